@@ -0,0 +1,130 @@
+"""
+Benchmark for merging and resolving heavily aliased nicks.
+
+Merges a user with hundreds of aliases into another, comparing the old
+per-alias re-pointing (one read and one write per alias) with the single
+bulk update used by ``add_alias``, then resolves nicks through alias
+chains of growing depth.  Reports storage round-trips and wall-clock time.
+
+Usage::
+
+    python benchmarks/aliases.py [repeat]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+import mock
+import mongomock
+
+from suite import CountingBackend
+
+
+def get_database():
+    client = mongomock.MongoClient()
+    client.drop_database('helga_karma_benchmark')
+    return client.helga_karma_benchmark
+
+
+def repoint_each(self, real_nick, nicks):
+    from helga_karma.data import alias_cache, backend
+
+    for link in backend.find_links_to(real_nick):
+        if link['nick'] in nicks:
+            link['real_nick'] = self['nick']
+            backend.replace_link(link)
+            alias_cache.invalidate(link['nick'])
+
+
+def add_aliases(backend, real_nick, count):
+    for idx in range(count):
+        nick = '%s_alias%d' % (real_nick, idx)
+        backend.insert_link({
+            'nick': nick,
+            'real_nick': real_nick,
+            'record': {'nick': nick, 'given': 0, 'received': 0, 'value': 0},
+            'aliases': [],
+        })
+
+
+def merge(KarmaRecord, backend, aliases):
+    backend.update_users([
+        ('main', {'$set': {'value': 10}}),
+        ('other', {'$set': {'value': 1}}),
+    ])
+    add_aliases(backend, 'other', aliases)
+    KarmaRecord.clear_caches()
+
+    main = KarmaRecord.get_for_nick('main')
+    other = KarmaRecord.get_for_nick('other')
+    backend.calls = 0
+    started = timeit.default_timer()
+    main.add_alias(other)
+    return timeit.default_timer() - started, backend.calls
+
+
+def main(repeat=5):
+    with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+        from helga_karma import data
+        from helga_karma.backends.mongo import MongoBackend
+        from helga_karma.data import KarmaRecord
+
+    for aliases in (10, 100, 500):
+        for name, repoint in (
+            ('per-alias', repoint_each),
+            ('bulk', KarmaRecord._repoint_aliases),
+        ):
+            elapsed = []
+            for _ in range(repeat):
+                backend = CountingBackend(MongoBackend(get_database()))
+                with mock.patch.object(data, 'backend', backend):
+                    with mock.patch.object(
+                        KarmaRecord, '_repoint_aliases', repoint,
+                    ):
+                        took, round_trips = merge(
+                            KarmaRecord, backend, aliases,
+                        )
+                        elapsed.append(took)
+            print(
+                'merge {aliases:>3} aliases {name:>9}: '
+                '{round_trips:>4} round-trips, {per:8.3f} msec'.format(
+                    aliases=aliases,
+                    name=name,
+                    round_trips=round_trips,
+                    per=min(elapsed) * 1e3,
+                )
+            )
+
+    for depth in (1, 2, 4, 8):
+        backend = CountingBackend(MongoBackend(get_database()))
+        nicks = []
+        for chain in range(100):
+            nick = 'user%d' % chain
+            for level in range(depth):
+                alias = '%s_%d' % (nick, level)
+                backend.insert_link({'nick': alias, 'real_nick': nick})
+                nick = alias
+            nicks.append(nick)
+
+        def resolve():
+            KarmaRecord.clear_caches()
+            KarmaRecord.get_actual_nicks(nicks)
+
+        with mock.patch.object(data, 'backend', backend):
+            backend.calls = 0
+            resolve()
+            round_trips = backend.calls
+            elapsed = min(timeit.repeat(resolve, number=repeat, repeat=3))
+        print(
+            'resolve 100 nicks {depth} deep: '
+            '{round_trips:>4} round-trips, {per:8.3f} msec'.format(
+                depth=depth,
+                round_trips=round_trips,
+                per=elapsed / repeat * 1e3,
+            )
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,112 @@
+"""
+Microbenchmark for automatic karma matching.
+
+Replays a corpus of chat messages (most of which contain no karma at all)
+through the precompiled matcher and through the previous implementation,
+which rebuilt its patterns on every message.
+
+Usage::
+
+    python benchmarks/autokarma.py [repeat]
+"""
+from __future__ import print_function
+
+import re
+import sys
+import timeit
+
+import mock
+import mongomock
+
+
+CORPUS = [
+    'morning all',
+    'has anyone looked at the failing build on master?',
+    'I think it is the new mongo driver',
+    'brb, coffee',
+    'can someone review https://github.com/shaunduncan/helga/pull/123',
+    'I love programming in C++',
+    'the deploy is going out in 5 minutes',
+    'lgtm, merging',
+    'thanks for the heads up',
+    'thanks helga',
+    'ty alfredodeza, that fixed it',
+    'nice work red++ ned++',
+    'helga++',
+    'anyone up for lunch?',
+    'the test suite takes forever on my laptop',
+    'i appreciate it',
+    'ok, rebasing now',
+    'thank you coddingtonbear!',
+    'that regex is horrifying',
+    'ping',
+]
+
+
+def _legacy_match(message):
+    from helga import settings
+    from helga_karma.plugin import (
+        _DEFAULT_INVALID_WORDS,
+        _DEFAULT_THANKS_WORDS,
+        VALID_NICK_PAT,
+    )
+
+    invalid_thanks = getattr(settings,
+                             'KARMA_INVALID_THANKS',
+                             _DEFAULT_INVALID_WORDS)
+    thanks_words = getattr(settings,
+                           'KARMA_THANKS_WORDS',
+                           _DEFAULT_THANKS_WORDS)
+
+    skip_pattern = r'^({thanks})\s+({invalid}).*$'.format(
+        thanks='|'.join(thanks_words),
+        invalid='|'.join(invalid_thanks),
+    )
+    if re.findall(skip_pattern, message, re.IGNORECASE):
+        return None
+
+    pattern = r'^(?:{thanks})[^\w]+({nick}).*$'.format(
+        thanks='|'.join(thanks_words),
+        nick=VALID_NICK_PAT
+    )
+    pp_pattern = r'(?:\w*\s+)*((?![cC]\+\+){nick}\+\+),?(?:\s+|$)'.format(
+        nick=VALID_NICK_PAT
+    )
+    return (
+        re.findall(pattern, message, re.IGNORECASE)
+        or re.findall(pp_pattern, message)
+    )
+
+
+def _replay(matcher):
+    for message in CORPUS:
+        matcher(message)
+
+
+def main(repeat=2000):
+    with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+        from helga_karma.plugin import _autokarma_match
+
+    for message in CORPUS:
+        assert _autokarma_match(message) == _legacy_match(message), message
+
+    messages = len(CORPUS) * repeat
+    for name, matcher in (
+        ('legacy', _legacy_match),
+        ('precompiled', _autokarma_match),
+    ):
+        elapsed = min(
+            timeit.repeat(lambda: _replay(matcher), number=repeat, repeat=3)
+        )
+        print(
+            '{name:>12}: {rate:12.0f} msgs/sec '
+            '({per:.2f} usec/msg)'.format(
+                name=name,
+                rate=messages / elapsed,
+                per=elapsed / messages * 1e6,
+            )
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
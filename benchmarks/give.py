@@ -0,0 +1,81 @@
+"""
+Benchmark for giving karma to several recipients at once.
+
+Compares the per-recipient path (``get_for_nick`` and ``give_karma_to``
+for every recipient) with the bulk path used by ``plugin.give``, reporting
+storage round-trips and wall-clock time for growing recipient lists.
+
+Usage::
+
+    python benchmarks/give.py [repeat]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+import mock
+import mongomock
+
+
+class CountingBackend(object):
+    """
+    Wraps a storage backend, counting every call made to it.
+    """
+    def __init__(self, backend):
+        self._backend = backend
+        self.calls = 0
+
+    def __getattr__(self, name):
+        method = getattr(self._backend, name)
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return method(*args, **kwargs)
+        return counted
+
+
+def give_each(KarmaRecord, from_nick, to_nicks):
+    from_record = KarmaRecord.get_for_nick(from_nick)
+    for to_nick in to_nicks:
+        from_record.give_karma_to(KarmaRecord.get_for_nick(to_nick))
+
+
+def give_bulk(KarmaRecord, from_nick, to_nicks):
+    records = KarmaRecord.get_for_nicks([from_nick] + to_nicks)
+    records[0].give_karma_to_many(records[1:])
+
+
+def main(repeat=200):
+    with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+        from helga_karma import data
+        from helga_karma.data import KarmaRecord
+
+    counting_db = CountingBackend(data.backend)
+    with mock.patch.object(data, 'backend', counting_db):
+        for recipients in (1, 4, 16, 64):
+            to_nicks = ['nick%d' % idx for idx in range(recipients)]
+            for name, fn in (('per-recipient', give_each), ('bulk', give_bulk)):
+                counting_db.calls = 0
+                fn(KarmaRecord, 'giver', to_nicks)
+                round_trips = counting_db.calls
+
+                elapsed = min(timeit.repeat(
+                    lambda: fn(KarmaRecord, 'giver', to_nicks),
+                    number=repeat,
+                    repeat=3,
+                ))
+                print(
+                    '{recipients:>3} recipients {name:>14}: '
+                    '{round_trips:>4} round-trips, '
+                    '{per:8.3f} msec/give'.format(
+                        recipients=recipients,
+                        name=name,
+                        round_trips=round_trips,
+                        per=elapsed / repeat * 1e3,
+                    )
+                )
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,102 @@
+"""
+Benchmark lookup latency on the karma collections with and without indexes.
+
+Needs a running mongod (mongomock does not use indexes); the benchmark
+works in its own scratch database, which is dropped afterwards.
+
+Usage::
+
+    MONGODB_URI=mongodb://localhost:27017 python benchmarks/indexes.py [users]
+"""
+from __future__ import print_function
+
+import os
+import random
+import sys
+import timeit
+
+import mock
+import mongomock
+import pymongo
+
+
+DATABASE = 'helga_karma_benchmark'
+
+
+def populate(database, users):
+    batch = []
+    for idx in range(users):
+        batch.append({
+            'nick': 'user%d' % idx,
+            'given': random.randint(0, 500),
+            'received': random.randint(0, 500),
+            'value': random.random() * 1000,
+        })
+        if len(batch) == 10000:
+            database.karma_user.insert_many(batch)
+            batch = []
+    if batch:
+        database.karma_user.insert_many(batch)
+
+    database.karma_link.insert_many([
+        {'nick': 'user%d_away' % idx, 'real_nick': 'user%d' % idx}
+        for idx in range(0, users, 10)
+    ])
+
+
+def measure(database, users, number):
+    nicks = ['user%d' % random.randrange(users) for _ in range(number)]
+    lookups = [
+        ('karma_user.nick', lambda nick: database.karma_user.find_one(
+            {'nick': nick}
+        )),
+        ('karma_link.nick', lambda nick: database.karma_link.find_one(
+            {'nick': nick + '_away'}
+        )),
+        ('karma_link.real_nick', lambda nick: list(database.karma_link.find(
+            {'real_nick': nick}
+        ))),
+        ('top 10', lambda nick: list(
+            database.karma_user.find()
+            .sort('value', pymongo.DESCENDING)
+            .limit(10)
+        )),
+    ]
+    results = {}
+    for name, lookup in lookups:
+        elapsed = timeit.timeit(
+            lambda: [lookup(nick) for nick in nicks],
+            number=1,
+        )
+        results[name] = elapsed / number * 1e3
+    return results
+
+
+def main(users=300000, number=200):
+    with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+        from helga_karma.indexes import ensure_indexes
+
+    client = pymongo.MongoClient(
+        os.environ.get('MONGODB_URI', 'mongodb://localhost:27017')
+    )
+    client.drop_database(DATABASE)
+    database = client[DATABASE]
+    try:
+        populate(database, users)
+        without = measure(database, users, number)
+        ensure_indexes(database)
+        with_indexes = measure(database, users, number)
+    finally:
+        client.drop_database(DATABASE)
+
+    print('{} users, {} lookups each (msec/lookup)'.format(users, number))
+    for name in sorted(without):
+        print('{name:>22}: {without:10.3f} -> {indexed:10.3f}'.format(
+            name=name,
+            without=without[name],
+            indexed=with_indexes[name],
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
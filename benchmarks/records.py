@@ -0,0 +1,128 @@
+"""
+Benchmark for loading many karma records.
+
+Builds records around 100k stored documents, as the leaderboard and
+exports do, comparing a plain dict copy of each document (merged over an
+empty record, as ``get_for_nick`` used to) with ``KarmaRecord`` reading
+the document in place and with ``KarmaRecord`` once its fields have been
+unpacked into slots.  Reports the memory held by the records on top of
+the documents themselves (on Pythons with ``tracemalloc``) and how long
+building and reading them takes.
+
+Usage::
+
+    python benchmarks/records.py [count]
+"""
+from __future__ import print_function
+
+import datetime
+import gc
+import sys
+import timeit
+
+import mock
+import mongomock
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def get_documents(count):
+    now = datetime.datetime.utcnow()
+    return [
+        {
+            '_id': idx,
+            'nick': 'user%d' % idx,
+            'given': idx % 50,
+            'received': idx % 70,
+            'value': idx * 0.5,
+            'created': now,
+            'last_given': now,
+            'last_received': now,
+        }
+        for idx in range(count)
+    ]
+
+
+def build_dicts(KarmaRecord, documents):
+    records = []
+    for document in documents:
+        record = KarmaRecord.get_empty_record(document['nick'])
+        record.update(document)
+        records.append(record)
+    return records
+
+
+def build_packed(KarmaRecord, documents):
+    return [KarmaRecord(document) for document in documents]
+
+
+def build_unpacked(KarmaRecord, documents):
+    records = build_packed(KarmaRecord, documents)
+    for record in records:
+        record['value'] = record['value']
+    return records
+
+
+def to_document(record):
+    if isinstance(record, dict):
+        return dict(record)
+    return record.to_document()
+
+
+def read(records):
+    return sum(record['value'] for record in records)
+
+
+def measure_memory(build):
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    records = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return size
+
+
+def main(count=100000):
+    with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+        from helga_karma.data import KarmaRecord
+
+    documents = get_documents(count)
+    for name, build in (
+        ('dict copies', build_dicts),
+        ('lazy records', build_packed),
+        ('unpacked records', build_unpacked),
+    ):
+        memory = measure_memory(lambda: build(KarmaRecord, documents))
+        elapsed = min(timeit.repeat(
+            lambda: read(build(KarmaRecord, documents)),
+            number=1,
+            repeat=3,
+        ))
+        records = build(KarmaRecord, documents)
+        convert = min(timeit.repeat(
+            lambda: [to_document(record) for record in records],
+            number=1,
+            repeat=3,
+        ))
+        print(
+            '{name:>16}: {memory} {build:8.1f} msec to build and read, '
+            '{convert:8.1f} msec to convert back'.format(
+                name=name,
+                memory=(
+                    '{:6.1f} bytes/record,'.format(float(memory) / count)
+                    if memory is not None else ''
+                ),
+                build=elapsed * 1e3,
+                convert=convert * 1e3,
+            )
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
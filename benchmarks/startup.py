@@ -0,0 +1,70 @@
+"""
+Benchmark for the cost of loading the karma plugin.
+
+Times importing ``helga_karma.plugin``, as helga does at startup, against
+also loading the data layer (which the plugin defers until karma is first
+used), each in a fresh interpreter, and reports which heavy modules each
+import pulled in.
+
+Usage::
+
+    python benchmarks/startup.py [repeat]
+"""
+from __future__ import print_function
+
+import json
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = '''
+import json, sys, time
+started = time.time()
+import helga_karma.plugin
+{extra}
+elapsed = time.time() - started
+print(json.dumps({{
+    'elapsed': elapsed,
+    'pymongo': 'pymongo' in sys.modules,
+    'data': 'helga_karma.data' in sys.modules,
+}}))
+'''
+
+CASES = (
+    ('plugin only', ''),
+    ('plugin and data', 'helga_karma.plugin.data.load()'),
+)
+
+
+def time_import(extra):
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [path for path in [environment.get('PYTHONPATH')] if path]
+    )
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT.format(extra=extra)],
+        env=environment,
+    )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(repeat=5):
+    for name, extra in CASES:
+        results = [time_import(extra) for _ in range(repeat)]
+        print(
+            '{name:>16}: {best:8.1f} msec (best of {repeat}), '
+            'pymongo {pymongo}, data layer {data}'.format(
+                name=name,
+                best=min(result['elapsed'] for result in results) * 1e3,
+                repeat=repeat,
+                pymongo='loaded' if results[0]['pymongo'] else 'not loaded',
+                data='loaded' if results[0]['data'] else 'not loaded',
+            )
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
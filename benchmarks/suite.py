@@ -0,0 +1,264 @@
+"""
+Benchmark suite for the karma plugin's hot paths.
+
+Times autokarma matching, give, info (plain, detailed and scaled), top,
+alias and unalias against a synthetic population on each available
+storage option, reporting ops/sec, p50/p99 latency and storage round-trips
+per operation.  Results can be saved as JSON to compare versions.
+
+Usage::
+
+    python benchmarks/suite.py --users 10000 --links 1000 \\
+        --output results.json
+
+A local mongod is used as well when one answers at ``--mongodb-uri``.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+import mock
+import mongomock
+import pymongo
+from pymongo.errors import PyMongoError
+
+from autokarma import CORPUS
+
+
+BENCHMARK_DATABASE = 'helga_karma_benchmark'
+
+
+class CountingBackend(object):
+    """
+    Wraps a storage backend, counting calls made to it.
+    """
+    def __init__(self, backend):
+        self._backend = backend
+        self.calls = 0
+
+    def __getattr__(self, name):
+        method = getattr(self._backend, name)
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return method(*args, **kwargs)
+        return counted
+
+
+def get_storages(mongodb_uri, names):
+    from helga_karma.backends import MemoryBackend, SQLiteBackend
+    from helga_karma.backends.mongo import MongoBackend
+
+    if 'mongomock' in names:
+        yield 'mongomock', MongoBackend(
+            mongomock.MongoClient()[BENCHMARK_DATABASE]
+        )
+
+    if 'mongod' in names:
+        client = pymongo.MongoClient(
+            mongodb_uri,
+            serverSelectionTimeoutMS=500,
+        )
+        try:
+            client.admin.command('ping')
+        except PyMongoError:
+            print('No mongod at {}; skipping'.format(mongodb_uri))
+        else:
+            client.drop_database(BENCHMARK_DATABASE)
+            try:
+                yield 'mongod', MongoBackend(client[BENCHMARK_DATABASE])
+            finally:
+                client.drop_database(BENCHMARK_DATABASE)
+
+    if 'sqlite' in names:
+        directory = tempfile.mkdtemp()
+        try:
+            yield 'sqlite', SQLiteBackend(
+                os.path.join(directory, 'karma.sqlite')
+            )
+        finally:
+            shutil.rmtree(directory)
+
+    if 'memory' in names:
+        yield 'memory', MemoryBackend()
+
+
+def populate(backend, users, links):
+    batch = []
+    for idx in range(users):
+        batch.append(('user%d' % idx, {
+            '$set': {
+                'given': random.randint(0, 500),
+                'received': random.randint(0, 500),
+                'value': random.random() * 1000,
+                'last_given': None,
+                'last_received': None,
+            },
+        }))
+        if len(batch) == 1000:
+            backend.update_users(batch)
+            batch = []
+    backend.update_users(batch)
+    backend.ensure_indexes()
+
+    for idx in range(links):
+        backend.insert_link({
+            'nick': 'user%d_away' % idx,
+            'real_nick': 'user%d' % idx,
+            'record': {
+                'nick': 'user%d_away' % idx,
+                'given': 0,
+                'received': 0,
+                'value': 0,
+            },
+            'aliases': [],
+        })
+
+
+def get_operations(plugin, settings, users, links):
+    def random_nick():
+        idx = random.randrange(users)
+        if idx < links and random.random() < 0.5:
+            return 'user%d_away' % idx
+        return 'user%d' % idx
+
+    def info_scaled(idx):
+        with mock.patch.object(
+            settings, 'KARMA_SCALED_RANGE', (1, 5), create=True,
+        ):
+            plugin.info('benchmark', random_nick())
+
+    return [
+        ('match', lambda idx: plugin._autokarma_match(
+            CORPUS[idx % len(CORPUS)]
+        )),
+        ('give', lambda idx: plugin.give(
+            random_nick(), [random_nick(), random_nick()],
+        )),
+        ('info', lambda idx: plugin.info('benchmark', random_nick())),
+        ('info_detailed', lambda idx: plugin.info(
+            'benchmark', random_nick(), detailed=True,
+        )),
+        ('info_scaled', info_scaled),
+        ('top', lambda idx: plugin.top(10)),
+        # Links user<idx> with a fresh nick, which unalias then undoes
+        ('alias', lambda idx: plugin.alias(
+            'benchmark', 'user%d' % idx, 'fresh%d' % idx,
+        )),
+        ('unalias', lambda idx: plugin.unalias(
+            'benchmark', 'user%d' % idx, 'fresh%d' % idx,
+        )),
+    ]
+
+
+def measure(operation, counter, iterations, clear_caches):
+    latencies = []
+    counter.calls = 0
+    for idx in range(iterations):
+        clear_caches()
+        started = timeit.default_timer()
+        operation(idx)
+        latencies.append(timeit.default_timer() - started)
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'ops_per_sec': iterations / total if total else None,
+        'p50_ms': latencies[int(len(latencies) * 0.50)] * 1e3,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1e3,
+        'round_trips': float(counter.calls) / iterations,
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--links', type=int, default=1000)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument(
+        '--storage',
+        action='append',
+        choices=['mongomock', 'mongod', 'sqlite', 'memory'],
+        help='Storage to benchmark (repeatable; default: all of them)',
+    )
+    parser.add_argument(
+        '--mongodb-uri',
+        default=os.environ.get('MONGODB_URI', 'mongodb://localhost:27017'),
+    )
+    parser.add_argument(
+        '--cold',
+        action='store_true',
+        help='Clear the in-process caches before every operation',
+    )
+    parser.add_argument('--output', help='Save results to this JSON file')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    storages = args.storage or ['mongomock', 'mongod', 'sqlite', 'memory']
+
+    with mock.patch('pymongo.MongoClient', mongomock.MongoClient):
+        from helga import settings
+        from helga_karma import __version__, data, plugin
+
+    KarmaRecord = data.KarmaRecord
+    clear_caches = KarmaRecord.clear_caches if args.cold else lambda: None
+    iterations = min(args.iterations, args.users)
+
+    results = {}
+    for name, backend in get_storages(args.mongodb_uri, storages):
+        populate(backend, args.users, args.links)
+        counter = CountingBackend(backend)
+        KarmaRecord.clear_caches()
+        with mock.patch.object(data, 'backend', counter):
+            results[name] = dict(
+                (operation_name, measure(
+                    operation, counter, iterations, clear_caches,
+                ))
+                for operation_name, operation in get_operations(
+                    plugin, settings, args.users, args.links,
+                )
+            )
+        KarmaRecord.clear_caches()
+
+        print('{} ({} users, {} links)'.format(name, args.users, args.links))
+        for operation_name, _ in get_operations(plugin, settings, 1, 0):
+            result = results[name][operation_name]
+            print(
+                '  {name:>14}: {ops_per_sec:10.0f} ops/sec  '
+                'p50 {p50_ms:7.3f}ms  p99 {p99_ms:7.3f}ms  '
+                '{round_trips:5.2f} round-trips'.format(
+                    name=operation_name,
+                    **result
+                )
+            )
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(
+                {
+                    'version': __version__,
+                    'python': platform.python_version(),
+                    'users': args.users,
+                    'links': args.links,
+                    'iterations': iterations,
+                    'cold': args.cold,
+                    'results': results,
+                },
+                out,
+                indent=2,
+                sort_keys=True,
+            )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
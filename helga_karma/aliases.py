@@ -0,0 +1,54 @@
+from helga import log
+
+
+logger = log.getLogger(__name__)
+
+
+def resolve_nicks(backend, nicks, max_depth=16):
+    """
+    Follow the karma_link documents of `nicks` to the nicks that own
+    their karma, returning a dict mapping each nick to its owner.
+
+    Links normally point straight at the owning nick, but chains can be
+    left behind by older versions or by merges racing each other, so
+    links are followed one level at a time, with one `find_links` query
+    per level for the whole batch.  A chain that loops back on itself
+    resolves to the smallest nick in the loop, so that every nick in it
+    resolves the same way; one longer than `max_depth` resolves to
+    wherever it had got to.
+    """
+    chains = dict((nick, [nick]) for nick in nicks)
+    links = {}
+    unresolved = set(chains)
+
+    for _ in range(max_depth):
+        heads = set(chains[nick][-1] for nick in unresolved) - set(links)
+        if heads:
+            for link in backend.find_links(heads):
+                links[link['nick']] = link['real_nick']
+
+        for nick in list(unresolved):
+            chain = chains[nick]
+            real_nick = links.get(chain[-1])
+            if real_nick is None:
+                unresolved.discard(nick)
+            elif real_nick in chain:
+                loop = chain[chain.index(real_nick):]
+                logger.warning(
+                    'Karma aliases form a loop: %s', ' -> '.join(loop),
+                )
+                chain.append(min(loop))
+                unresolved.discard(nick)
+            else:
+                chain.append(real_nick)
+
+        if not unresolved:
+            break
+    else:
+        logger.warning(
+            'Karma aliases nested more than %s deep: %s',
+            max_depth,
+            ', '.join(sorted(unresolved)),
+        )
+
+    return dict((nick, chain[-1]) for nick, chain in chains.items())
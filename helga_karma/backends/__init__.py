@@ -0,0 +1,32 @@
+from helga import settings
+
+from .base import KarmaBackend
+from .memory import MemoryBackend
+from .sqlite import SQLiteBackend
+
+
+__all__ = [
+    'KarmaBackend',
+    'MemoryBackend',
+    'SQLiteBackend',
+    'get_backend',
+]
+
+
+def get_backend(name=None):
+    """
+    Create the storage backend named by `name`, or by the `KARMA_BACKEND`
+    setting: ``mongo`` (the default), ``sqlite`` or ``memory``.
+    """
+    name = name or getattr(settings, 'KARMA_BACKEND', 'mongo')
+    if name == 'mongo':
+        # Imported here so that other backends never connect to mongo
+        from .mongo import MongoBackend
+        return MongoBackend()
+    if name == 'sqlite':
+        return SQLiteBackend(
+            getattr(settings, 'KARMA_SQLITE_PATH', 'helga_karma.sqlite')
+        )
+    if name == 'memory':
+        return MemoryBackend()
+    raise ValueError('Unknown karma backend {!r}'.format(name))
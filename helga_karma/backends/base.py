@@ -0,0 +1,176 @@
+class KarmaBackend(object):
+    """
+    Storage for karma users (``karma_user``), for the links between
+    aliased nicks (``karma_link``) and for the log of karma events
+    (``karma_event``) with the snapshots it is replayed from.  Karma
+    received is also counted in hourly and daily buckets
+    (``karma_bucket``; see `helga_karma.windows`).
+
+    Users are updated with mongo-style update documents made up of
+    ``$inc``, ``$set``, ``$max`` and ``$setOnInsert`` operations; see
+    `helga_karma.updates`.  Documents handed out by a backend belong to
+    the caller, who may modify them freely.
+
+    A backend works with the karma of one namespace: that of its
+    `channel`, or the global namespace when `channel` is None.
+    """
+    channel = None
+
+    def scoped(self, channel):
+        """
+        Get a backend for `channel`'s namespace sharing this one's storage.
+        """
+        raise NotImplementedError()
+
+    def find_users(self, nicks):
+        """
+        Get the stored user documents for `nicks`; nicks without a
+        document are left out.
+        """
+        raise NotImplementedError()
+
+    def get_top_users(self, limit):
+        """
+        Get up to `limit` user documents, highest value first.
+        """
+        raise NotImplementedError()
+
+    def update_users(self, updates):
+        """
+        Upsert a list of ``(nick, update)`` pairs, in order.
+        """
+        raise NotImplementedError()
+
+    def save_user(self, record):
+        """
+        Replace the stored document for ``record['nick']`` with `record`.
+        """
+        raise NotImplementedError()
+
+    def save_users(self, records):
+        """
+        Store a batch of user documents, replacing any with the same nicks.
+        Backends should write the batch in a single operation; this
+        fallback saves them one by one.
+        """
+        for record in records:
+            self.save_user(record)
+
+    def remove_user(self, nick):
+        raise NotImplementedError()
+
+    def iter_users(self):
+        """
+        Iterate over every stored user document, without loading them all
+        into memory at once where the backend allows.
+        """
+        raise NotImplementedError()
+
+    def find_link(self, nick):
+        """
+        Get the link document for alias `nick`, or None.
+        """
+        raise NotImplementedError()
+
+    def find_links(self, nicks):
+        raise NotImplementedError()
+
+    def find_links_to(self, real_nick):
+        """
+        Get the link documents of every alias of `real_nick`.
+        """
+        raise NotImplementedError()
+
+    def insert_link(self, link):
+        raise NotImplementedError()
+
+    def replace_link(self, link):
+        raise NotImplementedError()
+
+    def save_links(self, links):
+        """
+        Store a batch of link documents, replacing any with the same nicks.
+        """
+        for link in links:
+            self.remove_link(link['nick'])
+            self.insert_link(link)
+
+    def remove_link(self, nick):
+        raise NotImplementedError()
+
+    def iter_links(self):
+        raise NotImplementedError()
+
+    def repoint_links(self, real_nick, new_real_nick, nicks=None):
+        """
+        Point every alias of `real_nick` (or only those in `nicks`) at
+        `new_real_nick`.  Backends should do this in a single operation;
+        this fallback rewrites the links one by one.
+        """
+        for link in self.find_links_to(real_nick):
+            if nicks is None or link['nick'] in nicks:
+                link['real_nick'] = new_real_nick
+                self.replace_link(link)
+
+    def insert_events(self, events):
+        """
+        Append a batch of event documents to the event log.
+        """
+        raise NotImplementedError()
+
+    def iter_events(self, since=None):
+        """
+        Iterate over the logged events with a `time` after `since` (all of
+        them, by default), oldest first.
+        """
+        raise NotImplementedError()
+
+    def save_snapshot(self, time, users):
+        """
+        Store the user documents `users` as the snapshot taken at `time`,
+        replacing the previous snapshot once they are all stored.
+        """
+        raise NotImplementedError()
+
+    def get_snapshot(self):
+        """
+        Get the time of the latest snapshot and an iterator over its user
+        documents, or ``(None, [])`` if no snapshot has been taken.
+        """
+        raise NotImplementedError()
+
+    def update_buckets(self, increments):
+        """
+        Add the `value` and `received` of each increment to the bucket
+        with its `nick`, `granularity` and `start`, creating the bucket if
+        needed.  Buckets are removed some time after their `expires`.
+        """
+        raise NotImplementedError()
+
+    def get_bucket_top(self, granularity, since, limit):
+        """
+        Add up each nick's buckets of `granularity` starting at or after
+        `since`, and get up to `limit` of the sums as ``nick``, ``value``
+        and ``received`` documents, highest value first.
+        """
+        raise NotImplementedError()
+
+    def merge_buckets(self, nick, into):
+        """
+        Add every bucket of `nick` to the matching bucket of `into`, and
+        remove them.
+        """
+        raise NotImplementedError()
+
+    def ensure_indexes(self):
+        """
+        Create any missing indexes; returns ``(collection, name)`` pairs
+        for the indexes that were created.
+        """
+        return []
+
+    def check_indexes(self):
+        return {
+            'missing': [],
+            'unused': None,
+        }
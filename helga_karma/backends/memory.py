@@ -0,0 +1,217 @@
+import copy
+import datetime
+import heapq
+import threading
+
+from ..updates import apply_upsert
+from .base import KarmaBackend
+
+
+class MemoryBackend(KarmaBackend):
+    """
+    Keeps karma in process memory; nothing survives a restart.  Useful for
+    small deployments that do not need persistence, and for tests.
+
+    Each channel's namespace is a backend of its own, found through the
+    `scopes` all of them share.
+    """
+    def __init__(self, channel=None, scopes=None):
+        self.channel = channel
+        self._scopes = scopes if scopes is not None else {channel: self}
+        self._users = {}
+        self._links = {}
+        self._events = []
+        self._snapshot = (None, [])
+        self._buckets = {}
+        self._next_expiry = None
+        self._lock = threading.Lock()
+
+    def scoped(self, channel):
+        backend = self._scopes.get(channel)
+        if backend is None:
+            backend = self._scopes.setdefault(
+                channel,
+                MemoryBackend(channel, self._scopes),
+            )
+        return backend
+
+    def find_users(self, nicks):
+        with self._lock:
+            return [
+                dict(self._users[nick])
+                for nick in set(nicks) if nick in self._users
+            ]
+
+    def get_top_users(self, limit):
+        with self._lock:
+            return [
+                dict(user) for user in heapq.nlargest(
+                    limit,
+                    self._users.values(),
+                    key=lambda user: user.get('value', 0),
+                )
+            ]
+
+    def update_users(self, updates):
+        with self._lock:
+            for nick, update in updates:
+                self._users[nick] = apply_upsert(
+                    self._users.get(nick), nick, update,
+                )
+
+    def save_user(self, record):
+        with self._lock:
+            self._users[record['nick']] = dict(record)
+
+    def save_users(self, records):
+        with self._lock:
+            for record in records:
+                self._users[record['nick']] = dict(record)
+
+    def remove_user(self, nick):
+        with self._lock:
+            self._users.pop(nick, None)
+
+    def iter_users(self):
+        with self._lock:
+            users = [dict(user) for user in self._users.values()]
+        return iter(users)
+
+    def find_link(self, nick):
+        with self._lock:
+            return copy.deepcopy(self._links.get(nick))
+
+    def find_links(self, nicks):
+        with self._lock:
+            return [
+                copy.deepcopy(self._links[nick])
+                for nick in set(nicks) if nick in self._links
+            ]
+
+    def find_links_to(self, real_nick):
+        with self._lock:
+            return [
+                copy.deepcopy(link) for link in self._links.values()
+                if link['real_nick'] == real_nick
+            ]
+
+    def insert_link(self, link):
+        with self._lock:
+            self._links[link['nick']] = copy.deepcopy(link)
+
+    def save_links(self, links):
+        with self._lock:
+            for link in links:
+                self._links[link['nick']] = copy.deepcopy(link)
+
+    def replace_link(self, link):
+        with self._lock:
+            if link['nick'] in self._links:
+                self._links[link['nick']] = copy.deepcopy(link)
+
+    def remove_link(self, nick):
+        with self._lock:
+            self._links.pop(nick, None)
+
+    def iter_links(self):
+        with self._lock:
+            links = copy.deepcopy(list(self._links.values()))
+        return iter(links)
+
+    def repoint_links(self, real_nick, new_real_nick, nicks=None):
+        with self._lock:
+            for link in self._links.values():
+                if link['real_nick'] != real_nick:
+                    continue
+                if nicks is None or link['nick'] in nicks:
+                    link['real_nick'] = new_real_nick
+
+    def insert_events(self, events):
+        with self._lock:
+            self._events.extend(copy.deepcopy(events))
+
+    def iter_events(self, since=None):
+        with self._lock:
+            events = [
+                copy.deepcopy(event) for event in self._events
+                if since is None or event['time'] > since
+            ]
+        return iter(sorted(events, key=lambda event: event['time']))
+
+    def save_snapshot(self, time, users):
+        users = [dict(user) for user in users]
+        with self._lock:
+            self._snapshot = (time, users)
+
+    def get_snapshot(self):
+        with self._lock:
+            time, users = self._snapshot
+            return time, iter([dict(user) for user in users])
+
+    def update_buckets(self, increments):
+        with self._lock:
+            self._update_buckets(increments)
+
+    def _update_buckets(self, increments):
+        now = datetime.datetime.utcnow()
+        if self._next_expiry is not None and self._next_expiry <= now:
+            for key, bucket in list(self._buckets.items()):
+                if bucket['expires'] <= now:
+                    del self._buckets[key]
+            self._next_expiry = min(
+                [bucket['expires'] for bucket in self._buckets.values()]
+                or [None]
+            )
+
+        for increment in increments:
+            key = (
+                increment['nick'],
+                increment['granularity'],
+                increment['start'],
+            )
+            bucket = self._buckets.setdefault(key, {
+                'nick': increment['nick'],
+                'granularity': increment['granularity'],
+                'start': increment['start'],
+                'expires': increment['expires'],
+                'value': 0,
+                'received': 0,
+            })
+            bucket['value'] += increment['value']
+            bucket['received'] += increment['received']
+            if self._next_expiry is None:
+                self._next_expiry = bucket['expires']
+            else:
+                self._next_expiry = min(self._next_expiry, bucket['expires'])
+
+    def get_bucket_top(self, granularity, since, limit):
+        totals = {}
+        with self._lock:
+            for bucket in self._buckets.values():
+                if (
+                    bucket['granularity'] != granularity
+                    or bucket['start'] < since
+                ):
+                    continue
+                total = totals.setdefault(bucket['nick'], {
+                    'nick': bucket['nick'],
+                    'value': 0,
+                    'received': 0,
+                })
+                total['value'] += bucket['value']
+                total['received'] += bucket['received']
+        return heapq.nsmallest(
+            limit,
+            totals.values(),
+            key=lambda total: (-total['value'], total['nick']),
+        )
+
+    def merge_buckets(self, nick, into):
+        with self._lock:
+            buckets = [
+                self._buckets.pop(key) for key in list(self._buckets)
+                if key[0] == nick
+            ]
+            for bucket in buckets:
+                bucket['nick'] = into
+            self._update_buckets(buckets)
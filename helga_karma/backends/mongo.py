@@ -0,0 +1,276 @@
+import copy
+
+import pymongo
+
+from .base import KarmaBackend
+
+
+# Documents are handed out without the channel they are stored under
+_HIDDEN = {'channel': False}
+
+
+class MongoBackend(KarmaBackend):
+    """
+    Stores karma in helga's own MongoDB database.
+
+    Every document is stored with the `channel` of the namespace it
+    belongs to; documents without one (as stored before channels had
+    namespaces) belong to the global namespace.
+    """
+    def __init__(self, database=None, channel=None):
+        if database is None:
+            from helga.db import db as database
+        self.db = database
+        self.channel = channel
+
+    def scoped(self, channel):
+        backend = copy.copy(self)
+        backend.channel = channel
+        return backend
+
+    def _query(self, query=None):
+        # A query matching only this namespace's documents; for the
+        # global namespace, `None` also matches a missing channel
+        query = dict(query or {})
+        query['channel'] = self.channel
+        return query
+
+    def _document(self, document):
+        document = dict(document)
+        if self.channel is not None:
+            document['channel'] = self.channel
+        return document
+
+    def find_users(self, nicks):
+        return list(self.db.karma_user.find(
+            self._query({'nick': {'$in': list(nicks)}}),
+            _HIDDEN,
+        ))
+
+    def get_top_users(self, limit):
+        return list(
+            self.db.karma_user.find(self._query(), _HIDDEN)
+            .sort('value', direction=pymongo.DESCENDING)
+            .limit(limit)
+        )
+
+    def update_users(self, updates):
+        if not updates:
+            return
+        self.db.karma_user.bulk_write(
+            [
+                pymongo.UpdateOne(
+                    self._query({'nick': nick}),
+                    update,
+                    upsert=True,
+                )
+                for nick, update in updates
+            ],
+            ordered=True,
+        )
+
+    def save_user(self, record):
+        self.db.karma_user.update(
+            self._query({'nick': record['nick']}),
+            self._document(record),
+            upsert=True,
+        )
+
+    def save_users(self, records):
+        self._save_many(self.db.karma_user, records)
+
+    def _save_many(self, collection, documents):
+        if not documents:
+            return
+        collection.bulk_write(
+            [
+                pymongo.ReplaceOne(
+                    self._query({'nick': document['nick']}),
+                    self._document(document),
+                    upsert=True,
+                )
+                for document in documents
+            ],
+            ordered=False,
+        )
+
+    def remove_user(self, nick):
+        self.db.karma_user.remove(self._query({'nick': nick}))
+
+    def iter_users(self):
+        return self.db.karma_user.find(self._query(), _HIDDEN)
+
+    def find_link(self, nick):
+        return self.db.karma_link.find_one(
+            self._query({'nick': nick}),
+            _HIDDEN,
+        )
+
+    def find_links(self, nicks):
+        return list(self.db.karma_link.find(
+            self._query({'nick': {'$in': list(nicks)}}),
+            _HIDDEN,
+        ))
+
+    def find_links_to(self, real_nick):
+        return list(self.db.karma_link.find(
+            self._query({'real_nick': real_nick}),
+            _HIDDEN,
+        ))
+
+    def insert_link(self, link):
+        self.db.karma_link.insert(self._document(link))
+
+    def replace_link(self, link):
+        self.db.karma_link.update(
+            self._query({'nick': link['nick']}),
+            self._document(link),
+        )
+
+    def save_links(self, links):
+        self._save_many(self.db.karma_link, links)
+
+    def remove_link(self, nick):
+        self.db.karma_link.remove(self._query({'nick': nick}))
+
+    def iter_links(self):
+        return self.db.karma_link.find(self._query(), _HIDDEN)
+
+    def repoint_links(self, real_nick, new_real_nick, nicks=None):
+        query = self._query({'real_nick': real_nick})
+        if nicks is not None:
+            query['nick'] = {'$in': list(nicks)}
+        self.db.karma_link.update_many(
+            query,
+            {'$set': {'real_nick': new_real_nick}},
+        )
+
+    def insert_events(self, events):
+        if not events:
+            return
+        # insert_many adds an _id to the documents it is given
+        self.db.karma_event.insert_many(
+            [self._document(event) for event in events],
+            ordered=False,
+        )
+
+    def iter_events(self, since=None):
+        query = self._query()
+        if since is not None:
+            query['time'] = {'$gt': since}
+        # Events logged in the same millisecond keep the order they were
+        # inserted in
+        return self.db.karma_event.find(
+            query,
+            {'_id': False, 'channel': False},
+        ).sort([
+            ('time', pymongo.ASCENDING),
+            ('_id', pymongo.ASCENDING),
+        ])
+
+    def _get_snapshot_id(self):
+        if self.channel is None:
+            return 'latest'
+        return 'latest:{}'.format(self.channel)
+
+    def save_snapshot(self, time, users, batch_size=1000):
+        # Users are stored tagged with the snapshot's time, and the
+        # pointer to the latest snapshot only moves once they all are
+        batch = []
+        for user in users:
+            user = self._document(user)
+            user.pop('_id', None)
+            user['snapshot'] = time
+            batch.append(user)
+            if len(batch) >= batch_size:
+                self.db.karma_snapshot.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            self.db.karma_snapshot.insert_many(batch, ordered=False)
+
+        snapshot_id = self._get_snapshot_id()
+        self.db.karma_snapshot.replace_one(
+            {'_id': snapshot_id},
+            {'_id': snapshot_id, 'time': time},
+            upsert=True,
+        )
+        self.db.karma_snapshot.delete_many(
+            self._query({'snapshot': {'$lt': time}})
+        )
+
+    def get_snapshot(self):
+        latest = self.db.karma_snapshot.find_one(
+            {'_id': self._get_snapshot_id()}
+        )
+        if latest is None:
+            return None, []
+        return latest['time'], self.db.karma_snapshot.find(
+            self._query({'snapshot': latest['time']}),
+            {'_id': False, 'snapshot': False, 'channel': False},
+        )
+
+    def update_buckets(self, increments):
+        if not increments:
+            return
+        self.db.karma_bucket.bulk_write(
+            [
+                pymongo.UpdateOne(
+                    self._query({
+                        'nick': increment['nick'],
+                        'granularity': increment['granularity'],
+                        'start': increment['start'],
+                    }),
+                    {
+                        '$inc': {
+                            'value': increment['value'],
+                            'received': increment['received'],
+                        },
+                        # Removed by the TTL index on expires
+                        '$setOnInsert': {'expires': increment['expires']},
+                    },
+                    upsert=True,
+                )
+                for increment in increments
+            ],
+            ordered=True,
+        )
+
+    def get_bucket_top(self, granularity, since, limit):
+        return [
+            {
+                'nick': total['_id'],
+                'value': total['value'],
+                'received': total['received'],
+            }
+            for total in self.db.karma_bucket.aggregate([
+                {'$match': self._query({
+                    'granularity': granularity,
+                    'start': {'$gte': since},
+                })},
+                {'$group': {
+                    '_id': '$nick',
+                    'value': {'$sum': '$value'},
+                    'received': {'$sum': '$received'},
+                }},
+                {'$sort': {'value': pymongo.DESCENDING, '_id': 1}},
+                {'$limit': limit},
+            ])
+        ]
+
+    def merge_buckets(self, nick, into):
+        buckets = list(self.db.karma_bucket.find(
+            self._query({'nick': nick}),
+            _HIDDEN,
+        ))
+        for bucket in buckets:
+            bucket['nick'] = into
+        self.update_buckets(buckets)
+        self.db.karma_bucket.delete_many(self._query({'nick': nick}))
+
+    def ensure_indexes(self):
+        from ..indexes import ensure_indexes
+        return ensure_indexes(self.db)
+
+    def check_indexes(self):
+        from ..indexes import check_indexes
+        return check_indexes(self.db)
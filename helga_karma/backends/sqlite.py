@@ -0,0 +1,545 @@
+import copy
+import datetime
+import sqlite3
+import threading
+
+from ..documents import dumps as _dumps
+from ..documents import format_datetime as _format_datetime
+from ..documents import loads as _loads
+from ..documents import parse_datetime as _parse_datetime
+from ..updates import apply_upsert
+from .base import KarmaBackend
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS karma_user (
+    channel TEXT NOT NULL,
+    nick TEXT NOT NULL,
+    value REAL NOT NULL DEFAULT 0,
+    document TEXT NOT NULL,
+    PRIMARY KEY (channel, nick)
+);
+CREATE INDEX IF NOT EXISTS karma_user_value
+    ON karma_user (channel, value DESC);
+
+CREATE TABLE IF NOT EXISTS karma_link (
+    channel TEXT NOT NULL,
+    nick TEXT NOT NULL,
+    real_nick TEXT NOT NULL,
+    document TEXT NOT NULL,
+    PRIMARY KEY (channel, nick)
+);
+CREATE INDEX IF NOT EXISTS karma_link_real_nick
+    ON karma_link (channel, real_nick);
+
+CREATE TABLE IF NOT EXISTS karma_event (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    time TEXT NOT NULL,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS karma_event_time
+    ON karma_event (channel, time, id);
+
+CREATE TABLE IF NOT EXISTS karma_snapshot (
+    channel TEXT NOT NULL,
+    snapshot TEXT NOT NULL,
+    nick TEXT NOT NULL,
+    document TEXT NOT NULL,
+    PRIMARY KEY (channel, snapshot, nick)
+);
+
+CREATE TABLE IF NOT EXISTS karma_snapshot_latest (
+    channel TEXT PRIMARY KEY,
+    snapshot TEXT NOT NULL,
+    document TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS karma_bucket (
+    channel TEXT NOT NULL,
+    nick TEXT NOT NULL,
+    granularity TEXT NOT NULL,
+    start TEXT NOT NULL,
+    expires TEXT NOT NULL,
+    value REAL NOT NULL DEFAULT 0,
+    received INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (channel, nick, granularity, start)
+);
+CREATE INDEX IF NOT EXISTS karma_bucket_window
+    ON karma_bucket (channel, granularity, start);
+CREATE INDEX IF NOT EXISTS karma_bucket_expires ON karma_bucket (expires);
+'''
+
+# SQLite builds before 3.32 bind no more parameters than this per query
+MAX_VARIABLES = 999
+
+_INSERT_LINK = (
+    'INSERT OR REPLACE INTO karma_link (channel, nick, real_nick, document) '
+    'VALUES (?, ?, ?, ?)'
+)
+
+
+class SQLiteBackend(KarmaBackend):
+    """
+    Stores karma in a local SQLite database in WAL mode, so that karma can
+    be looked up while it is being written.
+
+    Each document is kept as JSON next to the columns it is looked up or
+    sorted by; updates read, modify and write a document inside a single
+    transaction.  Every row belongs to the namespace of its `channel`,
+    which is empty for the global namespace.
+    """
+    def __init__(self, path, channel=None):
+        self.path = path
+        self.channel = channel
+        self._channel = channel or ''
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        self._next_expiry = None
+
+    def scoped(self, channel):
+        backend = copy.copy(self)
+        backend.channel = channel
+        backend._channel = channel or ''
+        return backend
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def _in(self, nicks, fixed=1):
+        # Placeholders and parameters for `nicks`, in chunks small enough
+        # to be bound beside `fixed` other parameters
+        nicks = list(set(nicks))
+        size = MAX_VARIABLES - fixed
+        for start in range(0, len(nicks), size):
+            chunk = nicks[start:start + size]
+            yield ', '.join('?' for _ in chunk), chunk
+
+    def _find_in(self, table, nicks):
+        documents = []
+        for placeholders, chunk in self._in(nicks):
+            documents.extend(
+                _loads(row[0]) for row in self._query(
+                    'SELECT document FROM {} '
+                    'WHERE channel = ? AND nick IN ({})'.format(
+                        table,
+                        placeholders,
+                    ),
+                    [self._channel] + chunk,
+                )
+            )
+        return documents
+
+    def find_users(self, nicks):
+        return self._find_in('karma_user', nicks)
+
+    def get_top_users(self, limit):
+        return [
+            _loads(row[0]) for row in self._query(
+                'SELECT document FROM karma_user WHERE channel = ? '
+                'ORDER BY value DESC LIMIT ?',
+                (self._channel, limit),
+            )
+        ]
+
+    def update_users(self, updates):
+        if not updates:
+            return
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                for nick, update in updates:
+                    row = cursor.execute(
+                        'SELECT document FROM karma_user '
+                        'WHERE channel = ? AND nick = ?',
+                        (self._channel, nick),
+                    ).fetchone()
+                    record = apply_upsert(
+                        _loads(row[0]) if row else None, nick, update,
+                    )
+                    self._write_user(cursor, record)
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+    def _write_user(self, cursor, record):
+        cursor.execute(
+            'INSERT OR REPLACE INTO karma_user '
+            '(channel, nick, value, document) VALUES (?, ?, ?, ?)',
+            self._get_user_row(record),
+        )
+
+    def _get_user_row(self, record):
+        return (
+            self._channel,
+            record['nick'],
+            record.get('value', 0),
+            _dumps(record),
+        )
+
+    def save_user(self, record):
+        with self._lock:
+            self._write_user(self._connection.cursor(), record)
+
+    def save_users(self, records):
+        self._save_many(
+            'INSERT OR REPLACE INTO karma_user '
+            '(channel, nick, value, document) VALUES (?, ?, ?, ?)',
+            [self._get_user_row(record) for record in records],
+        )
+
+    def _save_many(self, sql, rows):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.executemany(sql, rows)
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+    def remove_user(self, nick):
+        self._query(
+            'DELETE FROM karma_user WHERE channel = ? AND nick = ?',
+            (self._channel, nick),
+        )
+
+    def _iter_table(self, table, batch_size=1000):
+        # Page through by primary key so that the lock is only held for
+        # one batch at a time
+        rows = self._query(
+            'SELECT nick, document FROM {} WHERE channel = ? '
+            'ORDER BY nick LIMIT ?'.format(table),
+            (self._channel, batch_size),
+        )
+        while True:
+            for _, document in rows:
+                yield _loads(document)
+            if len(rows) < batch_size:
+                return
+            rows = self._query(
+                'SELECT nick, document FROM {} '
+                'WHERE channel = ? AND nick > ? '
+                'ORDER BY nick LIMIT ?'.format(table),
+                (self._channel, rows[-1][0], batch_size),
+            )
+
+    def iter_users(self):
+        return self._iter_table('karma_user')
+
+    def find_link(self, nick):
+        rows = self._query(
+            'SELECT document FROM karma_link WHERE channel = ? AND nick = ?',
+            (self._channel, nick),
+        )
+        return _loads(rows[0][0]) if rows else None
+
+    def find_links(self, nicks):
+        return self._find_in('karma_link', nicks)
+
+    def find_links_to(self, real_nick):
+        return [
+            _loads(row[0]) for row in self._query(
+                'SELECT document FROM karma_link '
+                'WHERE channel = ? AND real_nick = ?',
+                (self._channel, real_nick),
+            )
+        ]
+
+    def insert_link(self, link):
+        self._query(_INSERT_LINK, self._get_link_row(link))
+
+    def save_links(self, links):
+        self._save_many(
+            _INSERT_LINK,
+            [self._get_link_row(link) for link in links],
+        )
+
+    def _get_link_row(self, link):
+        return (self._channel, link['nick'], link['real_nick'], _dumps(link))
+
+    def replace_link(self, link):
+        self._query(
+            'UPDATE karma_link SET real_nick = ?, document = ? '
+            'WHERE channel = ? AND nick = ?',
+            (link['real_nick'], _dumps(link), self._channel, link['nick']),
+        )
+
+    def remove_link(self, nick):
+        self._query(
+            'DELETE FROM karma_link WHERE channel = ? AND nick = ?',
+            (self._channel, nick),
+        )
+
+    def iter_links(self):
+        return self._iter_table('karma_link')
+
+    def repoint_links(self, real_nick, new_real_nick, nicks=None):
+        sql = (
+            'SELECT document FROM karma_link '
+            'WHERE channel = ? AND real_nick = ?'
+        )
+        params = [self._channel, real_nick]
+        if nicks is None:
+            queries = [(sql, params)]
+        else:
+            queries = [
+                (
+                    sql + ' AND nick IN ({})'.format(placeholders),
+                    params + chunk,
+                )
+                for placeholders, chunk in self._in(nicks, fixed=2)
+            ]
+
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                links = [
+                    _loads(row[0])
+                    for query, query_params in queries
+                    for row in cursor.execute(query, query_params).fetchall()
+                ]
+                for link in links:
+                    link['real_nick'] = new_real_nick
+                cursor.executemany(
+                    'UPDATE karma_link SET real_nick = ?, document = ? '
+                    'WHERE channel = ? AND nick = ?',
+                    [
+                        (
+                            new_real_nick,
+                            _dumps(link),
+                            self._channel,
+                            link['nick'],
+                        )
+                        for link in links
+                    ],
+                )
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+    def insert_events(self, events):
+        if not events:
+            return
+        self._save_many(
+            'INSERT INTO karma_event (channel, time, document) '
+            'VALUES (?, ?, ?)',
+            [
+                (
+                    self._channel,
+                    _format_datetime(event['time']),
+                    _dumps(event),
+                )
+                for event in events
+            ],
+        )
+
+    def iter_events(self, since=None, batch_size=1000):
+        # Page through in (time, id) order, as _iter_table does by nick
+        sql = 'SELECT time, id, document FROM karma_event WHERE channel = ? '
+        params = [self._channel]
+        if since is not None:
+            sql += 'AND time > ? '
+            params.append(_format_datetime(since))
+        rows = self._query(
+            sql + 'ORDER BY time, id LIMIT ?',
+            params + [batch_size],
+        )
+        while True:
+            for _, _, document in rows:
+                yield _loads(document)
+            if len(rows) < batch_size:
+                return
+            time, id_ = rows[-1][:2]
+            rows = self._query(
+                'SELECT time, id, document FROM karma_event '
+                'WHERE channel = ? AND (time > ? OR (time = ? AND id > ?)) '
+                'ORDER BY time, id LIMIT ?',
+                (self._channel, time, time, id_, batch_size),
+            )
+
+    def save_snapshot(self, time, users, batch_size=1000):
+        # Users are stored in batches under the snapshot's time, and the
+        # pointer to the latest snapshot only moves once they all are
+        snapshot = _format_datetime(time)
+        batch = []
+        for user in users:
+            batch.append(
+                (self._channel, snapshot, user['nick'], _dumps(user))
+            )
+            if len(batch) >= batch_size:
+                self._save_snapshot_users(batch)
+                batch = []
+        if batch:
+            self._save_snapshot_users(batch)
+
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute(
+                    'INSERT OR REPLACE INTO karma_snapshot_latest '
+                    '(channel, snapshot, document) VALUES (?, ?, ?)',
+                    (self._channel, snapshot, _dumps({'time': time})),
+                )
+                cursor.execute(
+                    'DELETE FROM karma_snapshot '
+                    'WHERE channel = ? AND snapshot < ?',
+                    (self._channel, snapshot),
+                )
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+    def _save_snapshot_users(self, rows):
+        self._save_many(
+            'INSERT OR REPLACE INTO karma_snapshot '
+            '(channel, snapshot, nick, document) VALUES (?, ?, ?, ?)',
+            rows,
+        )
+
+    def get_snapshot(self):
+        rows = self._query(
+            'SELECT snapshot, document FROM karma_snapshot_latest '
+            'WHERE channel = ?',
+            (self._channel,),
+        )
+        if not rows:
+            return None, []
+        snapshot, document = rows[0]
+        return _loads(document)['time'], self._iter_snapshot(snapshot)
+
+    def _iter_snapshot(self, snapshot, batch_size=1000):
+        rows = self._query(
+            'SELECT nick, document FROM karma_snapshot '
+            'WHERE channel = ? AND snapshot = ? ORDER BY nick LIMIT ?',
+            (self._channel, snapshot, batch_size),
+        )
+        while True:
+            for _, document in rows:
+                yield _loads(document)
+            if len(rows) < batch_size:
+                return
+            rows = self._query(
+                'SELECT nick, document FROM karma_snapshot '
+                'WHERE channel = ? AND snapshot = ? AND nick > ? '
+                'ORDER BY nick LIMIT ?',
+                (self._channel, snapshot, rows[-1][0], batch_size),
+            )
+
+    def update_buckets(self, increments):
+        if not increments:
+            return
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                self._update_buckets(cursor, increments)
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+
+    def _update_buckets(self, cursor, increments):
+        # Expired buckets are removed once the earliest expiry passes,
+        # rather than on every write
+        now = _format_datetime(datetime.datetime.utcnow())
+        if self._next_expiry is None or self._next_expiry <= now:
+            cursor.execute(
+                'DELETE FROM karma_bucket WHERE expires <= ?',
+                (now,),
+            )
+            self._next_expiry = None
+
+        rows = [
+            (
+                self._channel,
+                increment['nick'],
+                increment['granularity'],
+                _format_datetime(increment['start']),
+            )
+            for increment in increments
+        ]
+        cursor.executemany(
+            'INSERT OR IGNORE INTO karma_bucket '
+            '(channel, nick, granularity, start, expires) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [
+                row + (_format_datetime(increment['expires']),)
+                for row, increment in zip(rows, increments)
+            ],
+        )
+        cursor.executemany(
+            'UPDATE karma_bucket SET value = value + ?, '
+            'received = received + ? '
+            'WHERE channel = ? AND nick = ? AND granularity = ? '
+            'AND start = ?',
+            [
+                (increment['value'], increment['received']) + row
+                for row, increment in zip(rows, increments)
+            ],
+        )
+        expiry = min(
+            _format_datetime(increment['expires'])
+            for increment in increments
+        )
+        if self._next_expiry is None or expiry < self._next_expiry:
+            self._next_expiry = expiry
+
+    def get_bucket_top(self, granularity, since, limit):
+        return [
+            {'nick': nick, 'value': value, 'received': received}
+            for nick, value, received in self._query(
+                'SELECT nick, SUM(value) AS total, SUM(received) '
+                'FROM karma_bucket '
+                'WHERE channel = ? AND granularity = ? AND start >= ? '
+                'GROUP BY nick ORDER BY total DESC, nick LIMIT ?',
+                (self._channel, granularity, _format_datetime(since), limit),
+            )
+        ]
+
+    def merge_buckets(self, nick, into):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                buckets = [
+                    {
+                        'nick': into,
+                        'granularity': granularity,
+                        'start': _parse_datetime(start),
+                        'expires': _parse_datetime(expires),
+                        'value': value,
+                        'received': received,
+                    }
+                    for granularity, start, expires, value, received
+                    in cursor.execute(
+                        'SELECT granularity, start, expires, value, received '
+                        'FROM karma_bucket WHERE channel = ? AND nick = ?',
+                        (self._channel, nick),
+                    ).fetchall()
+                ]
+                cursor.execute(
+                    'DELETE FROM karma_bucket WHERE channel = ? AND nick = ?',
+                    (self._channel, nick),
+                )
+                if buckets:
+                    self._update_buckets(cursor, buckets)
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
@@ -0,0 +1,111 @@
+import collections
+import sys
+import threading
+import time
+
+
+def _get_size(value):
+    # Shallow estimate of the memory used by a cached value, counting the
+    # keys and values of dicts and the items of lists and tuples.
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(
+            sys.getsizeof(key) + sys.getsizeof(item)
+            for key, item in value.items()
+        )
+    elif isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class LRUCache(object):
+    """
+    A bounded mapping that evicts the least recently used entries once it
+    holds more than `maxsize` of them, and entries older than `ttl`
+    seconds when they are next read.
+    """
+    def __init__(self, maxsize=1024, ttl=None, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._timer = timer
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= self._timer():
+                self.misses += 1
+                return default
+            self._entries[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """
+        Like `get`, but without counting a hit or miss or refreshing the
+        entry's position.
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                return default
+            if expires is not None and expires <= self._timer():
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            expires = self._timer() + self.ttl if self.ttl else None
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        """
+        Get the ``(key, value)`` pairs that have not expired, least
+        recently used first, without counting hits or misses.
+        """
+        with self._lock:
+            now = self._timer()
+            return [
+                (key, value)
+                for key, (expires, value) in self._entries.items()
+                if expires is None or expires > now
+            ]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            memory = sys.getsizeof(self._entries) + sum(
+                sys.getsizeof(key) + _get_size(value)
+                for key, (_, value) in self._entries.items()
+            )
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'memory': memory,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,72 @@
+"""
+Per-channel karma namespaces.
+
+When `KARMA_CHANNEL_SCOPED` is set, each channel keeps karma of its own.
+The channel a request came from is made current for the thread handling
+it with `channel_scope`, and objects created per channel (the storage
+backend and caches) are reached through `ChannelScoped` stand-ins that
+forward to the current channel's instance.  The global
+namespace (channel None) is used for everything else, and holds the
+cross-channel totals.
+"""
+import contextlib
+import threading
+
+
+_local = threading.local()
+
+
+def get_channel():
+    """
+    Get the channel whose karma the current thread is working with, or
+    None for the global namespace.
+    """
+    return getattr(_local, 'channel', None)
+
+
+@contextlib.contextmanager
+def channel_scope(channel):
+    """
+    Work with `channel`'s karma (the global namespace's, for None) until
+    the block exits.
+    """
+    previous = get_channel()
+    _local.channel = channel
+    try:
+        yield
+    finally:
+        _local.channel = previous
+
+
+class ChannelScoped(object):
+    """
+    Stands in for an object of which each channel gets its own, created by
+    `factory(channel)` when first used; attributes are looked up on the
+    current channel's instance.
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def for_channel(self, channel):
+        try:
+            return self._instances[channel]
+        except KeyError:
+            with self._lock:
+                if channel not in self._instances:
+                    self._instances[channel] = self._factory(channel)
+                return self._instances[channel]
+
+    def channels(self):
+        """
+        Get the channels that have an instance, the global namespace
+        (None) included if it does.
+        """
+        return list(self._instances)
+
+    def instances(self):
+        return list(self._instances.values())
+
+    def __getattr__(self, name):
+        return getattr(self.for_channel(get_channel()), name)
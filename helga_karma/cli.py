@@ -0,0 +1,262 @@
+"""
+Maintenance commands for helga-karma.
+
+Uses the same database settings as helga itself, so set
+``HELGA_SETTINGS`` when running against a non-default configuration.
+"""
+from __future__ import print_function
+
+import argparse
+import contextlib
+import gzip
+import sys
+
+from .channels import channel_scope
+
+
+def indexes(args):
+    from .data import backend
+
+    if not args.check:
+        for collection, name in backend.ensure_indexes():
+            print('Created {}.{}'.format(collection, name))
+
+    report = backend.check_indexes()
+    for collection, name in report['missing']:
+        print('Missing index {}.{}'.format(collection, name))
+    if report['unused'] is None:
+        print('Index usage statistics are unavailable on this server')
+    else:
+        for collection, name in report['unused']:
+            print('Unused index {}.{}'.format(collection, name))
+    return 1 if report['missing'] else 0
+
+
+def nicks(args):
+    from .data import KarmaRecord
+
+    for old, new in KarmaRecord.merge_unnormalized_nicks():
+        print('Moved {} to {}'.format(old, new))
+    return 0
+
+
+@contextlib.contextmanager
+def _open(path, mode, compress):
+    # Binary file at `path` (stdin or stdout for '-'), gzipped if asked to
+    # or if the name ends in .gz
+    if path == '-':
+        stream = sys.stdin if 'r' in mode else sys.stdout
+        stream = getattr(stream, 'buffer', stream)
+        if compress:
+            with gzip.GzipFile(fileobj=stream, mode=mode) as stream:
+                yield stream
+        else:
+            yield stream
+            stream.flush()
+    else:
+        opener = gzip.open if compress or path.endswith('.gz') else open
+        with opener(path, mode) as stream:
+            yield stream
+
+
+def _print_counts(action, counts):
+    print(
+        '{} {} karma_user and {} karma_link documents'.format(
+            action,
+            counts['karma_user'],
+            counts['karma_link'],
+        ),
+        file=sys.stderr,
+    )
+
+
+def export(args):
+    from .data import KarmaRecord, backend
+    from .transfer import export_karma
+
+    KarmaRecord.flush_writes()
+    with _open(args.file, 'wb', args.gzip) as out:
+        counts = export_karma(backend, out)
+    _print_counts('Exported', counts)
+    return 0
+
+
+def import_(args):
+    from .data import KarmaRecord, backend
+    from .transfer import import_karma
+
+    KarmaRecord.flush_writes()
+    with _open(args.file, 'rb', args.gzip) as in_:
+        counts = import_karma(backend, in_, batch_size=args.batch_size)
+    KarmaRecord.clear_caches()
+    _print_counts('Imported', counts)
+    return 0
+
+
+def snapshot(args):
+    from .data import KarmaRecord
+
+    print('Took snapshot at {}'.format(KarmaRecord.take_snapshot()))
+    return 0
+
+
+def rebuild(args):
+    from .data import KarmaRecord
+
+    result = KarmaRecord.rebuild(batch_size=args.batch_size)
+    print(
+        'Replayed {} events into {} karma_user documents, '
+        'removing {}'.format(
+            result.events,
+            len(result.totals),
+            len(result.removed),
+        )
+    )
+    return 0
+
+
+def serve(args):
+    from helga import settings
+    from .plugin import handle_request, resolve_request_nicks
+    from .service import KarmaService
+
+    path = args.socket or getattr(settings, 'KARMA_SERVICE_SOCKET', None)
+    if not path:
+        print(
+            'Set KARMA_SERVICE_SOCKET or pass --socket to serve karma',
+            file=sys.stderr,
+        )
+        return 1
+
+    service = KarmaService(
+        path,
+        handle_request,
+        resolve=resolve_request_nicks,
+        shards=args.shards,
+    )
+    print('Serving karma on {}'.format(path), file=sys.stderr)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='helga-karma')
+    parser.add_argument(
+        '--channel',
+        help=(
+            'Work with the karma of this channel, when channels keep '
+            'karma of their own (default: the overall totals, which '
+            'leave out every channel\'s own karma and aliases)'
+        ),
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    indexes_parser = subparsers.add_parser(
+        'indexes',
+        help='Create missing indexes and report unused ones',
+    )
+    indexes_parser.add_argument(
+        '--check',
+        action='store_true',
+        help='Only report on indexes; do not create any',
+    )
+    indexes_parser.set_defaults(func=indexes)
+
+    nicks_parser = subparsers.add_parser(
+        'nicks',
+        help='Merge karma stored under look-alike nicks',
+    )
+    nicks_parser.set_defaults(func=nicks)
+
+    export_parser = subparsers.add_parser(
+        'export',
+        help='Write all karma data out as newline-delimited JSON',
+    )
+    export_parser.add_argument(
+        'file',
+        nargs='?',
+        default='-',
+        help='File to write to (default: standard output)',
+    )
+    export_parser.add_argument(
+        '--gzip',
+        action='store_true',
+        help='Compress the output (implied by a .gz file name)',
+    )
+    export_parser.set_defaults(func=export)
+
+    import_parser = subparsers.add_parser(
+        'import',
+        help='Load karma data written by `helga-karma export`',
+    )
+    import_parser.add_argument(
+        'file',
+        nargs='?',
+        default='-',
+        help='File to read from (default: standard input)',
+    )
+    import_parser.add_argument(
+        '--gzip',
+        action='store_true',
+        help='Decompress the input (implied by a .gz file name)',
+    )
+    import_parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000,
+        help='Documents to write at a time (default: 1000)',
+    )
+    import_parser.set_defaults(func=import_)
+
+    snapshot_parser = subparsers.add_parser(
+        'snapshot',
+        help='Snapshot karma totals for the event log to be replayed over',
+    )
+    snapshot_parser.set_defaults(func=snapshot)
+
+    rebuild_parser = subparsers.add_parser(
+        'rebuild',
+        help='Rebuild karma totals from the latest snapshot and event log',
+    )
+    rebuild_parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000,
+        help='Events to fold and users to write at a time (default: 1000)',
+    )
+    rebuild_parser.set_defaults(func=rebuild)
+
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help='Handle karma for bots that set KARMA_SERVICE_SOCKET',
+    )
+    serve_parser.add_argument(
+        '--socket',
+        help='Unix socket to listen on (default: KARMA_SERVICE_SOCKET)',
+    )
+    serve_parser.add_argument(
+        '--shards',
+        type=int,
+        default=16,
+        help=(
+            'Shards of nicks whose requests are handled one at a time '
+            '(default: 16)'
+        ),
+    )
+    serve_parser.set_defaults(func=serve)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    with channel_scope(args.channel):
+        return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,32 +1,379 @@
+import atexit
+import collections
 import datetime
 import math
 import sys
+import time
 
-import pymongo
 import six
 
 from helga import log, settings
-from helga.db import db
+
+from .aliases import resolve_nicks
+from .backends import get_backend
+from . import replay as _replay
+from . import warmstart
+from . import windows
+from .cache import LRUCache
+from .channels import ChannelScoped, channel_scope, get_channel
+from .events import EventLog
+from .instrumentation import InstrumentedBackend, instrumentation
+from .leaderboard import Leaderboard
+from .nicks import NickNormalizer
+from .updates import apply_update as _apply_update
+from .updates import merge_update as _merge_update
+from .writebehind import WriteBehindQueue
 
 
 logger = log.getLogger(__name__)
 
 
+_backend = get_backend()
+
+
+def _get_backend(channel):
+    scoped = _backend if channel is None else _backend.scoped(channel)
+    if getattr(settings, 'KARMA_INSTRUMENTATION', True):
+        scoped = InstrumentedBackend(scoped, instrumentation)
+    return scoped
+
+
+# The backend and caches below work with the current channel's karma; see
+# `helga_karma.channels`
+backend = ChannelScoped(_get_backend)
+
+nick_normalizer = NickNormalizer(
+    casemapping=getattr(settings, 'KARMA_CASEMAPPING', None),
+    cache_size=getattr(settings, 'KARMA_NICK_CACHE_SIZE', 10000),
+)
+
+alias_cache = ChannelScoped(lambda channel: LRUCache(
+    maxsize=getattr(settings, 'KARMA_ALIAS_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'KARMA_ALIAS_CACHE_TTL', 300),
+))
+record_cache = ChannelScoped(lambda channel: LRUCache(
+    maxsize=getattr(settings, 'KARMA_RECORD_CACHE_SIZE', 1000),
+    ttl=getattr(settings, 'KARMA_RECORD_CACHE_TTL', 60),
+))
+leaderboard = ChannelScoped(lambda channel: Leaderboard(
+    size=getattr(settings, 'KARMA_LEADERBOARD_SIZE', 100),
+    ttl=getattr(settings, 'KARMA_LEADERBOARD_TTL', 300),
+))
+maximum_cache = ChannelScoped(lambda channel: LRUCache(
+    maxsize=1,
+    ttl=getattr(settings, 'KARMA_MAXIMUM_CACHE_TTL', 60),
+))
+
+
+FIELDS = (
+    '_id',
+    'nick',
+    'given',
+    'received',
+    'value',
+    'created',
+    'last_received',
+    'last_given',
+)
+
+# What fields missing from a stored document read as
+DEFAULTS = {
+    'given': 0,
+    'received': 0,
+    'value': 0,
+    'created': None,
+    'last_received': None,
+    'last_given': None,
+}
+
+_FIELD_SET = frozenset(FIELDS)
+
+_MISSING = object()
+
+
 class KarmaRecord(object):
-    def __init__(self, record):
-        self._record = record
+    """
+    A user's karma, read and written like a dictionary.
+
+    Records are created around the document they were loaded from and
+    read straight from it, so loading many records (for the leaderboard,
+    say) costs no copying.  Only when a record is first changed are its
+    fields unpacked into slots, with anything else the document held kept
+    aside; `to_document` turns it back into a document for storage.
+    """
+    __slots__ = FIELDS + ('_document', '_extra')
+
+    def __init__(self, document):
+        self._document = document
+        self._extra = None
+
+    @classmethod
+    def normalize_nick(cls, nick):
+        return nick_normalizer(nick)
 
     @classmethod
     def get_actual_nick(cls, nick):
-        nick = nick.split('|')[0]
-        if nick.endswith('++'):
-            nick = nick.split('+')[0]
-        record = db.karma_link.find_one(
-            {'nick': nick}
-        )
-        if record:
-            return record['real_nick']
-        return nick
+        nick = cls.normalize_nick(nick)
+        real_nick = alias_cache.get(nick)
+        if real_nick is None:
+            real_nick = resolve_nicks(backend, [nick])[nick]
+            alias_cache.set(nick, real_nick)
+        return real_nick
+
+    @classmethod
+    def get_actual_nicks(cls, nicks):
+        nicks = [cls.normalize_nick(nick) for nick in nicks]
+        real_nicks = {}
+        for nick in nicks:
+            real_nick = alias_cache.get(nick)
+            if real_nick is not None:
+                real_nicks[nick] = real_nick
+
+        uncached = list(set(nicks) - set(real_nicks))
+        if uncached:
+            for nick, real_nick in resolve_nicks(backend, uncached).items():
+                real_nicks[nick] = real_nick
+                alias_cache.set(nick, real_nick)
+
+        return [real_nicks[nick] for nick in nicks]
+
+    @classmethod
+    def clear_caches(cls):
+        """
+        Forget everything cached about karma records and aliases.
+        """
+        nick_normalizer.clear()
+        for caches in (alias_cache, record_cache, maximum_cache, leaderboard):
+            for cache in caches.instances():
+                cache.clear()
+
+    @classmethod
+    def get_cache_stats(cls):
+        return {
+            'nick': nick_normalizer.stats(),
+            'alias': alias_cache.stats(),
+            'record': record_cache.stats(),
+            'maximum': maximum_cache.stats(),
+        }
+
+    @classmethod
+    def merge_unnormalized_nicks(cls):
+        """
+        Move karma and aliases stored under nicks that are not in their
+        normal form (say, stored before `KARMA_CASEMAPPING` was set) to
+        the normal nick (or the nick it is an alias of), merging
+        look-alikes.  Returns ``(old, new)`` pairs for every nick moved.
+        """
+        cls.flush_writes()
+        moved = []
+
+        nicks = [
+            user['nick'] for user in backend.iter_users()
+            if cls.normalize_nick(user['nick']) != user['nick']
+        ]
+        for nick in nicks:
+            for user in backend.find_users([nick]):
+                other = cls(user)
+                record = cls.get_for_nick(nick)
+                if record['nick'] == nick:
+                    continue
+                record.apply_update(record._get_merge_update(other))
+                other.delete()
+                if _windowed_top_enabled():
+                    backend.merge_buckets(nick, record['nick'])
+                log_event('merge', nick=record['nick'], alias=nick)
+                moved.append((nick, record['nick']))
+
+        links = [
+            link for link in backend.iter_links()
+            if (
+                cls.normalize_nick(link['nick']) != link['nick']
+                or cls.normalize_nick(link['real_nick']) != link['real_nick']
+            )
+        ]
+        for link in links:
+            nick = link['nick']
+            backend.remove_link(nick)
+            link['nick'] = cls.normalize_nick(nick)
+            link['real_nick'] = cls.normalize_nick(link['real_nick'])
+            link['aliases'] = [
+                cls.normalize_nick(alias)
+                for alias in link.get('aliases', [])
+            ]
+            if 'record' in link:
+                link['record']['nick'] = link['nick']
+            # Links to themselves, or duplicating a link that is already
+            # in normal form, are dropped
+            if (
+                link['nick'] != link['real_nick']
+                and not backend.find_link(link['nick'])
+            ):
+                backend.insert_link(link)
+            if link['nick'] != nick:
+                moved.append((nick, link['nick']))
+
+        cls.clear_caches()
+        return moved
+
+    @classmethod
+    def take_snapshot(cls):
+        """
+        Snapshot every karma user, so that replays only need the events
+        logged after now.  Returns the snapshot's time.
+        """
+        cls.flush_writes()
+        if event_log is not None:
+            event_log.flush()
+        return _replay.take_snapshot(backend)
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """
+        Rebuild karma totals from the latest snapshot and the events
+        logged since.  Returns the `helga_karma.replay.Replay`.
+        """
+        cls.flush_writes()
+        if event_log is not None:
+            event_log.flush()
+        result = _replay.rebuild(backend, batch_size=batch_size)
+        cls.clear_caches()
+        return result
+
+    @classmethod
+    def warm_caches(cls, batch_size=1000):
+        """
+        Load the leaderboard, and resolve aliases until the alias cache
+        is full, ahead of their first use.
+        """
+        list(cls.get_top(limit=leaderboard.size))
+
+        nicks = []
+        for link in backend.iter_links():
+            nicks.append(link['nick'])
+            if len(nicks) >= alias_cache.maxsize:
+                break
+        for start in range(0, len(nicks), batch_size):
+            resolved = resolve_nicks(backend, nicks[start:start + batch_size])
+            for nick, real_nick in resolved.items():
+                alias_cache.set(nick, real_nick)
+
+    @classmethod
+    def save_warm_start(cls, path):
+        """
+        Save every channel's alias map, leaderboard and cached records to
+        the warm-start file at `path`.
+        """
+        # Anything that changes while the caches are read is newer than
+        # the file, and so is picked up by `reconcile_warm_start`; queued
+        # changes are written first, so the cached records include them
+        saved = datetime.datetime.utcnow()
+        cls.flush_writes()
+        channels = {}
+        for channel in _get_cached_channels():
+            board = leaderboard.for_channel(channel).snapshot() or ([], False)
+            channels[channel] = {
+                'aliases': alias_cache.for_channel(channel).items(),
+                'records': [
+                    (nick, _without_id(document))
+                    for nick, document
+                    in record_cache.for_channel(channel).items()
+                ],
+                'top': [_without_id(record) for record in board[0]],
+                'complete': board[1],
+            }
+        warmstart.save(path, channels, saved=saved)
+
+    @classmethod
+    def load_warm_start(cls, path):
+        """
+        Fill the caches from the warm-start file at `path`.  Returns the
+        time it was saved, or None if there was nothing to load.
+        """
+        snapshot = warmstart.load(path)
+        if snapshot is None:
+            return None
+        try:
+            for channel in snapshot.channels():
+                section = snapshot.get(channel)
+                aliases = alias_cache.for_channel(channel)
+                for nick, real_nick in section['aliases']:
+                    aliases.set(nick, real_nick)
+                records = record_cache.for_channel(channel)
+                for nick, document in section['records']:
+                    records.set(nick, document)
+                if section['top'] or section['complete']:
+                    top = section['top']
+                    leaderboard.for_channel(channel).seed(
+                        top,
+                        len(top) + 1 if section['complete'] else len(top),
+                    )
+        except Exception:
+            logger.exception('Unable to load the karma warm-start file')
+            cls.clear_caches()
+            return None
+        finally:
+            snapshot.close()
+        return snapshot.saved
+
+    @classmethod
+    def reconcile_warm_start(cls, since, batch_size=1000):
+        """
+        Bring caches filled by `load_warm_start` up to date with the
+        changes made since `since`, when the file was saved.  With the
+        event log on, only nicks with events after then are fetched again;
+        otherwise everything cached is.
+        """
+        for channel in _get_cached_channels():
+            with channel_scope(channel):
+                cls._reconcile(since, batch_size)
+
+    @classmethod
+    def _reconcile(cls, since, batch_size):
+        changed, relinked = cls._get_changes_since(since)
+
+        fetch = leaderboard.size
+        leaderboard.seed(backend.get_top_users(fetch), fetch)
+
+        nicks = [nick for nick, _ in record_cache.items()]
+        if changed is not None:
+            nicks = [nick for nick in nicks if nick in changed]
+        for start in range(0, len(nicks), batch_size):
+            chunk = nicks[start:start + batch_size]
+            found = dict(
+                (result['nick'], result)
+                for result in backend.find_users(chunk)
+            )
+            for nick in chunk:
+                record_cache.set(nick, found.get(nick, {}))
+
+        if not relinked:
+            return
+        nicks = [nick for nick, _ in alias_cache.items()]
+        for start in range(0, len(nicks), batch_size):
+            resolved = resolve_nicks(backend, nicks[start:start + batch_size])
+            for nick, real_nick in resolved.items():
+                alias_cache.set(nick, real_nick)
+
+    @classmethod
+    def _get_changes_since(cls, since):
+        # The nicks with events logged after `since`, and whether any of
+        # those changed aliases; (None, True) without an event log
+        if event_log is None:
+            return None, True
+        event_log.flush()
+        changed = set()
+        relinked = False
+        for event in backend.iter_events(since=since):
+            if event['type'] == 'give':
+                changed.update([event['giver'], event['receiver']])
+            else:
+                changed.update([event['nick'], event['alias']])
+                relinked = True
+        return changed, relinked
+
+    @classmethod
+    def ensure_indexes(cls):
+        return backend.ensure_indexes()
 
     @classmethod
     def get_empty_record(self, nick):
@@ -44,149 +391,487 @@ class KarmaRecord(object):
     def get_for_nick(cls, nick, get_empty=True, use_aliases=True):
         if use_aliases:
             nick = cls.get_actual_nick(nick)
-        record = cls.get_empty_record(nick)
+        else:
+            nick = cls.normalize_nick(nick)
 
-        result = db.karma_user.find_one({'nick': nick})
-        if not get_empty and not result:
+        results, pending = cls._read_users([nick])
+        result, pending = results[nick], pending.get(nick)
+        if not get_empty and not result and not pending:
             return None
-        if result:
-            record.update(result)
-        return cls(record)
+        return cls._get_record(nick, result, pending)
 
     @classmethod
-    def get_top(cls, limit=10):
-        for result in (
-            db.karma_user.find()
-            .sort('value', direction=pymongo.DESCENDING)
-            .limit(limit)
-        ):
+    def _get_record(cls, nick, result, pending):
+        record = cls(result or cls.get_empty_record(nick))
+        if pending:
+            _apply_update(record, pending)
+        return record
+
+    @classmethod
+    def get_for_nicks(cls, nicks, use_aliases=True):
+        """
+        Fetch records for many nicks at once; the same record instance is
+        returned for nicks resolving to the same user.
+        """
+        if use_aliases:
+            nicks = cls.get_actual_nicks(nicks)
+        else:
+            nicks = [cls.normalize_nick(nick) for nick in nicks]
+
+        results, pending = cls._read_users(nicks)
+        records = {}
+        for nick in nicks:
+            if nick not in records:
+                records[nick] = cls._get_record(
+                    nick,
+                    results[nick],
+                    pending.get(nick),
+                )
+        return [records[nick] for nick in nicks]
+
+    @classmethod
+    def _read_users(cls, nicks):
+        # Stored karma_user documents by nick, and the updates still
+        # queued for them; read together, so that an update being written
+        # meanwhile is not found in both
+        if write_behind is None:
+            return cls._get_results(nicks), {}
+        channel = get_channel()
+        with write_behind.reading():
+            return cls._get_results(nicks), dict(
+                (nick, write_behind.pending((channel, nick)))
+                for nick in nicks
+            )
+
+    @classmethod
+    def _get_results(cls, nicks):
+        # Stored karma_user documents by nick, from the record cache where
+        # possible; nicks without a document map to an empty dict.
+        results = {}
+        for nick in nicks:
+            result = record_cache.get(nick)
+            if result is not None:
+                results[nick] = result
+
+        uncached = list(set(nicks) - set(results))
+        if uncached:
+            for result in backend.find_users(uncached):
+                results[result['nick']] = result
+            for nick in uncached:
+                results.setdefault(nick, {})
+                record_cache.set(nick, results[nick])
+
+        return results
+
+    @classmethod
+    def get_upsert(cls, nick, update):
+        """
+        Add a ``$setOnInsert`` of empty-record defaults to ``update`` for
+        every field the update does not already touch.
+        """
+        touched = set(['nick'])
+        for fields in six.itervalues(update):
+            touched.update(fields)
+        upsert = dict(update)
+        upsert['$setOnInsert'] = dict(
+            (key, value)
+            for key, value in six.iteritems(cls.get_empty_record(nick))
+            if key not in touched
+        )
+        return upsert
+
+    @classmethod
+    def write_updates(cls, updates, increments=()):
+        """
+        Write a list of ``(nick, update)`` pairs to karma_user, and any
+        bucket `increments` (see `helga_karma.windows`), handing them to
+        the write-behind queue when it is enabled.
+        """
+        if write_behind is not None:
+            channel = get_channel()
+            for nick, update in updates:
+                write_behind.put((channel, nick), update)
+            for increment in increments:
+                write_behind.put(
+                    (channel, windows.Bucket(*[
+                        increment[field] for field in windows.Bucket._fields
+                    ])),
+                    {'$inc': {
+                        'value': increment['value'],
+                        'received': increment['received'],
+                    }},
+                )
+        else:
+            cls._bulk_write(updates)
+            if increments:
+                backend.update_buckets(increments)
+
+    @classmethod
+    def _write_queued(cls, batch):
+        # Write one channel's batch from the write-behind queue, which is
+        # keyed by ``(channel, nick)`` for karma_user updates and by
+        # ``(channel, windows.Bucket)`` for bucket increments
+        updates = []
+        increments = []
+        for (channel, key), update in batch:
+            if isinstance(key, windows.Bucket):
+                increment = key._asdict()
+                increment.update(update['$inc'])
+                increments.append(increment)
+            else:
+                updates.append((key, update))
+
+        with channel_scope(channel):
+            cls._bulk_write(updates)
+            if not increments:
+                return
+            try:
+                backend.update_buckets(increments)
+            except Exception:
+                # Retrying the batch would count its karma twice; buckets
+                # only feed the windowed leaderboards, so they are dropped
+                logger.exception(
+                    'Unable to write %s karma bucket increments',
+                    len(increments),
+                )
+
+    @classmethod
+    def _bulk_write(cls, updates):
+        if not updates:
+            return
+        backend.update_users([
+            (nick, cls.get_upsert(nick, update))
+            for nick, update in updates
+        ])
+
+        for nick, update in updates:
+            cached = record_cache.peek(nick)
+            if cached:
+                record_cache.set(nick, _apply_update(dict(cached), update))
+            else:
+                # Upserted; let the next read fetch the whole document
+                record_cache.invalidate(nick)
+
+    @classmethod
+    def flush_writes(cls):
+        """
+        Write out any updates still waiting in the write-behind queue.
+        """
+        if write_behind is not None:
+            write_behind.flush()
+
+    @classmethod
+    def get_top(cls, limit=10, window=None):
+        """
+        Get the `limit` records with the most karma, or with the most karma
+        received over the last ``'day'``, ``'week'`` or ``'month'`` if
+        `window` is given (and `KARMA_WINDOWED_TOP` is set).
+        """
+        if window is not None:
+            granularity, since = windows.get_window(window)
+            for result in backend.get_bucket_top(granularity, since, limit):
+                yield cls(result)
+            return
+
+        results = leaderboard.top(limit)
+        if results is None:
+            fetch = max(limit, leaderboard.size)
+            results = backend.get_top_users(fetch)
+            leaderboard.seed(results, fetch)
+            results = results[:limit]
+        for result in results:
             yield cls(result)
 
     @classmethod
     def get_global_karma_maximum(cls):
-        top_1 = list(cls.get_top(limit=1))
-        if not top_1:
-            return 0
-        return top_1[0].get('value', 0)
+        maximum = maximum_cache.get('value')
+        if maximum is None:
+            top_1 = list(cls.get_top(limit=1))
+            maximum = top_1[0].get('value', 0) if top_1 else 0
+            maximum_cache.set('value', maximum)
+        return maximum
 
-    def add_alias(self, other):
-        for key in ['given', 'received', 'value']:
-            self[key] = self[key] + other[key]
+    @classmethod
+    def _track_global_karma_maximum(cls, new_value, old_value=None):
+        # Raise the cached maximum as karma is given; if whoever held it
+        # lost karma, the next lookup has to ask the database again.
+        maximum = maximum_cache.peek('value')
+        if maximum is None:
+            return
+        if new_value > maximum:
+            maximum_cache.set('value', new_value)
+        elif old_value is None or (
+            new_value < old_value and old_value >= maximum
+        ):
+            maximum_cache.invalidate('value')
+
+    @classmethod
+    def get_values(cls, records):
+        """
+        Get the (optionally scaled) karma values for a page of records,
+        looking the global karma maximum up at most once.
+        """
+        values = [record.get('value', 0) for record in records]
+        output_scale_min, output_scale_max = getattr(
+            settings,
+            'KARMA_SCALED_RANGE',
+            (0, 0),
+        )
+        if not output_scale_max:
+            return values
 
+        maximum_karma = float(cls.get_global_karma_maximum())
+        if maximum_karma == 0:
+            return [0 for _ in values]
+
+        if getattr(settings, 'KARMA_SCALE_LINEAR', False):
+            # Linearly scale karma
+            percentages = [my_karma / maximum_karma for my_karma in values]
+        else:
+            # Logarithmically scale karma
+            log_maximum = math.log(maximum_karma + 1)
+            percentages = [
+                math.log(my_karma + 1) / log_maximum for my_karma in values
+            ]
+
+        return [
+            (percentage * (output_scale_max - output_scale_min))
+            + output_scale_min
+            for percentage in percentages
+        ]
+
+    def _get_merge_update(self, other):
+        # The update adding `other`'s karma to this record's
+        update = {
+            '$inc': dict(
+                (key, other[key])
+                for key in ['given', 'received', 'value']
+            ),
+        }
         for key in ['last_received', 'last_given']:
-            if (other[key] and self[key] and other[key] > self[key]):
-                self[key] = other[key]
+            if other[key]:
+                # $max cannot compare against a missing timestamp
+                operator = '$max' if self[key] else '$set'
+                update.setdefault(operator, {})[key] = other[key]
+        return update
 
+    def add_alias(self, other):
+        update = self._get_merge_update(other)
         self._add_alias_record(other)
-        self.save()
+        self.apply_update(update)
         other.delete()
+        if _windowed_top_enabled():
+            backend.merge_buckets(other['nick'], self['nick'])
+        log_event('merge', nick=self['nick'], alias=other['nick'])
 
     def remove_alias(self, nick):
-        alias = db.karma_link.find_one({'nick': nick})
-        db.karma_link.remove({'nick': nick})
+        alias = backend.find_link(nick)
+        backend.remove_link(nick)
+        alias_cache.invalidate(nick)
 
         other = KarmaRecord(alias['record'])
         other.save()
 
-        for key in ['given', 'received', 'value']:
-            self[key] = self[key] - other[key]
-
-        self.save()
+        self.apply_update({
+            '$inc': dict(
+                (key, -other[key])
+                for key in ['given', 'received', 'value']
+            ),
+        })
         other.transfer_aliases_from(self, subset=alias['aliases'])
 
+        record = other.to_document()
+        record.pop('_id', None)
+        log_event('split', nick=self['nick'], alias=nick, record=record)
+
     def transfer_aliases_from(self, record, subset=None):
-        for existing_alias in record._get_alias_records():
-            if not subset or existing_alias['nick'] in subset:
-                existing_alias['real_nick'] = self['nick']
-                db.karma_link.update(
-                    {'nick': existing_alias['nick']},
-                    existing_alias,
-                )
+        if subset:
+            nicks = subset
+        else:
+            nicks = record.get_aliases()
+        self._repoint_aliases(record['nick'], nicks)
+
+    def _repoint_aliases(self, real_nick, nicks):
+        # Point the aliases `nicks` of `real_nick` at `self` in one update.
+        if not nicks:
+            return
+        backend.repoint_links(real_nick, self['nick'], nicks)
+        for nick in nicks:
+            alias_cache.invalidate(nick)
 
     def _add_alias_record(self, record):
         # Update aliases assigned to `record` to point at `self`.
         record_aliases = record.get_aliases()
-        self.transfer_aliases_from(record)
+        self._repoint_aliases(record['nick'], record_aliases)
 
-        return db.karma_link.insert(
+        backend.insert_link(
             {
                 'nick': record['nick'],
                 'real_nick': self['nick'],
-                'record': dict(record),
+                'record': record.to_document(),
                 'aliases': record_aliases,
             }
         )
+        alias_cache.invalidate(record['nick'])
 
     def get_aliases(self):
         return [record['nick'] for record in self._get_alias_records()]
 
     def _get_alias_records(self):
-        return db.karma_link.find(
-            {'real_nick': self['nick']}
-        )
+        return backend.find_links_to(self['nick'])
 
     def give_karma_to(self, other, count=1):
-        value = count * self.get_coefficient()
+        return self.give_karma_to_many([other], count=count)[0]
 
-        self['given'] = self['given'] + 1
-        self['last_given'] = datetime.datetime.utcnow()
-        self.save()
+    def give_karma_to_many(self, others, count=1):
+        """
+        Give karma to each of `others` in turn, writing every resulting
+        change in one ordered bulk write.  Karma given in a channel's
+        namespace is also added to the global namespace's totals.
+        """
+        values = self._give(others, count=count)
+        for other, value in zip(others, values):
+            logger.info(
+                "Gave %s karma from %s to %s",
+                value,
+                self,
+                other,
+            )
 
-        other['value'] = other['value'] + value
-        other['received'] = other['received'] + 1
-        other['last_received'] = datetime.datetime.now()
-        other.save()
+        if get_channel() is not None:
+            nicks = [self['nick']] + [other['nick'] for other in others]
+            with channel_scope(None):
+                records = self.get_for_nicks(nicks)
+                records[0]._give(records[1:], values=values)
 
-        logger.info(
-            "Gave %s karma from %s to %s",
-            value,
-            self,
-            other,
-        )
+        return values
 
-        return value
+    def _give(self, others, count=1, values=None):
+        # Give each of `others` `count` thanks' worth of karma, or the
+        # karma in `values` if given, and return the values given
+        updates = collections.OrderedDict()
+        windowed = _windowed_top_enabled()
+        increments = []
+        given = []
+        for index, other in enumerate(others):
+            if values is not None:
+                value = values[index]
+            else:
+                value = count * self.get_coefficient()
 
-    def get_value(self):
-        output_scale_min, output_scale_max = getattr(
-            settings,
-            'KARMA_SCALED_RANGE',
-            (0, 0),
-        )
-        if not output_scale_max:
-            return self.get('value', 0)
+            self['given'] = self['given'] + 1
+            self['last_given'] = datetime.datetime.utcnow()
+            _merge_update(
+                updates.setdefault(self['nick'], {}),
+                {
+                    '$inc': {'given': 1},
+                    '$set': {'last_given': self['last_given']},
+                },
+            )
 
-        maximum_karma = float(self.get_global_karma_maximum())
-        my_karma = self.get('value', 0)
+            self._track_global_karma_maximum(
+                other['value'] + value,
+                other['value'],
+            )
+            other['value'] = other['value'] + value
+            other['received'] = other['received'] + 1
+            other['last_received'] = datetime.datetime.now()
+            _merge_update(
+                updates.setdefault(other['nick'], {}),
+                {
+                    '$inc': {'value': value, 'received': 1},
+                    '$set': {'last_received': other['last_received']},
+                },
+            )
 
-        if maximum_karma == 0:
-            return 0
+            given.append(value)
+            if windowed:
+                increments.extend(windows.get_increments(
+                    other['nick'],
+                    value,
+                    self['last_given'],
+                ))
+            log_event(
+                'give',
+                giver=self['nick'],
+                receiver=other['nick'],
+                value=value,
+                time=self['last_given'],
+                last_received=other['last_received'],
+            )
 
-        if getattr(settings, 'KARMA_SCALE_LINEAR', False):
-            # Linearly scale karma
-            percentage = my_karma / maximum_karma
-        else:
-            # Logarithmically scale karma
-            percentage = math.log(my_karma + 1, maximum_karma + 1)
+        self.write_updates(list(updates.items()), increments)
+        for record in [self] + list(others):
+            leaderboard.update(record.to_document())
 
-        return (
-            percentage * (output_scale_max - output_scale_min)
-        ) + output_scale_min
+        return given
+
+    def get_value(self):
+        return self.get_values([self])[0]
 
     def get_coefficient(self):
         return (
-            max(float(self._record['received']), 1.0)
-            / max(self._record['given'], 1)
+            max(float(self['received']), 1.0)
+            / max(self['given'], 1)
         )
 
+    def apply_update(self, update):
+        """
+        Apply a mongo update document to this record, writing only the
+        fields it touches.
+        """
+        old_value = self.get('value', 0)
+        _apply_update(self, update)
+        self._track_global_karma_maximum(self.get('value', 0), old_value)
+        self._bulk_write([(self['nick'], update)])
+        leaderboard.update(self.to_document())
+
     def save(self):
-        db.karma_user.update(
-            {'nick': self['nick']},
-            self._record,
-            upsert=True,
-        )
+        # Queued increments must land before the whole record is replaced
+        self.flush_writes()
+        document = self.to_document()
+        backend.save_user(document)
+        record_cache.set(self['nick'], dict(document))
+        leaderboard.update(document)
+        self._track_global_karma_maximum(self.get('value', 0))
 
     def delete(self):
-        db.karma_user.remove({'nick': self['nick']})
+        # ...and before it is removed, or they would recreate it
+        self.flush_writes()
+        backend.remove_user(self['nick'])
+        record_cache.set(self['nick'], {})
+        leaderboard.remove(self['nick'])
+        self._track_global_karma_maximum(
+            float('-inf'),
+            self.get('value', 0),
+        )
+
+    def _unpack(self):
+        document, self._document = self._document, None
+        for key in FIELDS:
+            if key in document:
+                setattr(self, key, document[key])
+            elif key in DEFAULTS:
+                setattr(self, key, DEFAULTS[key])
+        extra = [key for key in document if key not in _FIELD_SET]
+        if extra:
+            self._extra = dict((key, document[key]) for key in extra)
+
+    def to_document(self):
+        """
+        Get this record as a new dictionary, for storage.
+        """
+        if self._document is not None:
+            document = dict(DEFAULTS)
+            document.update(self._document)
+            return document
+
+        document = dict(self._extra or {})
+        for key in FIELDS:
+            value = getattr(self, key, _MISSING)
+            if value is not _MISSING:
+                document[key] = value
+        return document
 
     def get(self, key, default=None):
         try:
@@ -194,14 +879,41 @@ class KarmaRecord(object):
         except KeyError:
             return default
 
+    def __getattr__(self, name):
+        # Only called for fields not unpacked yet (or missing)
+        if name in _FIELD_SET:
+            if self._document is not None:
+                self._unpack()
+                return getattr(self, name)
+        raise AttributeError(name)
+
     def __getitem__(self, key):
-        return self._record[key]
+        if self._document is not None:
+            try:
+                return self._document[key]
+            except KeyError:
+                return DEFAULTS[key]
+        if key in _FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
 
     def __setitem__(self, key, value):
-        self._record[key] = value
+        if self._document is not None:
+            self._unpack()
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
 
     def __iter__(self):
-        return six.iteritems(self._record)
+        return six.iteritems(self.to_document())
 
     def __str__(self):
         if sys.version_info > (3, 0):
@@ -209,9 +921,140 @@ class KarmaRecord(object):
         return self.__unicode__().encode(sys.getdefaultencoding())
 
     def __unicode__(self):
-        return six.text_type(self._record)
+        return six.text_type(self.to_document())
 
     def __repr__(self):
         return '<Karma Record \'{record}\'>'.format(
             record=six.text_type(self)
         )
+
+
+def _get_queued_channel(item):
+    # The channel of a ``(channel, ...)`` write-behind key or event
+    return item[0]
+
+
+def get_write_behind_queue():
+    """
+    Create and start the write-behind queue if `KARMA_WRITE_BEHIND` is set.
+    Every channel's updates share it, keyed by channel.
+    """
+    if not getattr(settings, 'KARMA_WRITE_BEHIND', False):
+        return None
+    queue = WriteBehindQueue(
+        KarmaRecord._write_queued,
+        _merge_update,
+        maxsize=getattr(settings, 'KARMA_WRITE_BEHIND_QUEUE_SIZE', 10000),
+        batch_size=getattr(settings, 'KARMA_WRITE_BEHIND_BATCH_SIZE', 500),
+        window=getattr(settings, 'KARMA_WRITE_BEHIND_WINDOW', 0.25),
+        group=_get_queued_channel,
+    )
+    queue.start()
+    atexit.register(queue.stop)
+    return queue
+
+
+write_behind = get_write_behind_queue()
+
+
+def _without_id(document):
+    return dict(
+        (key, value) for key, value in document.items() if key != '_id'
+    )
+
+
+def _get_cached_channels():
+    return set(
+        alias_cache.channels()
+        + record_cache.channels()
+        + leaderboard.channels()
+    )
+
+
+def start_warm_start_saves(path):
+    """
+    Save the warm-start file at `path` every `KARMA_WARM_START_INTERVAL`
+    seconds, and on shutdown, once the write-behind queue and event log
+    have written out what they hold.
+    """
+    saves = warmstart.PeriodicSave(
+        lambda: KarmaRecord.save_warm_start(path),
+        interval=getattr(settings, 'KARMA_WARM_START_INTERVAL', 300),
+    )
+    saves.start()
+    atexit.register(_stop_warm_start_saves, saves)
+    return saves
+
+
+def _stop_warm_start_saves(saves):
+    # Exit handlers run last registered first, so this runs before the
+    # write-behind queue's and event log's own (stopping them twice is
+    # harmless)
+    saves.stop(final=False)
+    for worker in (write_behind, event_log):
+        if worker is not None:
+            worker.stop()
+    saves.save()
+
+
+def _windowed_top_enabled():
+    return getattr(settings, 'KARMA_WINDOWED_TOP', False)
+
+
+def _insert_events(events):
+    # Write one channel's ``(channel, event)`` pairs from the event log
+    backend.for_channel(_get_queued_channel(events[0])).insert_events(
+        [event for _, event in events]
+    )
+
+
+def _take_snapshots():
+    # Snapshot every channel whose karma has been used since startup
+    for channel in set(backend.channels()) | set([None]):
+        with channel_scope(channel):
+            KarmaRecord.take_snapshot()
+
+
+def get_event_log():
+    """
+    Create and start the event log if `KARMA_EVENT_LOG` is set.  Every
+    channel's events share it, and are snapshotted together, as often as
+    the global namespace's.
+    """
+    if not getattr(settings, 'KARMA_EVENT_LOG', False):
+        return None
+
+    last_snapshot, _ = backend.for_channel(None).get_snapshot()
+    if last_snapshot is not None:
+        # The snapshot's age, counted back from the event log's timer
+        last_snapshot = time.time() - (
+            datetime.datetime.utcnow() - last_snapshot
+        ).total_seconds()
+
+    events = EventLog(
+        _insert_events,
+        maxsize=getattr(settings, 'KARMA_EVENT_LOG_QUEUE_SIZE', 100000),
+        batch_size=getattr(settings, 'KARMA_EVENT_LOG_BATCH_SIZE', 500),
+        interval=getattr(settings, 'KARMA_EVENT_LOG_INTERVAL', 1.0),
+        snapshot=_take_snapshots,
+        snapshot_interval=getattr(settings, 'KARMA_SNAPSHOT_INTERVAL', 86400),
+        last_snapshot=last_snapshot,
+        group=_get_queued_channel,
+    )
+    events.start()
+    atexit.register(events.stop)
+    return events
+
+
+def log_event(event_type, **event):
+    """
+    Append an event of `event_type` to the event log, if it is enabled.
+    """
+    if event_log is None:
+        return
+    event['type'] = event_type
+    event.setdefault('time', datetime.datetime.utcnow())
+    event_log.append((get_channel(), event))
+
+
+event_log = get_event_log()
@@ -0,0 +1,52 @@
+"""
+JSON encoding of karma documents, for storage outside of mongo.
+
+Datetimes are written as ``{"$date": "..."}`` and read back as datetimes;
+mongo's ObjectIds (which may turn up in copies of documents, such as the
+records embedded in alias links) are written as strings.
+"""
+import datetime
+import json
+
+
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def format_datetime(value):
+    """
+    Format `value` the way stored datetimes are; these sort as text in
+    the same order as the datetimes do.
+    """
+    return value.strftime(_DATETIME_FORMAT)
+
+
+def parse_datetime(value):
+    return datetime.datetime.strptime(value, _DATETIME_FORMAT)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'$date': format_datetime(value)}
+    if type(value).__name__ == 'ObjectId':
+        return str(value)
+    raise TypeError('Cannot store {!r}'.format(value))
+
+
+def _decode_object(obj):
+    if list(obj) == ['$date']:
+        return parse_datetime(obj['$date'])
+    return obj
+
+
+def dumps(document):
+    """
+    Encode `document` as JSON, leaving out its mongo ``_id``, which means
+    nothing anywhere else.
+    """
+    document = dict(document)
+    document.pop('_id', None)
+    return json.dumps(document, default=_encode_value, sort_keys=True)
+
+
+def loads(document):
+    return json.loads(document, object_hook=_decode_object)
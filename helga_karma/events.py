@@ -0,0 +1,210 @@
+import collections
+import threading
+import time
+
+from helga import log
+
+
+logger = log.getLogger(__name__)
+
+
+class EventLog(object):
+    """
+    Appends karma events to the ``karma_event`` log from a background
+    thread, so that recording them never slows karma down.
+
+    `writer` is called with a list of events, oldest first; when it fails
+    the batch is put back and retried.  The worker writes once
+    `batch_size` events are waiting or the oldest has waited `interval`
+    seconds.  Once `maxsize` events are waiting, `append` writes further
+    events straight away, from the calling thread, rather than wait for
+    the worker to catch up; replays order events by time, so these
+    overtaking older ones does no harm.  An event that cannot be written
+    then is dropped, and counted.
+
+    If `group` is given, each batch is split by ``group(event)`` and the
+    writer called once per group, each group's events in order; when one
+    fails, it and the groups after it are put back, while those already
+    written are not written again.
+
+    If `snapshot` is given, it is called from the worker after a write
+    whenever `snapshot_interval` seconds have passed since the last
+    snapshot (at `last_snapshot`, in `timer` seconds), keeping the number
+    of events a replay has to fold bounded.
+    """
+    def __init__(
+        self, writer, maxsize=100000, batch_size=500, interval=1.0,
+        retry_interval=1.0, snapshot=None, snapshot_interval=0,
+        last_snapshot=None, group=None, timer=time.time
+    ):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.snapshot_interval = snapshot_interval
+
+        self._writer = writer
+        self._snapshot = snapshot
+        self._group = group
+        self._timer = timer
+        self._last_snapshot = (
+            last_snapshot if last_snapshot is not None else timer()
+        )
+        self._pending = []
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+
+        self.appended = 0
+        self.overflowed = 0
+        self.dropped = 0
+        self.written = 0
+        self.failures = 0
+        self.snapshots = 0
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run,
+                name='helga-karma-event-log',
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker thread and write out every event still waiting.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    def append(self, event):
+        with self._condition:
+            self.appended += 1
+            if len(self._pending) < self.maxsize or self._stopping:
+                if not self._pending:
+                    self._oldest = self._timer()
+                self._pending.append(event)
+                self._condition.notify_all()
+                return
+            self.overflowed += 1
+
+        logger.warning('Karma event log is full; writing an event directly')
+        with self._write_lock:
+            try:
+                self._writer([event])
+            except Exception:
+                logger.exception('Unable to write a karma event; dropping it')
+                self.dropped += 1
+            else:
+                self.written += 1
+
+    def flush(self, limit=None):
+        """
+        Write up to `limit` waiting events (all of them by default) from
+        the calling thread.  Returns False if the write failed.
+        """
+        with self._write_lock:
+            with self._condition:
+                if limit is None:
+                    limit = len(self._pending)
+                batch = self._pending[:limit]
+                self._pending = self._pending[limit:]
+                if self._pending:
+                    self._oldest = self._timer()
+                self._condition.notify_all()
+            if not batch:
+                return True
+
+            groups = self._get_groups(batch)
+            for index, group in enumerate(groups):
+                try:
+                    self._writer(group)
+                except Exception:
+                    unwritten = [
+                        event for group in groups[index:] for event in group
+                    ]
+                    logger.exception(
+                        'Unable to write %s karma events; will retry',
+                        len(unwritten),
+                    )
+                    with self._condition:
+                        self._pending = unwritten + self._pending
+                    self.failures += 1
+                    return False
+                self.written += len(group)
+            return True
+
+    def _get_groups(self, batch):
+        if self._group is None:
+            return [batch]
+        groups = collections.OrderedDict()
+        for event in batch:
+            groups.setdefault(self._group(event), []).append(event)
+        return list(groups.values())
+
+    def _wait_for_batch(self):
+        with self._condition:
+            while not self._pending and not self._stopping:
+                self._condition.wait()
+            if self._stopping:
+                return False
+
+            deadline = self._oldest + self.interval
+            while (
+                self._pending
+                and not self._stopping
+                and len(self._pending) < self.batch_size
+            ):
+                remaining = deadline - self._timer()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            # Whoever flushed meanwhile may have left nothing to write
+            return not self._stopping
+
+    def _snapshot_if_due(self):
+        if self._snapshot is None or not self.snapshot_interval:
+            return
+        if self._timer() - self._last_snapshot < self.snapshot_interval:
+            return
+        try:
+            self._snapshot()
+        except Exception:
+            logger.exception('Unable to take a karma snapshot')
+        else:
+            self.snapshots += 1
+        # Failed snapshots wait for the next interval too, rather than
+        # being retried after every write
+        self._last_snapshot = self._timer()
+
+    def _run(self):
+        while self._wait_for_batch():
+            if self.flush(limit=self.batch_size):
+                self._snapshot_if_due()
+            else:
+                time.sleep(self.retry_interval)
+
+    def stats(self):
+        with self._condition:
+            depth = len(self._pending)
+        return {
+            'depth': depth,
+            'appended': self.appended,
+            'overflowed': self.overflowed,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failures': self.failures,
+            'snapshots': self.snapshots,
+        }
@@ -0,0 +1,162 @@
+import pymongo
+from pymongo.errors import OperationFailure
+
+from helga import log
+from helga.db import db
+
+
+logger = log.getLogger(__name__)
+
+
+# Every index leads with the channel, so that each channel's karma is
+# looked up and ranked as cheaply as if it were stored on its own
+INDEXES = {
+    'karma_user': [
+        (
+            [('channel', pymongo.ASCENDING), ('nick', pymongo.ASCENDING)],
+            {'unique': True},
+        ),
+        (
+            [('channel', pymongo.ASCENDING), ('value', pymongo.DESCENDING)],
+            {},
+        ),
+    ],
+    'karma_link': [
+        (
+            [('channel', pymongo.ASCENDING), ('nick', pymongo.ASCENDING)],
+            {},
+        ),
+        (
+            [
+                ('channel', pymongo.ASCENDING),
+                ('real_nick', pymongo.ASCENDING),
+            ],
+            {},
+        ),
+    ],
+    'karma_event': [
+        (
+            [
+                ('channel', pymongo.ASCENDING),
+                ('time', pymongo.ASCENDING),
+                ('_id', pymongo.ASCENDING),
+            ],
+            {},
+        ),
+    ],
+    'karma_bucket': [
+        (
+            [
+                ('channel', pymongo.ASCENDING),
+                ('nick', pymongo.ASCENDING),
+                ('granularity', pymongo.ASCENDING),
+                ('start', pymongo.ASCENDING),
+            ],
+            {'unique': True},
+        ),
+        (
+            [
+                ('channel', pymongo.ASCENDING),
+                ('granularity', pymongo.ASCENDING),
+                ('start', pymongo.ASCENDING),
+            ],
+            {},
+        ),
+        ([('expires', pymongo.ASCENDING)], {'expireAfterSeconds': 0}),
+    ],
+    'karma_snapshot': [
+        (
+            [
+                ('channel', pymongo.ASCENDING),
+                ('snapshot', pymongo.ASCENDING),
+            ],
+            {},
+        ),
+    ],
+}
+
+# Indexes replaced by those above; the unique index on nick alone would
+# keep a nick from having karma in more than one channel
+OBSOLETE_INDEXES = {
+    'karma_user': ['nick_1', 'value_-1'],
+    'karma_link': ['nick_1', 'real_nick_1'],
+    'karma_event': ['time_1__id_1'],
+    'karma_bucket': [
+        'nick_1_granularity_1_start_1',
+        'granularity_1_start_1',
+    ],
+    'karma_snapshot': ['snapshot_1'],
+}
+
+
+def _get_index_name(keys):
+    return '_'.join(
+        '{}_{}'.format(field, direction) for field, direction in keys
+    )
+
+
+def ensure_indexes(database=None):
+    """
+    Create any indexes the karma collections are missing, and drop those
+    they have outgrown; indexes that already exist are left alone, so
+    this is safe to run repeatedly.  Outgrown indexes are only dropped
+    once every index replacing them has been created, so that a failure
+    never leaves a collection without its unique index.
+    """
+    database = database if database is not None else db
+    created = []
+    obsolete = []
+    for collection, indexes in sorted(INDEXES.items()):
+        existing = database[collection].index_information()
+        for keys, options in indexes:
+            name = _get_index_name(keys)
+            if name in existing:
+                continue
+            logger.info('Creating index %s on %s', name, collection)
+            database[collection].create_index(keys, name=name, **options)
+            created.append((collection, name))
+        obsolete.extend(
+            (collection, name)
+            for name in OBSOLETE_INDEXES.get(collection, [])
+            if name in existing
+        )
+
+    for collection, name in obsolete:
+        logger.info('Dropping index %s on %s', name, collection)
+        database[collection].drop_index(name)
+    return created
+
+
+def check_indexes(database=None):
+    """
+    Report indexes that are missing, and indexes that exist but have not
+    been used since the server started.  `unused` is None when the server
+    cannot report index usage.
+    """
+    database = database if database is not None else db
+    missing = []
+    unused = []
+    for collection, indexes in sorted(INDEXES.items()):
+        existing = database[collection].index_information()
+        for keys, _ in indexes:
+            name = _get_index_name(keys)
+            if name not in existing:
+                missing.append((collection, name))
+
+        try:
+            stats = list(database[collection].aggregate(
+                [{'$indexStats': {}}]
+            ))
+        except OperationFailure:
+            unused = None
+            continue
+        if unused is None:
+            continue
+        for stat in stats:
+            if stat['name'] != '_id_' and not stat['accesses']['ops']:
+                unused.append((collection, stat['name']))
+
+    return {
+        'missing': missing,
+        'unused': unused,
+    }
@@ -0,0 +1,233 @@
+import bisect
+import collections
+import functools
+import threading
+import time
+
+from helga import log, settings
+
+
+logger = log.getLogger(__name__)
+
+
+# Upper bounds of the histogram buckets; anything larger is counted in an
+# extra overflow bucket.
+CALL_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+TIME_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+
+class Histogram(object):
+    """
+    Counts observations in fixed buckets, so that recording one costs the
+    same however many have been recorded before it.
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def percentile(self, percent):
+        """
+        Get the upper bound of the bucket holding the observation at
+        `percent`, or the largest observation if that is smaller.
+        """
+        if not self.count:
+            return 0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def mean(self):
+        return float(self.total) / self.count if self.count else 0.0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.maximum,
+            'buckets': dict(zip(
+                [str(bound) for bound in self.buckets] + ['inf'],
+                self.counts,
+            )),
+        }
+
+
+class OperationStats(object):
+    def __init__(self):
+        self.calls = Histogram(CALL_BUCKETS)
+        self.time = Histogram(TIME_BUCKETS)
+        self.methods = collections.Counter()
+
+    def record(self, calls, elapsed, methods):
+        self.calls.observe(calls)
+        self.time.observe(elapsed)
+        self.methods.update(methods)
+
+    def summary(self):
+        return {
+            'count': self.calls.count,
+            'calls': self.calls.summary(),
+            'time': self.time.summary(),
+            'methods': dict(self.methods),
+        }
+
+
+class _Tally(object):
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.elapsed = 0.0
+        self.methods = collections.Counter()
+
+
+class Instrumentation(object):
+    """
+    Counts and times storage calls, grouped by the plugin operation (give,
+    info, top, ...) that made them.
+
+    Operations are tracked per thread; calls made outside of one, such as
+    those from the write-behind queue's worker, are recorded under
+    ``other``, one call per observation.  When `log_interval` is set, the
+    stats are logged at most once every `log_interval` seconds, as
+    operations finish.
+    """
+    def __init__(self, log_interval=0, timer=time.time):
+        self.log_interval = log_interval
+        self._timer = timer
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = collections.defaultdict(OperationStats)
+            self._last_logged = self._timer()
+
+    def operation(self, name):
+        """
+        Decorator recording the storage calls made by the decorated
+        function under `name`.  Nested operations are counted as part of
+        the outermost one.
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if getattr(self._local, 'tally', None) is not None:
+                    return fn(*args, **kwargs)
+                self._local.tally = tally = _Tally(name)
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self._local.tally = None
+                    self._record(tally)
+            return wrapper
+        return decorator
+
+    def record_call(self, method, elapsed):
+        tally = getattr(self._local, 'tally', None)
+        if tally is None:
+            tally = _Tally('other')
+            tally.calls = 1
+            tally.elapsed = elapsed
+            tally.methods[method] = 1
+            self._record(tally)
+            return
+        tally.calls += 1
+        tally.elapsed += elapsed
+        tally.methods[method] += 1
+
+    def _record(self, tally):
+        with self._lock:
+            self._stats[tally.name].record(
+                tally.calls,
+                tally.elapsed,
+                tally.methods,
+            )
+            now = self._timer()
+            should_log = (
+                self.log_interval
+                and now - self._last_logged >= self.log_interval
+            )
+            if should_log:
+                self._last_logged = now
+        if should_log:
+            for line in self.format_stats():
+                logger.info('Karma stats: %s', line)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                (name, stats.summary())
+                for name, stats in self._stats.items()
+            )
+
+    def format_stats(self):
+        lines = []
+        for name, stats in sorted(self.stats().items()):
+            lines.append(
+                '{name}: {count} ops, {calls:.1f} calls/op '
+                '(p50 {calls_p50}, p99 {calls_p99}), '
+                '{time:.1f}ms/op (p50 {time_p50:.1f}ms, p99 {time_p99:.1f}ms)'
+                .format(
+                    name=name,
+                    count=stats['count'],
+                    calls=stats['calls']['mean'],
+                    calls_p50=stats['calls']['p50'],
+                    calls_p99=stats['calls']['p99'],
+                    time=stats['time']['mean'] * 1000,
+                    time_p50=stats['time']['p50'] * 1000,
+                    time_p99=stats['time']['p99'] * 1000,
+                )
+            )
+        return lines
+
+
+class InstrumentedBackend(object):
+    """
+    Wraps a storage backend, reporting the time taken by every method
+    call to an `Instrumentation`.
+    """
+    def __init__(self, backend, instrumentation, timer=time.time):
+        self.backend = backend
+        self.instrumentation = instrumentation
+        self._timer = timer
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def timed(*args, **kwargs):
+            started = self._timer()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.instrumentation.record_call(
+                    name,
+                    self._timer() - started,
+                )
+        return timed
+
+
+# Shared by the plugin's operations and the data layer's backend, which
+# is only loaded once karma is first used
+instrumentation = Instrumentation(
+    log_interval=getattr(settings, 'KARMA_STATS_LOG_INTERVAL', 0),
+)
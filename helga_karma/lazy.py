@@ -0,0 +1,54 @@
+import importlib
+import threading
+
+
+class LazyModule(object):
+    """
+    Stands in for the module `name`, importing it the first time one of
+    its attributes is used; `on_load`, if given, is then called with the
+    module.
+    """
+    def __init__(self, name, on_load=None):
+        self.name = name
+        self._on_load = on_load
+        self._module = None
+        self._lock = threading.RLock()
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def load(self):
+        module = self._module
+        if module is not None:
+            return module
+        with self._lock:
+            if self._module is None:
+                module = importlib.import_module(self.name)
+                # Set first, so that `on_load` can use this stand-in too
+                self._module = module
+                if self._on_load is not None:
+                    self._on_load(module)
+            return self._module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+class LazyAttribute(object):
+    """
+    Stands in for the attribute `name` of a `LazyModule`, loading the
+    module only when the attribute is used or called.
+    """
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+
+    def _get(self):
+        return getattr(self._module.load(), self._name)
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._get()(*args, **kwargs)
@@ -0,0 +1,101 @@
+import bisect
+import threading
+import time
+
+
+class Leaderboard(object):
+    """
+    The `size` records with the most karma, kept in memory.
+
+    The board is seeded from a query sorted by value and then updated as
+    records change.  It always holds the true top N for N = its length:
+    when a record on the board loses enough karma that somebody off the
+    board might now rank above it, it is dropped rather than guessed at,
+    and `top` returns None for anything the board can no longer answer.
+    Seeds older than `ttl` seconds are discarded so that changes made
+    elsewhere are eventually picked up.
+    """
+    def __init__(self, size=100, ttl=None, timer=time.time):
+        self.size = size
+        self.ttl = ttl
+        self._timer = timer
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._keys = []
+        self._records = {}
+        self._complete = False
+        self._seeded_at = None
+
+    def seed(self, records, limit):
+        """
+        Replace the board with `records`, the result of fetching the top
+        `limit` records sorted by value.
+        """
+        with self._lock:
+            self.clear()
+            for record in records[:self.size]:
+                self._insert(dict(record))
+            self._complete = len(records) < limit and len(records) <= self.size
+            self._seeded_at = self._timer()
+
+    def top(self, limit):
+        with self._lock:
+            if self._seeded_at is None:
+                return None
+            if self.ttl and self._seeded_at + self.ttl <= self._timer():
+                self.clear()
+                return None
+            if limit > len(self._keys) and not self._complete:
+                return None
+            return [
+                dict(self._records[nick]) for _, nick in self._keys[:limit]
+            ]
+
+    def snapshot(self):
+        """
+        Get the records on the board, highest value first, and whether
+        they are everybody; None if the board has no current seed.
+        """
+        with self._lock:
+            if self._seeded_at is None:
+                return None
+            if self.ttl and self._seeded_at + self.ttl <= self._timer():
+                return None
+            records = [dict(self._records[nick]) for _, nick in self._keys]
+            return records, self._complete
+
+    def update(self, record):
+        with self._lock:
+            if self._seeded_at is None:
+                return
+            nick = record['nick']
+            value = record.get('value', 0)
+            # Everybody off the board has at most this much karma
+            boundary = -self._keys[-1][0] if self._keys else None
+
+            if nick in self._records:
+                self._remove(nick)
+            if self._complete or (boundary is not None and value >= boundary):
+                self._insert(dict(record))
+
+            if len(self._keys) > self.size:
+                self._remove(self._keys[-1][1])
+                self._complete = False
+
+    def remove(self, nick):
+        with self._lock:
+            if nick in self._records:
+                self._remove(nick)
+
+    def _insert(self, record):
+        bisect.insort(self._keys, (-record.get('value', 0), record['nick']))
+        self._records[record['nick']] = record
+
+    def _remove(self, nick):
+        record = self._records.pop(nick)
+        self._keys.remove((-record.get('value', 0), nick))
+
+    def __len__(self):
+        return len(self._keys)
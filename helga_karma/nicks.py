@@ -0,0 +1,61 @@
+import string
+
+from .cache import LRUCache
+
+
+def _get_casemap(extra_upper, extra_lower):
+    return dict(zip(
+        string.ascii_uppercase + extra_upper,
+        string.ascii_lowercase + extra_lower,
+    ))
+
+
+# How IRC servers fold nick case, by the name of their CASEMAPPING
+CASEMAPPINGS = {
+    'ascii': _get_casemap('', ''),
+    'rfc1459': _get_casemap('[]\\~', '{}|^'),
+    'strict-rfc1459': _get_casemap('[]\\', '{}|'),
+}
+
+_TRAILING_PUNCTUATION = ',:;'
+
+
+class NickNormalizer(object):
+    """
+    Turns the nicks people type into the form their karma is stored under.
+
+    Trailing punctuation (``nick:``), ``++`` and ``|away``-style suffixes
+    are removed and, if `casemapping` names one of `CASEMAPPINGS`, case is
+    folded the way the IRC server folds it, so that nicks the server
+    considers the same share one karma record.  Results are memoised in
+    an LRU cache of `cache_size` nicks.
+    """
+    def __init__(self, casemapping=None, cache_size=10000):
+        if casemapping is not None and casemapping not in CASEMAPPINGS:
+            raise ValueError('Unknown casemapping {!r}'.format(casemapping))
+        self.casemapping = casemapping
+        self._casemap = CASEMAPPINGS.get(casemapping)
+        self._cache = LRUCache(maxsize=cache_size)
+
+    def __call__(self, nick):
+        normalized = self._cache.get(nick)
+        if normalized is None:
+            normalized = self._normalize(nick)
+            self._cache.set(nick, normalized)
+        return normalized
+
+    def _normalize(self, nick):
+        if self._casemap:
+            # Folding first means that suffixes written as ``nick\away``
+            # are recognised wherever ``\`` and ``|`` are the same letter
+            nick = ''.join(self._casemap.get(char, char) for char in nick)
+        nick = nick.split('|')[0].rstrip(_TRAILING_PUNCTUATION)
+        if nick.endswith('++'):
+            nick = nick.split('+')[0]
+        return nick
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
@@ -1,15 +1,81 @@
 import re
+import threading
+
 import six
 
 from helga import log, settings
-from helga.plugins import command, match
+from helga.plugins import ResponseNotReady, command, match
 
-from .data import KarmaRecord
+from .channels import channel_scope
+from .instrumentation import instrumentation
+from .lazy import LazyAttribute, LazyModule
+from .ratelimit import FloodProtection, TokenBuckets
+from .threads import KarmaThreadPool
+from .windows import WINDOWS
 
 
 logger = log.getLogger(__name__)
 
 
+def _ensure_indexes(data):
+    """
+    Create the karma collection indexes when karma is first used
+    """
+    if not getattr(settings, 'KARMA_ENSURE_INDEXES', True):
+        return
+    from pymongo.errors import PyMongoError
+    try:
+        data.KarmaRecord.ensure_indexes()
+    except PyMongoError:
+        logger.exception(
+            'Unable to create karma indexes; run `helga-karma indexes` '
+            'to see what is missing.'
+        )
+
+
+def _warm_caches(data):
+    """
+    Fill the caches from the warm-start file, if there is one, and then
+    bring them up to date (or, without one, fill the leaderboard and alias
+    caches) from a background thread
+    """
+    since = None
+    path = getattr(settings, 'KARMA_WARM_START_FILE', None)
+    if path:
+        since = data.KarmaRecord.load_warm_start(path)
+        data.start_warm_start_saves(path)
+
+    if since is not None:
+        def warm():
+            data.KarmaRecord.reconcile_warm_start(since)
+    elif getattr(settings, 'KARMA_WARM_CACHES', True):
+        warm = data.KarmaRecord.warm_caches
+    else:
+        return
+
+    def run():
+        try:
+            warm()
+        except Exception:
+            logger.exception('Unable to warm karma caches')
+
+    thread = threading.Thread(target=run, name='helga-karma-warm')
+    thread.daemon = True
+    thread.start()
+
+
+def _on_data_loaded(data):
+    _ensure_indexes(data)
+    _warm_caches(data)
+
+
+# The data layer (and with it, the database connection) is only loaded
+# once karma is first used
+data = LazyModule('helga_karma.data', on_load=_on_data_loaded)
+KarmaRecord = LazyAttribute(data, 'KarmaRecord')
+nick_normalizer = LazyAttribute(data, 'nick_normalizer')
+
+
 VALID_NICK_PAT = r'[\w{}\[\]\-|^`\\]+'
 
 
@@ -31,6 +97,13 @@ MESSAGES = {
     ),
 
     'top': '#{idx}: {nick} ({value} {VALUE_NAME})',
+    'top_window_unknown': (
+        'I can only rank {VALUE_NAME} over the last day, week or month, '
+        '{nick}.'
+    ),
+    'top_window_disabled': (
+        'I\'m not keeping track of {VALUE_NAME} over time, {nick}.'
+    ),
 
     'linked_already': '{secondary} is already linked to {main}.',
     'linked': '{main} and {secondary} are now linked.',
@@ -45,7 +118,21 @@ MESSAGES = {
         'Neither of the users you specified appear to exist, {nick}.'
     ),
     'unknown_user': 'I don\'t know who {for_nick} is, {nick}.',
-    'nope': 'That doesn\'t make much sense now, does it, {nick}.'
+    'nope': 'That doesn\'t make much sense now, does it, {nick}.',
+
+    'stats_none': 'No karma operations have been recorded yet.',
+    'stats_flood': (
+        'flood protection: {allowed} thanks allowed, {rejected} rejected'
+    ),
+    'stats_write_behind': (
+        'write-behind: {depth} waiting, {flushed} written in {flushes} '
+        'flushes (last {last_flush_ms:.1f}ms, max {max_flush_ms:.1f}ms), '
+        '{overflowed} written directly, {failures} failed'
+    ),
+    'stats_cache': (
+        '{cache} cache: {hit_ratio:.0%} hit ratio ({hits} hits, {misses} '
+        'misses), {size} entries in {memory_kb:.1f}KiB'
+    ),
 }
 
 
@@ -61,6 +148,13 @@ _DEFAULT_INVALID_WORDS = [
     'for',
 ]
 
+_REGEX_SPECIAL_CHARS = set('.^$*+?{}[]\\|()')
+
+_PP_PATTERN = re.compile(
+    r'(?:\w*\s+)*((?![cC]\+\+){nick}\+\+),?(?:\s+|$)'.format(
+        nick=VALID_NICK_PAT
+    )
+)
 
 
 def format_message(name, **kwargs):
@@ -80,6 +174,7 @@ def format_message(name, **kwargs):
     return message.format(**kwargs)
 
 
+@instrumentation.operation('info')
 def info(requested_by, for_nick, detailed=False):
     """
     Get karma for a specified user, optionally verbose
@@ -116,36 +211,85 @@ def info(requested_by, for_nick, detailed=False):
     )
 
 
-def top(limit=10):
+@instrumentation.operation('top')
+def top(limit=10, window=None, requested_by=None):
     """
-    Get the top N users
+    Get the top N users, over all time or over the last day, week or month
     """
-    top_n = KarmaRecord.get_top(limit)
+    if window is not None:
+        if window not in WINDOWS:
+            return format_message('top_window_unknown', nick=requested_by)
+        if not getattr(settings, 'KARMA_WINDOWED_TOP', False):
+            return format_message('top_window_disabled', nick=requested_by)
+
+    top_n = list(KarmaRecord.get_top(limit, window=window))
+    if window is not None:
+        # Scaling is relative to all-time karma, so it would not make
+        # sense here
+        values = [record['value'] for record in top_n]
+    else:
+        values = KarmaRecord.get_values(top_n)
     lines = []
-    for idx, record in enumerate(top_n):
+    for idx, (record, value) in enumerate(zip(top_n, values)):
         lines.append(
             format_message(
                 'top',
                 idx=idx+1,
                 nick=record['nick'],
-                value=round(record.get_value(), 1),
+                value=round(value, 1),
             )
         )
     return lines
 
 
+def stats():
+    """
+    Get the database round-trips made by each kind of karma operation,
+    how the write-behind queue is keeping up and how well the caches hit
+    """
+    lines = instrumentation.format_stats()
+    if flood_protection.enabled:
+        lines.append(format_message('stats_flood', **flood_protection.stats()))
+    # Without the data layer loaded, there is nothing of it to report
+    if not data.loaded:
+        return lines or format_message('stats_none')
+    if data.write_behind is not None:
+        queue = data.write_behind.stats()
+        lines.append(format_message(
+            'stats_write_behind',
+            last_flush_ms=queue['last_flush_latency'] * 1000,
+            max_flush_ms=queue['max_flush_latency'] * 1000,
+            **queue
+        ))
+    caches = data.KarmaRecord.get_cache_stats()
+    for cache, cache_stats in sorted(caches.items()):
+        lines.append(format_message(
+            'stats_cache',
+            cache=cache,
+            memory_kb=cache_stats['memory'] / 1024.0,
+            **cache_stats
+        ))
+    return lines or format_message('stats_none')
+
+
+@instrumentation.operation('give')
 def give(from_nick, to_nicks):
     """
     Give karma from one user to other users with some regards to greediness
     """
-    if from_nick in to_nicks:
+    if nick_normalizer(from_nick) in [nick_normalizer(n) for n in to_nicks]:
         return format_message('too_arrogant', nick=from_nick)
 
-    from_record = KarmaRecord.get_for_nick(from_nick)
+    if flood_protection.enabled:
+        # Thanks over the limits are dropped before anything is looked up
+        to_nicks = flood_protection.filter(from_nick, to_nicks)
+        if not to_nicks:
+            logger.debug('Dropped karma from %s over its limits', from_nick)
+            return None
 
-    for to_nick in to_nicks:
-        to_record = KarmaRecord.get_for_nick(to_nick)
-        from_record.give_karma_to(to_record)
+    records = KarmaRecord.get_for_nicks([from_nick] + list(to_nicks))
+    from_record = records[0]
+    from_record.give_karma_to_many(records[1:])
 
     # Return a nicely-formatted message for the recipient(s)
     if len(to_nicks) == 1:
@@ -156,6 +300,7 @@ def give(from_nick, to_nicks):
     return format_message('good_job', nicks=recipients)
 
 
+@instrumentation.operation('alias')
 def alias(requested_by, nick1, nick2):
     """
     Mark a second nick as an alias of a certain nick
@@ -181,10 +326,13 @@ def alias(requested_by, nick1, nick2):
     )
 
 
+@instrumentation.operation('unalias')
 def unalias(requested_by, nick1, nick2):
     """
     Unmark a second nick as an alias of a certain nick
     """
+    nick1 = nick_normalizer(nick1)
+    nick2 = nick_normalizer(nick2)
     if nick1 == nick2:
         return format_message('nope', nick=requested_by)
 
@@ -217,6 +365,29 @@ def unalias(requested_by, nick1, nick2):
     return format_message('unlinked', usera=nick1, userb=nick2)
 
 
+def _get_token_buckets(setting):
+    """
+    Create token buckets for the ``(count, seconds)`` limit in `setting`,
+    or None if it is not set
+    """
+    limit = getattr(settings, setting, None)
+    if not limit:
+        return None
+    count, seconds = limit
+    return TokenBuckets(
+        count,
+        float(count) / seconds,
+        maxsize=getattr(settings, 'KARMA_RATE_LIMIT_SIZE', 50000),
+    )
+
+
+flood_protection = FloodProtection(
+    givers=_get_token_buckets('KARMA_RATE_LIMIT'),
+    pairs=_get_token_buckets('KARMA_PAIR_RATE_LIMIT'),
+    normalize=nick_normalizer,
+)
+
+
 def _handle_command(client, channel, nick, message, command, args):
     """
     The command variant of this plugin
@@ -233,11 +404,25 @@ def _handle_command(client, channel, nick, message, command, args):
 
     # Handle top N karma
     if subcmd == 'top':
-        try:
-            limit = int(args[1])
-        except (IndexError, ValueError):
-            limit = 10
-        return top(limit)
+        limit = 10
+        window = None
+        everywhere = False
+        for arg in args[1:4]:
+            try:
+                limit = int(arg)
+            except ValueError:
+                if arg.lower() == 'global':
+                    everywhere = True
+                elif arg.lower() in WINDOWS:
+                    window = arg.lower()
+        if everywhere:
+            # Karma from every channel, whichever this was asked in
+            with channel_scope(None):
+                return top(limit, window=window, requested_by=nick)
+        return top(limit, window=window, requested_by=nick)
+
+    if subcmd == 'stats':
+        return stats()
 
     if subcmd == 'alias':
         return alias(requested_by=nick, nick1=args[1], nick2=args[2])
@@ -264,38 +449,179 @@ def _handle_match(client, channel, nick, message, matches):
         return karma_given
 
 
+class AutokarmaMatcher(object):
+    """
+    Precompiled matcher for automatic karma.
+
+    Patterns are compiled once and only rebuilt when the configured
+    thanks or invalid-thanks words change.  Messages that neither
+    contain ``++`` nor start with a thanks word are rejected before
+    any regular expression runs.
+    """
+    def __init__(self):
+        self._words = None
+
+    def _get_words(self):
+        thanks_words = getattr(settings,
+                               'KARMA_THANKS_WORDS',
+                               _DEFAULT_THANKS_WORDS)
+        invalid_thanks = getattr(settings,
+                                 'KARMA_INVALID_THANKS',
+                                 _DEFAULT_INVALID_WORDS)
+        return tuple(thanks_words), tuple(invalid_thanks)
+
+    def _compile(self, thanks_words, invalid_thanks):
+        self._skip_pattern = re.compile(
+            r'^({thanks})\s+({invalid}).*$'.format(
+                thanks='|'.join(thanks_words),
+                invalid='|'.join(invalid_thanks),
+            ),
+            re.IGNORECASE,
+        )
+        self._pattern = re.compile(
+            r'^(?:{thanks})[^\w]+({nick}).*$'.format(
+                thanks='|'.join(thanks_words),
+                nick=VALID_NICK_PAT,
+            ),
+            re.IGNORECASE,
+        )
+        # Thanks words are interpolated into the patterns above, so they
+        # may be regular expressions themselves; only literal words can
+        # use the cheap prefix check.
+        if any(set(word) & _REGEX_SPECIAL_CHARS for word in thanks_words):
+            self._thanks_prefixes = None
+        else:
+            self._thanks_prefixes = tuple(
+                word.lower() for word in thanks_words
+            )
+        self._words = (thanks_words, invalid_thanks)
+
+    def _starts_with_thanks(self, message):
+        if self._thanks_prefixes is None:
+            return True
+        return message.lower().startswith(self._thanks_prefixes)
+
+    def __call__(self, message):
+        words = self._get_words()
+        if words != self._words:
+            self._compile(*words)
+
+        has_pp = '++' in message
+        if not has_pp and not self._starts_with_thanks(message):
+            return []
+
+        if self._skip_pattern.findall(message):
+            return None
+
+        matches = self._pattern.findall(message)
+        if matches or not has_pp:
+            return matches
+        return _PP_PATTERN.findall(message)
+
+
+_autokarma_matcher = AutokarmaMatcher()
+
+
 def _autokarma_match(message):
     """
     Match an incoming message for any nicks that should receive auto karma
     """
-    invalid_thanks = getattr(settings,
-                             'KARMA_INVALID_THANKS',
-                             _DEFAULT_INVALID_WORDS)
+    return _autokarma_matcher(message)
 
-    thanks_words = getattr(settings,
-                           'KARMA_THANKS_WORDS',
-                           _DEFAULT_THANKS_WORDS)
 
-    skip_pattern = r'^(?i)({thanks})\s+({invalid}).*$'.format(
-        thanks='|'.join(thanks_words),
-        invalid='|'.join(invalid_thanks),
-    )
-    if re.findall(skip_pattern, message):
+thread_pool = KarmaThreadPool(
+    size=getattr(settings, 'KARMA_THREAD_POOL_SIZE', 4),
+)
+
+
+def _get_namespace(channel):
+    """
+    Get the channel whose karma a request from `channel` works with: its
+    own if `KARMA_CHANNEL_SCOPED` is set, and otherwise (or for private
+    messages) None, for the global namespace
+    """
+    if not getattr(settings, 'KARMA_CHANNEL_SCOPED', False):
         return None
+    if not channel or channel[0] not in '#&':
+        return None
+    return channel
 
-    pattern = r'^(?i)(?:{thanks})[^\w]+({nick}).*$'.format(
-        thanks='|'.join(thanks_words),
-        nick=VALID_NICK_PAT
+
+def handle_request(channel, nick, message, *args):
+    """
+    Handle a karma command or message from `nick` in `channel`, returning
+    the response
+    """
+    fn = _handle_command if len(args) == 2 else _handle_match
+    with channel_scope(_get_namespace(channel)):
+        return fn(None, channel, nick, message, *args)
+
+
+def resolve_request_nicks(channel, nicks):
+    """
+    Get the nicks whose karma a request from `channel` naming `nicks`
+    might change: what they resolve to in the channel's namespace and,
+    as karma given there is added to the global totals, in the global
+    namespace.
+    """
+    namespace = _get_namespace(channel)
+    with channel_scope(namespace):
+        resolved = KarmaRecord.get_actual_nicks(nicks)
+    if namespace is None:
+        return resolved
+    with channel_scope(None):
+        return resolved + KarmaRecord.get_actual_nicks(resolved)
+
+
+def _get_service_client():
+    """
+    Connect to the karma service if `KARMA_SERVICE_SOCKET` is set
+    """
+    path = getattr(settings, 'KARMA_SERVICE_SOCKET', None)
+    if not path:
+        return None
+    from .service import ServiceClient
+    return ServiceClient(
+        path,
+        timeout=getattr(settings, 'KARMA_SERVICE_TIMEOUT', 10.0),
+        batch_size=getattr(settings, 'KARMA_SERVICE_BATCH_SIZE', 100),
     )
-    pp_pattern = r'(?:\w*\s+)*((?![cC]\+\+){nick}\+\+),?(?:\s+|$)'.format(nick=VALID_NICK_PAT)
-    return re.findall(pattern, message) or re.findall(pp_pattern, message)
+
+
+service_client = _get_service_client()
+
+
+def _respond(client, channel, response):
+    """
+    Send a reply computed off the reactor thread
+    """
+    if not response:
+        return
+    if isinstance(response, six.string_types):
+        response = [response]
+    for line in response:
+        client.msg(channel, line)
+
+
+def _log_failure(failure):
+    logger.error('Unable to handle karma request: %s', failure.getTraceback())
 
 
 @match(_autokarma_match)
 @command('karma', aliases=['k', 'thanks', 'motivate', 't', 'm', 'alias', 'unalias'],
          help=('Give and receive karma. Usage: helga ('
-               'k[arma] [(top [num] | [details] [for] [nick] | [un]alias <nick1> <nick2>)] | '
+               'k[arma] [(top [global] [day|week|month] [num] | stats | [details] [for] [nick] | [un]alias <nick1> <nick2>)] | '
                '(t[hanks] | m[otivate]) <nick>)'))
 def karma(client, channel, nick, message, *args):
-    fn = _handle_command if len(args) == 2 else _handle_match
-    return fn(client, channel, nick, message, *args)
+    if service_client is not None:
+        # Waiting on the service must not hold up the reactor either
+        handle = service_client.request
+    elif getattr(settings, 'KARMA_ASYNC', False):
+        handle = handle_request
+    else:
+        return handle_request(channel, nick, message, *args)
+
+    deferred = thread_pool.run(handle, channel, nick, message, *args)
+    deferred.addCallback(lambda response: _respond(client, channel, response))
+    deferred.addErrback(_log_failure)
+    raise ResponseNotReady
@@ -0,0 +1,142 @@
+import collections
+import threading
+import time
+
+import six
+
+
+class TokenBuckets(object):
+    """
+    A token bucket for each of any number of keys, holding up to
+    `capacity` tokens and refilled at `rate` tokens a second.  Taking a
+    token costs the same however many keys are tracked.
+
+    Only buckets that are not full are stored, as ``(tokens, time)``; a
+    key without one has a full bucket.  Buckets are kept in the order they
+    were last taken from, so those that have filled up again are dropped
+    from the front as others are used, and once `maxsize` keys are tracked
+    the least recently used is dropped to make room.
+    """
+    def __init__(self, capacity, rate, maxsize=50000, timer=time.time):
+        self.capacity = capacity
+        self.rate = rate
+        self.maxsize = maxsize
+        self._timer = timer
+        self._buckets = collections.OrderedDict()
+
+    def _refill(self, bucket, now):
+        tokens, updated = bucket
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def _expire(self, now):
+        while self._buckets:
+            key, bucket = next(six.iteritems(self._buckets))
+            if self._refill(bucket, now) < self.capacity:
+                return
+            del self._buckets[key]
+
+    def available(self, key, now=None):
+        """
+        Get the tokens `key`'s bucket holds now.
+        """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        if now is None:
+            now = self._timer()
+        return self._refill(bucket, now)
+
+    def take(self, key, now=None):
+        """
+        Take a token from `key`'s bucket, if it holds one.  Returns
+        whether it did.
+        """
+        if now is None:
+            now = self._timer()
+        tokens = self.available(key, now)
+        if tokens < 1:
+            return False
+
+        self._buckets.pop(key, None)
+        self._expire(now)
+        while len(self._buckets) >= self.maxsize:
+            self._buckets.popitem(last=False)
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+    def clear(self):
+        self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class FloodProtection(object):
+    """
+    Limits how quickly karma can be given: `givers` buckets, keyed by the
+    giver's nick, limit the thanks anyone can give, and `pairs` buckets,
+    keyed by ``(giver, receiver)``, how often they can thank the same
+    nick.  Either may be None for no limit.  Nicks are passed through
+    `normalize` before they are used as keys.
+    """
+    def __init__(
+        self, givers=None, pairs=None, normalize=None, timer=time.time
+    ):
+        self.givers = givers
+        self.pairs = pairs
+        self._normalize = normalize or (lambda nick: nick)
+        self._timer = timer
+        self._lock = threading.Lock()
+
+        self.allowed = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self):
+        return self.givers is not None or self.pairs is not None
+
+    def filter(self, giver, receivers):
+        """
+        Get the `receivers` that `giver` may thank now, in order, taking a
+        token from each bucket involved.  A nick thanked more than once is
+        only thanked once.
+        """
+        receivers = list(receivers)
+        if not self.enabled:
+            return receivers
+
+        giver = self._normalize(giver)
+        allowed = []
+        seen = set()
+        with self._lock:
+            now = self._timer()
+            for receiver in receivers:
+                pair = (giver, self._normalize(receiver))
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                if self._take(giver, pair, now):
+                    allowed.append(receiver)
+                    self.allowed += 1
+                else:
+                    self.rejected += 1
+        return allowed
+
+    def _take(self, giver, pair, now):
+        # Take a token from both buckets, or from neither
+        if self.givers is not None and self.givers.available(giver, now) < 1:
+            return False
+        if self.pairs is not None and not self.pairs.take(pair, now):
+            return False
+        if self.givers is not None:
+            self.givers.take(giver, now)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'rejected': self.rejected,
+                'givers': len(self.givers) if self.givers is not None else 0,
+                'pairs': len(self.pairs) if self.pairs is not None else 0,
+            }
@@ -0,0 +1,167 @@
+"""
+Rebuilding karma totals from the ``karma_event`` log.
+
+Every change to karma is recorded as one of these events, each with the
+`time` it happened:
+
+* ``give``: `giver` thanked `receiver`, who gained `value` karma;
+  `last_received` is the receiver's new `last_received`, which is kept in
+  local time where `time` is UTC
+* ``merge``: all of `alias`'s karma moved to `nick`, as when aliasing
+  two nicks
+* ``split``: `alias`'s karma from before it was merged, stored as
+  `record`, moved back out of `nick`
+
+A snapshot holds every karma user as it was at one moment; replaying
+folds the events since the latest snapshot over it, a chunk at a time,
+so that totals can be rebuilt without keeping the log in memory.
+"""
+import datetime
+import itertools
+from time import sleep
+
+
+COUNTERS = ('given', 'received', 'value')
+TIMESTAMPS = ('last_given', 'last_received')
+
+_MILLISECOND = datetime.timedelta(milliseconds=1)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _later(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return max(first, second)
+
+
+def get_snapshot_time(now=None):
+    """
+    Get the first whole millisecond after `now`.  Mongo keeps datetimes
+    to the millisecond, so snapshots are taken on one to compare the same
+    way with event times on every backend.
+    """
+    now = now or datetime.datetime.utcnow()
+    return now.replace(
+        microsecond=now.microsecond // 1000 * 1000,
+    ) + _MILLISECOND
+
+
+def take_snapshot(backend, time=None):
+    """
+    Store every user in `backend` as its latest snapshot, taken at `time`
+    (now, by default), and return that time.  Changes made while the
+    snapshot is being taken may be counted twice, or not at all, by a
+    later replay.
+    """
+    if time is None:
+        time = get_snapshot_time()
+        # Let the snapshot's millisecond pass, so that nothing logged from
+        # now on can share its time
+        while datetime.datetime.utcnow() < time + _MILLISECOND:
+            sleep(0.001)
+    backend.save_snapshot(time, backend.iter_users())
+    return time
+
+
+class Replay(object):
+    """
+    Karma totals by nick, folded from a snapshot and the events after it.
+
+    `removed` holds the nicks whose karma was merged into another; their
+    users should no longer exist.
+    """
+    def __init__(self, users=()):
+        self.totals = {}
+        self.removed = set()
+        self.events = 0
+        for user in users:
+            self.totals[user['nick']] = dict(user)
+
+    def _get(self, nick, time):
+        self.removed.discard(nick)
+        if nick not in self.totals:
+            self.totals[nick] = {
+                'nick': nick,
+                'given': 0,
+                'received': 0,
+                'value': 0,
+                'created': time,
+                'last_given': None,
+                'last_received': None,
+            }
+        return self.totals[nick]
+
+    def fold(self, events):
+        """
+        Apply `events`, oldest first, to the totals.
+        """
+        for event in events:
+            getattr(self, '_fold_' + event['type'])(event)
+            self.events += 1
+
+    def _fold_give(self, event):
+        giver = self._get(event['giver'], event['time'])
+        giver['given'] = giver.get('given', 0) + 1
+        giver['last_given'] = event['time']
+
+        receiver = self._get(event['receiver'], event['time'])
+        receiver['received'] = receiver.get('received', 0) + 1
+        receiver['value'] = receiver.get('value', 0) + event['value']
+        # Logged before last_received was, events may not have it
+        receiver['last_received'] = event.get('last_received', event['time'])
+
+    def _fold_merge(self, event):
+        other = self.totals.pop(event['alias'], None)
+        self.removed.add(event['alias'])
+        if not other:
+            return
+        record = self._get(event['nick'], event['time'])
+        for key in COUNTERS:
+            record[key] = record.get(key, 0) + other.get(key, 0)
+        for key in TIMESTAMPS:
+            record[key] = _later(record.get(key), other.get(key))
+
+    def _fold_split(self, event):
+        other = dict(event['record'])
+        record = self._get(event['nick'], event['time'])
+        for key in COUNTERS:
+            record[key] = record.get(key, 0) - other.get(key, 0)
+
+        self.removed.discard(event['alias'])
+        self.totals[event['alias']] = other
+
+
+def replay(backend, batch_size=1000):
+    """
+    Fold the events stored in `backend` since its latest snapshot over
+    that snapshot, `batch_size` events at a time.
+    """
+    since, users = backend.get_snapshot()
+    result = Replay(users)
+    for events in _chunks(backend.iter_events(since=since), batch_size):
+        result.fold(events)
+    return result
+
+
+def rebuild(backend, batch_size=1000):
+    """
+    Replace the users in `backend` with the totals replayed from its
+    snapshot and event log, `batch_size` users at a time.  Users that
+    appear in neither are left alone.  Returns the `Replay`.
+    """
+    result = replay(backend, batch_size=batch_size)
+    for users in _chunks(result.totals.values(), batch_size):
+        backend.save_users(users)
+    for nick in result.removed:
+        backend.remove_user(nick)
+    return result
@@ -0,0 +1,268 @@
+"""
+A karma service shared by several helga instances.
+
+``helga-karma serve`` handles karma requests in one process, listening on
+a Unix socket.  Bots with `KARMA_SERVICE_SOCKET` set forward every karma
+request to it rather than handling it themselves, so that one set of
+caches serves all of them and two bots never write the same nick's karma
+at once.
+
+Each line sent to the service is a JSON array of requests, each of them
+``[channel, nick, message, args]``, and is answered by a line holding a
+``[error, response]`` array for each request, in the same order.
+"""
+import contextlib
+import json
+import os
+import socket
+import threading
+
+from six.moves import socketserver
+
+from helga import log
+
+
+logger = log.getLogger(__name__)
+
+
+class ServiceError(Exception):
+    pass
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def _decode(line):
+    return json.loads(line.decode('utf-8'))
+
+
+class ShardLocks(object):
+    """
+    Locks for `count` shards of nicks.  Requests hold the locks of the
+    shards of every nick whose karma they might change, so requests about
+    the same nick are handled one at a time while others go ahead.
+    """
+    def __init__(self, count=16):
+        self._locks = [threading.Lock() for _ in range(count)]
+
+    def get_shards(self, keys):
+        return sorted(set(hash(key) % len(self._locks) for key in keys))
+
+    @contextlib.contextmanager
+    def locked(self, keys):
+        # Always taken in shard order, so that requests cannot deadlock
+        shards = self.get_shards(keys)
+        for shard in shards:
+            self._locks[shard].acquire()
+        try:
+            yield
+        finally:
+            for shard in reversed(shards):
+                self._locks[shard].release()
+
+
+def get_request_nicks(nick, args):
+    """
+    Get every word a request from `nick` with `args` might use as a nick;
+    naming a few words that are not nicks only costs some extra locking.
+    """
+    words = [nick]
+    for arg in args:
+        if isinstance(arg, list):
+            words.extend(arg)
+        else:
+            words.append(arg)
+    return [word.rstrip('+,') for word in words if word]
+
+
+class KarmaService(object):
+    """
+    Answers karma requests with `handler`, called as ``handler(channel,
+    nick, message, *args)``, from one thread per connected bot.
+
+    The words a request might use as nicks are passed, with its channel,
+    through `resolve` before they are sharded, so that it can map aliases
+    (and look-alike nicks) to the nicks whose karma they change.
+    """
+    def __init__(self, path, handler, resolve=None, shards=16):
+        self.path = path
+        self.handler = handler
+        self.locks = ShardLocks(shards)
+        self._resolve = resolve or (lambda channel, nicks: nicks)
+        self._server = None
+
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+
+    def handle(self, request):
+        """
+        Handle a single ``[channel, nick, message, args]`` request,
+        returning its ``[error, response]``.
+        """
+        channel, nick, message, args = request
+        try:
+            nicks = self._resolve(channel, get_request_nicks(nick, args))
+            with self.locks.locked(nicks):
+                return [None, self.handler(channel, nick, message, *args)]
+        except Exception as error:
+            logger.exception('Unable to handle karma request %r', request)
+            self.errors += 1
+            return [str(error) or error.__class__.__name__, None]
+        finally:
+            self.requests += 1
+
+    def handle_batch(self, requests):
+        self.batches += 1
+        return [self.handle(request) for request in requests]
+
+    def _get_server(self):
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in iter(self.rfile.readline, b''):
+                    self.wfile.write(_encode(
+                        service.handle_batch(_decode(line))
+                    ))
+
+        class Server(
+            socketserver.ThreadingMixIn,
+            socketserver.UnixStreamServer,
+        ):
+            daemon_threads = True
+
+        return Server(self.path, Handler)
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except socket.error:
+            # Left behind by a service that did not shut down cleanly
+            os.unlink(self.path)
+        else:
+            raise ServiceError(
+                'A karma service is already listening on {}'.format(
+                    self.path,
+                )
+            )
+        finally:
+            probe.close()
+
+    def serve_forever(self):
+        self._remove_stale_socket()
+        self._server = self._get_server()
+        logger.info('Serving karma on %s', self.path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.unlink(self.path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'errors': self.errors,
+        }
+
+
+class _Waiter(object):
+    def __init__(self, request):
+        self.request = request
+        self.done = False
+        self.error = None
+        self.response = None
+
+    def set(self, error, response):
+        self.error = error
+        self.response = response
+        self.done = True
+
+
+class ServiceClient(object):
+    """
+    Sends karma requests to a `KarmaService` listening at `path`.
+
+    Requests made from several threads at once are sent together, up to
+    `batch_size` in a batch, by whichever thread gets to the socket first.
+    A request whose batch fails is not retried, since the service may have
+    handled it already.
+    """
+    def __init__(self, path, timeout=10.0, batch_size=100):
+        self.path = path
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+        self._socket_lock = threading.Lock()
+        self._socket = None
+        self._file = None
+
+    def request(self, channel, nick, message, *args):
+        """
+        Have the service handle a request, returning its response.
+        """
+        waiter = _Waiter([channel, nick, message, list(args)])
+        with self._lock:
+            self._pending.append(waiter)
+        while True:
+            with self._socket_lock:
+                if waiter.done:
+                    break
+                with self._lock:
+                    batch = self._pending[:self.batch_size]
+                    self._pending = self._pending[self.batch_size:]
+                self._send(batch)
+
+        if waiter.error is not None:
+            raise ServiceError(waiter.error)
+        return waiter.response
+
+    def _connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+            connection.connect(self.path)
+        except socket.error:
+            connection.close()
+            raise
+        self._socket = connection
+        self._file = connection.makefile('rb')
+
+    def _send(self, batch):
+        try:
+            if self._socket is None:
+                self._connect()
+            self._socket.sendall(_encode([
+                waiter.request for waiter in batch
+            ]))
+            line = self._file.readline()
+            if not line:
+                raise ServiceError('The karma service closed the connection')
+            responses = _decode(line)
+        except (socket.error, ServiceError, ValueError) as error:
+            logger.exception('Unable to reach the karma service')
+            self.close()
+            message = str(error) or 'Unable to reach the karma service'
+            for waiter in batch:
+                waiter.set(message, None)
+            return
+
+        for waiter, (error, response) in zip(batch, responses):
+            waiter.set(error, response)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = self._file = None
@@ -0,0 +1,51 @@
+import threading
+
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+
+class KarmaThreadPool(object):
+    """
+    A bounded pool of threads for running blocking karma operations off
+    the reactor thread.
+
+    The pool is started the first time it is used, so nothing is started
+    unless something is run in it, and is stopped when the reactor shuts
+    down.  At most `size` operations run at once; the rest wait for a
+    free thread.
+    """
+    def __init__(self, size=4, reactor=reactor):
+        self.size = size
+        self._reactor = reactor
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                pool = ThreadPool(0, self.size, 'helga-karma')
+                pool.start()
+                self._reactor.addSystemEventTrigger(
+                    'during', 'shutdown', self.stop,
+                )
+                self._pool = pool
+            return self._pool
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Call `fn` in the pool, returning a Deferred that fires (on the
+        reactor thread) with its result.
+        """
+        return threads.deferToThreadPool(
+            self._reactor,
+            self._get_pool(),
+            fn,
+            *args,
+            **kwargs
+        )
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.stop()
@@ -0,0 +1,78 @@
+"""
+Streaming export and import of karma data as newline-delimited JSON.
+
+Each line holds one document and the collection it belongs to::
+
+    {"collection": "karma_user", "document": {"nick": "somebody", ...}}
+
+Documents are read and written one batch at a time, so memory use does not
+grow with the size of the data.
+"""
+from .documents import dumps, loads
+
+
+COLLECTIONS = ('karma_user', 'karma_link')
+
+
+def _get_line(collection, document):
+    return u'{{"collection": "{}", "document": {}}}\n'.format(
+        collection,
+        dumps(document),
+    ).encode('utf-8')
+
+
+def export_karma(backend, out):
+    """
+    Write every karma user and link stored in `backend` to the binary
+    file `out`.  Returns the number of documents written per collection.
+    """
+    counts = {}
+    for collection, documents in (
+        ('karma_user', backend.iter_users()),
+        ('karma_link', backend.iter_links()),
+    ):
+        counts[collection] = 0
+        for document in documents:
+            out.write(_get_line(collection, document))
+            counts[collection] += 1
+    return counts
+
+
+def import_karma(backend, lines, batch_size=1000):
+    """
+    Store the documents in `lines` (as written by `export_karma`) in
+    `backend`, `batch_size` documents at a time, replacing any users or
+    links with the same nicks.  Returns the number of documents stored per
+    collection.
+    """
+    savers = {
+        'karma_user': backend.save_users,
+        'karma_link': backend.save_links,
+    }
+    batches = dict((collection, []) for collection in COLLECTIONS)
+    counts = dict((collection, 0) for collection in COLLECTIONS)
+
+    def save(collection):
+        savers[collection](batches[collection])
+        counts[collection] += len(batches[collection])
+        batches[collection] = []
+
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        entry = loads(line)
+        collection = entry.get('collection')
+        if collection not in savers:
+            raise ValueError(
+                'Unknown collection {!r} on line {}'.format(collection, number)
+            )
+        batches[collection].append(entry['document'])
+        if len(batches[collection]) >= batch_size:
+            save(collection)
+
+    for collection in COLLECTIONS:
+        if batches[collection]:
+            save(collection)
+    return counts
@@ -0,0 +1,53 @@
+"""
+Helpers for the mongo-style update documents used throughout helga-karma.
+
+Only the ``$inc``, ``$set`` and ``$max`` operators (and ``$setOnInsert``
+when upserting) are used, so they are easy to apply to in-memory records
+and to merge together when writes are deferred.
+"""
+import six
+
+
+def merge_update(existing, update):
+    """
+    Merge the ``$inc``, ``$set`` and ``$max`` operations of a mongo update
+    document into ``existing``.
+    """
+    for operator, fields in six.iteritems(update):
+        merged = existing.setdefault(operator, {})
+        for key, value in six.iteritems(fields):
+            if operator == '$inc':
+                merged[key] = merged.get(key, 0) + value
+            elif operator == '$max' and key in merged:
+                merged[key] = max(merged[key], value)
+            else:
+                merged[key] = value
+    return existing
+
+
+def apply_update(record, update):
+    """
+    Apply the ``$inc``, ``$set`` and ``$max`` operations of a mongo update
+    document to an in-memory record dictionary.
+    """
+    for operator, fields in six.iteritems(update):
+        for key, value in six.iteritems(fields):
+            if operator == '$inc':
+                record[key] = record.get(key, 0) + value
+            elif operator == '$max':
+                if record.get(key) is None or value > record[key]:
+                    record[key] = value
+            elif operator == '$set':
+                record[key] = value
+    return record
+
+
+def apply_upsert(record, nick, update):
+    """
+    Apply an upsert to `record`, which is None if no record for `nick`
+    exists yet; returns the updated (or created) record.
+    """
+    if record is None:
+        record = {'nick': nick}
+        record.update(update.get('$setOnInsert', {}))
+    return apply_update(record, update)
@@ -0,0 +1,186 @@
+"""
+Warm-start files: the karma caches saved to local disk, so that a
+restarted bot can answer from them straight away rather than from the
+database.
+
+A file starts with a small header::
+
+    HKWS <header length: uint32> <header: JSON>
+
+The header holds the time the file was saved and, for each channel
+(``""`` for the global namespace), where its section starts and how long
+it is, counted from the end of the header.  Each section is a
+zlib-compressed JSON document of that channel's caches (see
+`helga_karma.documents` for how datetimes are stored)::
+
+    {"aliases": [[nick, real_nick], ...], "records": [[nick, document], ...],
+     "top": [document, ...], "complete": bool}
+
+Cache entries are listed least recently used first, so that they are
+restored in the same order.
+
+Files are memory-mapped when read, so only the sections being decoded
+are read from disk, and replaced atomically when written.
+"""
+import datetime
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from helga import log
+
+from .documents import dumps, format_datetime, loads, parse_datetime
+
+
+logger = log.getLogger(__name__)
+
+
+MAGIC = b'HKWS'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sI')
+
+
+def save(path, channels, saved=None):
+    """
+    Write the caches of `channels`, a dict of channel to section
+    document, to `path`, as of `saved` (now, by default).
+    """
+    saved = saved or datetime.datetime.utcnow()
+    sections = []
+    index = {}
+    offset = 0
+    for channel, section in channels.items():
+        data = zlib.compress(dumps(section).encode('utf-8'))
+        index[channel or ''] = [offset, len(data)]
+        sections.append(data)
+        offset += len(data)
+
+    header = json.dumps({
+        'version': VERSION,
+        'saved': format_datetime(saved),
+        'sections': index,
+    }).encode('utf-8')
+
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as out:
+        out.write(_HEADER.pack(MAGIC, len(header)))
+        out.write(header)
+        for data in sections:
+            out.write(data)
+    os.rename(temporary, path)
+
+
+class WarmStart(object):
+    """
+    A warm-start file read through a memory map; `saved` is the time it
+    was saved.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as in_:
+            self._map = mmap.mmap(in_.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, length = _HEADER.unpack(self._map[:_HEADER.size])
+            if magic != MAGIC:
+                raise ValueError('{} is not a warm-start file'.format(path))
+            header = json.loads(
+                self._map[_HEADER.size:_HEADER.size + length].decode('utf-8')
+            )
+            if header['version'] != VERSION:
+                raise ValueError(
+                    'Unsupported warm-start version {}'.format(
+                        header['version'],
+                    )
+                )
+        except Exception:
+            self._map.close()
+            raise
+        self.saved = parse_datetime(header['saved'])
+        self._start = _HEADER.size + length
+        self._sections = header['sections']
+
+    def channels(self):
+        return [channel or None for channel in self._sections]
+
+    def get(self, channel):
+        """
+        Decode the section of `channel`, or None if it has none.
+        """
+        try:
+            offset, length = self._sections[channel or '']
+        except KeyError:
+            return None
+        start = self._start + offset
+        data = zlib.decompress(self._map[start:start + length])
+        return loads(data.decode('utf-8'))
+
+    def close(self):
+        self._map.close()
+
+
+def load(path):
+    """
+    Open the warm-start file at `path`, or return None if there is none
+    or it cannot be read.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        return WarmStart(path)
+    except Exception:
+        logger.exception('Unable to read the karma warm-start file %s', path)
+        return None
+
+
+class PeriodicSave(object):
+    """
+    Calls `save` from a background thread every `interval` seconds, and
+    once more when stopped.
+    """
+    def __init__(self, save, interval=300):
+        self.interval = interval
+        self._save = save
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run,
+            name='helga-karma-warm-start',
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None, final=True):
+        """
+        Stop the worker thread, then save once more unless `final` is
+        false.
+        """
+        self._stopping.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+        if final:
+            self.save()
+
+    def save(self):
+        started = time.time()
+        try:
+            self._save()
+        except Exception:
+            logger.exception('Unable to save the karma warm-start file')
+        else:
+            logger.debug(
+                'Saved the karma warm-start file in %.1fms',
+                (time.time() - started) * 1000,
+            )
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.save()
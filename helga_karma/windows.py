@@ -0,0 +1,82 @@
+"""
+Karma received per nick in hourly and daily buckets, for leaderboards
+over recent windows of time (``!karma top week``).
+
+Every thanks adds its value to the receiver's current hourly and daily
+buckets, so that a windowed top only has to add up the buckets inside
+the window.  Buckets expire once no window reaches back to them.
+"""
+import collections
+import datetime
+
+
+GRANULARITIES = {
+    'hour': datetime.timedelta(hours=1),
+    'day': datetime.timedelta(days=1),
+}
+
+# Each window adds up this many of the latest buckets of a granularity,
+# the current (partly filled) one included
+WINDOWS = {
+    'day': ('hour', 24),
+    'week': ('day', 7),
+    'month': ('day', 30),
+}
+
+# How long a bucket is kept, counted from its start
+RETENTION = dict(
+    (
+        granularity,
+        length * max(
+            count for name, count in WINDOWS.values() if name == granularity
+        ),
+    )
+    for granularity, length in GRANULARITIES.items()
+)
+
+
+# Identifies the bucket an increment is added to, as when increments are
+# queued for writing
+Bucket = collections.namedtuple(
+    'Bucket', ['nick', 'granularity', 'start', 'expires'],
+)
+
+
+def get_bucket_start(time, granularity):
+    start = time.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        start = start.replace(hour=0)
+    return start
+
+
+def get_increments(nick, value, time):
+    """
+    Get the bucket increments for `nick` receiving `value` karma at
+    `time`, one per granularity.
+    """
+    increments = []
+    for granularity in sorted(GRANULARITIES):
+        start = get_bucket_start(time, granularity)
+        increments.append({
+            'nick': nick,
+            'granularity': granularity,
+            'start': start,
+            'expires': start + RETENTION[granularity],
+            'value': value,
+            'received': 1,
+        })
+    return increments
+
+
+def get_window(window, now=None):
+    """
+    Get the granularity of the buckets making up `window`, and the start
+    of the oldest of them.
+    """
+    granularity, count = WINDOWS[window]
+    now = now or datetime.datetime.utcnow()
+    since = (
+        get_bucket_start(now, granularity)
+        - GRANULARITIES[granularity] * (count - 1)
+    )
+    return granularity, since
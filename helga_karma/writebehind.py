@@ -0,0 +1,226 @@
+import collections
+import contextlib
+import copy
+import threading
+import time
+
+from helga import log
+
+
+logger = log.getLogger(__name__)
+
+
+class WriteBehindQueue(object):
+    """
+    Applies karma_user updates from a background thread.
+
+    Updates queued for the same nick are merged while they wait, so a
+    flush writes at most one update per nick.  `writer` is called with a
+    list of ``(nick, update)`` pairs; when it fails, the batch is put back
+    and retried on the next flush.
+
+    The worker waits until the oldest waiting update is `window` seconds
+    old (or `batch_size` nicks are waiting) before flushing, giving bursts
+    of karma for the same nick time to coalesce into one write.  Once
+    `maxsize` nicks are waiting, `put` writes updates for other nicks
+    straight away, from the calling thread, rather than wait for the
+    worker to catch up.
+
+    If `group` is given, each batch is split by ``group(key)`` and the
+    writer called once per group; when one fails, it and the groups after
+    it are put back, while those already written are not written again.
+
+    An update is either written or pending, never both: readers combining
+    what has been written with `pending` do both inside `reading`, which
+    holds off writes until they are done.
+    """
+    def __init__(
+        self, writer, merge, maxsize=10000, batch_size=500, window=0.25,
+        retry_interval=1.0, group=None, timer=time.time
+    ):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.window = window
+        self.retry_interval = retry_interval
+
+        self._writer = writer
+        self._merge = merge
+        self._group = group
+        self._timer = timer
+        self._pending = collections.OrderedDict()
+        self._window_started = None
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+
+        self.queued = 0
+        self.overflowed = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.failures = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run,
+                name='helga-karma-write-behind',
+            )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker thread and write out everything still queued.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+        self.flush()
+
+    def put(self, nick, update):
+        with self._condition:
+            if (
+                nick in self._pending
+                or len(self._pending) < self.maxsize
+                or self._stopping
+            ):
+                if not self._pending:
+                    self._window_started = self._timer()
+                self._merge(self._pending.setdefault(nick, {}), update)
+                self.queued += 1
+                self._condition.notify_all()
+                return
+            self.overflowed += 1
+
+        logger.warning(
+            'Karma write-behind queue is full; writing %s directly', nick,
+        )
+        with self._write_lock:
+            self._writer([(nick, update)])
+
+    def pending(self, nick):
+        """
+        Get the merged update waiting to be written for `nick`, if there
+        is one.  Updates already being written are not included.
+        """
+        with self._condition:
+            update = self._pending.get(nick)
+            if not update:
+                return None
+            return copy.deepcopy(update)
+
+    @contextlib.contextmanager
+    def reading(self):
+        """
+        Hold off writes until the block exits, waiting for one under way
+        to finish first.  Must not be used from `writer`.
+        """
+        with self._write_lock:
+            yield
+
+    def flush(self, limit=None):
+        """
+        Write up to `limit` pending updates (all of them by default) from
+        the calling thread.  Returns False if the write failed.
+        """
+        with self._write_lock:
+            with self._condition:
+                batch = []
+                while self._pending and (limit is None or len(batch) < limit):
+                    batch.append(self._pending.popitem(last=False))
+                self._condition.notify_all()
+            if not batch:
+                return True
+
+            started = self._timer()
+            groups = self._get_groups(batch)
+            for index, group in enumerate(groups):
+                try:
+                    self._writer(group)
+                except Exception:
+                    unwritten = [
+                        item for group in groups[index:] for item in group
+                    ]
+                    logger.exception(
+                        'Unable to write %s karma updates; will retry',
+                        len(unwritten),
+                    )
+                    self._requeue(unwritten)
+                    self.failures += 1
+                    return False
+                self.flushed += len(group)
+
+            latency = self._timer() - started
+            self.flushes += 1
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            logger.debug(
+                'Wrote %s karma updates in %.1fms',
+                len(batch),
+                latency * 1000,
+            )
+            return True
+
+    def _get_groups(self, batch):
+        if self._group is None:
+            return [batch]
+        groups = collections.OrderedDict()
+        for key, update in batch:
+            groups.setdefault(self._group(key), []).append((key, update))
+        return list(groups.values())
+
+    def _requeue(self, batch):
+        with self._condition:
+            pending = collections.OrderedDict(batch)
+            for nick, update in self._pending.items():
+                self._merge(pending.setdefault(nick, {}), update)
+            self._pending = pending
+
+    def _wait_for_batch(self):
+        with self._condition:
+            while not self._pending and not self._stopping:
+                self._condition.wait()
+            if self._stopping:
+                return False
+
+            deadline = self._window_started + self.window
+            while (
+                self._pending
+                and not self._stopping
+                and len(self._pending) < self.batch_size
+            ):
+                remaining = deadline - self._timer()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            # Whoever flushed meanwhile may have left nothing to write
+            return not self._stopping
+
+    def _run(self):
+        while self._wait_for_batch():
+            if not self.flush(limit=self.batch_size):
+                time.sleep(self.retry_interval)
+
+    def stats(self):
+        with self._condition:
+            depth = len(self._pending)
+        return {
+            'depth': depth,
+            'queued': self.queued,
+            'overflowed': self.overflowed,
+            'flushes': self.flushes,
+            'flushed': self.flushed,
+            'failures': self.failures,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+        }
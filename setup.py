@@ -32,7 +32,10 @@ setup(
     entry_points={
         'helga_plugins': [
             'karma = helga_karma.plugin:karma',
-        ]
+        ],
+        'console_scripts': [
+            'helga-karma = helga_karma.cli:main',
+        ],
     },
     install_requires=requirements,
     tests_require=[
@@ -0,0 +1,6 @@
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,70 @@
+from helga_karma.aliases import resolve_nicks
+from helga_karma.backends import MemoryBackend
+
+
+class TestResolveNicks(object):
+
+    def setup(self):
+        self.backend = MemoryBackend()
+        self.queries = 0
+
+        find_links = self.backend.find_links
+
+        def counting_find_links(nicks):
+            self.queries += 1
+            return find_links(nicks)
+        self.backend.find_links = counting_find_links
+
+    def link(self, nick, real_nick):
+        self.backend.insert_link({'nick': nick, 'real_nick': real_nick})
+
+    def test_unlinked(self):
+        assert resolve_nicks(self.backend, ['alpha']) == {'alpha': 'alpha'}
+        assert self.queries == 1
+
+    def test_one_level(self):
+        self.link('beta', 'alpha')
+        self.link('gamma', 'alpha')
+
+        assert resolve_nicks(self.backend, ['beta', 'gamma', 'alpha']) == {
+            'alpha': 'alpha',
+            'beta': 'alpha',
+            'gamma': 'alpha',
+        }
+        assert self.queries == 2
+
+    def test_chains(self):
+        self.link('delta', 'gamma')
+        self.link('gamma', 'beta')
+        self.link('beta', 'alpha')
+
+        assert resolve_nicks(self.backend, ['delta', 'gamma']) == {
+            'delta': 'alpha',
+            'gamma': 'alpha',
+        }
+        # One query per level, not per nick
+        assert self.queries == 4
+
+    def test_loops(self):
+        self.link('gamma', 'beta')
+        self.link('beta', 'delta')
+        self.link('delta', 'gamma')
+
+        assert resolve_nicks(self.backend, ['gamma', 'beta', 'delta']) == {
+            'beta': 'beta',
+            'gamma': 'beta',
+            'delta': 'beta',
+        }
+
+    def test_linked_to_itself(self):
+        self.link('alpha', 'alpha')
+
+        assert resolve_nicks(self.backend, ['alpha']) == {'alpha': 'alpha'}
+
+    def test_max_depth(self):
+        for idx in range(10):
+            self.link('nick%d' % (idx + 1), 'nick%d' % idx)
+
+        assert resolve_nicks(self.backend, ['nick10'], max_depth=3) == {
+            'nick10': 'nick7',
+        }
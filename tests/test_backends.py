@@ -0,0 +1,358 @@
+import datetime
+
+import mock
+import mongomock
+
+
+class BackendTests(object):
+
+    def get_backend(self):
+        raise NotImplementedError()
+
+    def setup(self):
+        self.backend = self.get_backend()
+
+    def _upsert(self, nick, **fields):
+        self.backend.update_users([
+            (nick, {'$set': fields, '$setOnInsert': {'given': 0}}),
+        ])
+
+    def test_find_users(self):
+        self._upsert('alpha', value=10)
+        self._upsert('beta', value=5)
+
+        users = self.backend.find_users(['alpha', 'gamma'])
+
+        assert len(users) == 1
+        assert users[0]['nick'] == 'alpha'
+        assert users[0]['value'] == 10
+        assert users[0]['given'] == 0
+
+    def test_update_users(self):
+        created = datetime.datetime(2015, 1, 1, 12, 30, 15, 1000)
+        self.backend.update_users([
+            ('alpha', {
+                '$inc': {'value': 2},
+                '$setOnInsert': {'created': created},
+            }),
+            ('alpha', {'$inc': {'value': 3}, '$set': {'given': 1}}),
+        ])
+
+        user = self.backend.find_users(['alpha'])[0]
+        assert user['value'] == 5
+        assert user['given'] == 1
+        assert user['created'] == created
+
+    def test_update_users_max(self):
+        earlier = datetime.datetime(2015, 1, 1)
+        later = datetime.datetime(2015, 1, 2)
+        self._upsert('alpha', last_given=later)
+
+        self.backend.update_users([
+            ('alpha', {'$max': {'last_given': earlier}}),
+        ])
+
+        assert self.backend.find_users(['alpha'])[0]['last_given'] == later
+
+    def test_get_top_users(self):
+        self._upsert('alpha', value=10)
+        self._upsert('beta', value=30)
+        self._upsert('gamma', value=20)
+
+        top = self.backend.get_top_users(2)
+
+        assert [user['nick'] for user in top] == ['beta', 'gamma']
+
+    def test_save_and_remove_user(self):
+        self.backend.save_user({'nick': 'alpha', 'value': 10, 'given': 1})
+        self.backend.save_user({'nick': 'alpha', 'value': 20})
+
+        user = self.backend.find_users(['alpha'])[0]
+        assert user['value'] == 20
+        assert 'given' not in user
+
+        self.backend.remove_user('alpha')
+        assert self.backend.find_users(['alpha']) == []
+
+    def test_links(self):
+        self.backend.insert_link({
+            'nick': 'beta',
+            'real_nick': 'alpha',
+            'record': {'nick': 'beta', 'value': 1},
+            'aliases': [],
+        })
+        self.backend.insert_link({'nick': 'gamma', 'real_nick': 'alpha'})
+
+        assert self.backend.find_link('beta')['record']['value'] == 1
+        assert self.backend.find_link('delta') is None
+        assert len(self.backend.find_links(['beta', 'delta'])) == 1
+        assert set(
+            link['nick'] for link in self.backend.find_links_to('alpha')
+        ) == set(['beta', 'gamma'])
+
+        link = self.backend.find_link('gamma')
+        link['real_nick'] = 'beta'
+        self.backend.replace_link(link)
+        assert self.backend.find_link('gamma')['real_nick'] == 'beta'
+
+        self.backend.remove_link('beta')
+        assert self.backend.find_link('beta') is None
+
+    def test_repoint_links(self):
+        for nick in ['beta', 'gamma', 'delta']:
+            self.backend.insert_link({
+                'nick': nick,
+                'real_nick': 'alpha',
+                'record': {'nick': nick, 'value': 1},
+            })
+        self.backend.insert_link({'nick': 'zeta', 'real_nick': 'epsilon'})
+
+        self.backend.repoint_links('alpha', 'omega', ['beta', 'gamma'])
+        assert self.backend.find_link('beta')['real_nick'] == 'omega'
+        assert self.backend.find_link('gamma')['record']['value'] == 1
+        assert self.backend.find_link('delta')['real_nick'] == 'alpha'
+
+        self.backend.repoint_links('alpha', 'omega')
+        assert set(
+            link['nick'] for link in self.backend.find_links_to('omega')
+        ) == set(['beta', 'gamma', 'delta'])
+        assert self.backend.find_link('zeta')['real_nick'] == 'epsilon'
+
+    def test_iter(self):
+        for idx in range(5):
+            self._upsert('user%d' % idx, value=idx)
+        self.backend.insert_link({'nick': 'beta', 'real_nick': 'user1'})
+
+        assert sorted(
+            user['nick'] for user in self.backend.iter_users()
+        ) == ['user%d' % idx for idx in range(5)]
+        assert [
+            link['nick'] for link in self.backend.iter_links()
+        ] == ['beta']
+
+    def test_save_many(self):
+        self._upsert('alpha', value=10, given=5)
+        self.backend.save_users([
+            {'nick': 'alpha', 'value': 1},
+            {'nick': 'beta', 'value': 2},
+        ])
+        self.backend.save_links([
+            {'nick': 'gamma', 'real_nick': 'alpha'},
+            {'nick': 'delta', 'real_nick': 'beta'},
+        ])
+        self.backend.save_links([{'nick': 'gamma', 'real_nick': 'beta'}])
+
+        users = dict(
+            (user['nick'], user)
+            for user in self.backend.find_users(['alpha', 'beta'])
+        )
+        assert users['alpha']['value'] == 1
+        assert 'given' not in users['alpha']
+        assert users['beta']['value'] == 2
+        assert set(
+            link['nick'] for link in self.backend.find_links_to('beta')
+        ) == set(['gamma', 'delta'])
+
+    def test_events(self):
+        start = datetime.datetime(2020, 1, 1)
+        self.backend.insert_events([
+            {'type': 'give', 'giver': 'alpha', 'receiver': 'beta',
+             'value': 1.0, 'time': start + datetime.timedelta(seconds=idx)}
+            for idx in [2, 0, 1]
+        ])
+        self.backend.insert_events([])
+
+        assert [
+            event['time'].second for event in self.backend.iter_events()
+        ] == [0, 1, 2]
+        events = list(self.backend.iter_events(since=start))
+        assert [event['time'].second for event in events] == [1, 2]
+        assert events[0]['receiver'] == 'beta'
+        assert '_id' not in events[0]
+
+    def test_snapshot(self):
+        assert self.backend.get_snapshot()[0] is None
+        assert list(self.backend.get_snapshot()[1]) == []
+
+        first = datetime.datetime(2020, 1, 1)
+        second = datetime.datetime(2020, 1, 2)
+        self.backend.save_snapshot(first, [{'nick': 'alpha', 'value': 1}])
+        self.backend.save_snapshot(second, iter([
+            {'nick': 'alpha', 'value': 2},
+            {'nick': 'beta', 'value': 3},
+        ]))
+
+        time, users = self.backend.get_snapshot()
+        users = sorted(users, key=lambda user: user['nick'])
+        assert time == second
+        assert [user['value'] for user in users] == [2, 3]
+        assert set(users[0]) == set(['nick', 'value'])
+
+    def _increments(self, nick, value, time):
+        from helga_karma.windows import get_increments
+        return get_increments(nick, value, time)
+
+    def test_buckets(self):
+        now = datetime.datetime.utcnow()
+        yesterday = now - datetime.timedelta(days=1)
+        last_month = now - datetime.timedelta(days=40)
+        self.backend.update_buckets(
+            self._increments('alpha', 1.0, now)
+            + self._increments('alpha', 2.0, now)
+            + self._increments('beta', 2.5, yesterday)
+            + self._increments('gamma', 9.0, last_month)
+        )
+
+        top = self.backend.get_bucket_top(
+            'day', now - datetime.timedelta(days=7), 10,
+        )
+        assert [(total['nick'], total['value']) for total in top] == [
+            ('alpha', 3.0),
+            ('beta', 2.5),
+        ]
+        assert top[0]['received'] == 2
+        assert [
+            total['nick'] for total in self.backend.get_bucket_top(
+                'hour', now - datetime.timedelta(hours=1), 10,
+            )
+        ] == ['alpha']
+        assert len(self.backend.get_bucket_top(
+            'day', now - datetime.timedelta(days=7), 1,
+        )) == 1
+
+    def test_merge_buckets(self):
+        now = datetime.datetime.utcnow()
+        self.backend.update_buckets(
+            self._increments('alpha', 1.0, now)
+            + self._increments('beta', 2.0, now)
+        )
+
+        self.backend.merge_buckets('beta', 'alpha')
+
+        top = self.backend.get_bucket_top(
+            'day', now - datetime.timedelta(days=1), 10,
+        )
+        assert top == [{'nick': 'alpha', 'value': 3.0, 'received': 2}]
+
+    def test_scoped(self):
+        channel = self.backend.scoped('#bots')
+        self._upsert('alpha', value=10)
+        channel.update_users([('alpha', {'$set': {'value': 3}})])
+        channel.update_users([('beta', {'$set': {'value': 5}})])
+        channel.insert_link({'nick': 'gamma', 'real_nick': 'beta'})
+
+        assert self.backend.find_users(['alpha'])[0]['value'] == 10
+        assert self.backend.find_users(['beta']) == []
+        assert self.backend.find_link('gamma') is None
+        assert [user['nick'] for user in self.backend.iter_users()] == [
+            'alpha',
+        ]
+
+        user = channel.find_users(['alpha'])[0]
+        assert user['value'] == 3
+        assert 'channel' not in user
+        assert [
+            user['nick'] for user in channel.get_top_users(10)
+        ] == ['beta', 'alpha']
+        assert channel.find_link('gamma')['real_nick'] == 'beta'
+        assert 'channel' not in channel.find_link('gamma')
+
+        channel.remove_user('alpha')
+        assert self.backend.find_users(['alpha'])[0]['value'] == 10
+
+    def test_scoped_snapshot_and_events(self):
+        channel = self.backend.scoped('#bots')
+        time = datetime.datetime(2020, 1, 1)
+        channel.insert_events([
+            {'type': 'give', 'giver': 'alpha', 'receiver': 'beta',
+             'value': 1.0, 'time': time},
+        ])
+        channel.save_snapshot(time, [{'nick': 'alpha', 'value': 1}])
+
+        assert list(self.backend.iter_events()) == []
+        assert self.backend.get_snapshot()[0] is None
+        assert [event['receiver'] for event in channel.iter_events()] == [
+            'beta',
+        ]
+        snapshot, users = channel.get_snapshot()
+        assert snapshot == time
+        assert list(users) == [{'nick': 'alpha', 'value': 1}]
+
+    def test_scoped_buckets(self):
+        channel = self.backend.scoped('#bots')
+        now = datetime.datetime.utcnow()
+        channel.update_buckets(self._increments('alpha', 1.0, now))
+
+        since = now - datetime.timedelta(days=1)
+        assert self.backend.get_bucket_top('day', since, 10) == []
+        assert [
+            total['nick'] for total in channel.get_bucket_top('day', since, 10)
+        ] == ['alpha']
+
+    def test_returned_documents_are_copies(self):
+        self._upsert('alpha', value=10)
+        self.backend.find_users(['alpha'])[0]['value'] = 20
+
+        assert self.backend.find_users(['alpha'])[0]['value'] == 10
+
+
+class TestMemoryBackend(BackendTests):
+
+    def get_backend(self):
+        from helga_karma.backends import MemoryBackend
+        return MemoryBackend()
+
+
+class TestSQLiteBackend(BackendTests):
+
+    def get_backend(self):
+        from helga_karma.backends import SQLiteBackend
+        return SQLiteBackend(':memory:')
+
+    def test_iter_pages(self):
+        for idx in range(5):
+            self._upsert('user%d' % idx, value=idx)
+
+        assert [
+            user['nick'] for user in self.backend._iter_table('karma_user', 2)
+        ] == ['user%d' % idx for idx in range(5)]
+
+    def test_iter_events_pages(self):
+        time = datetime.datetime(2020, 1, 1)
+        self.backend.insert_events([
+            {'type': 'give', 'giver': 'alpha', 'receiver': 'user%d' % idx,
+             'value': 1.0, 'time': time}
+            for idx in range(5)
+        ])
+
+        assert [
+            event['receiver']
+            for event in self.backend.iter_events(batch_size=2)
+        ] == ['user%d' % idx for idx in range(5)]
+
+
+    @mock.patch('helga_karma.backends.sqlite.MAX_VARIABLES', 3)
+    def test_find_in_chunks(self):
+        nicks = ['user%d' % idx for idx in range(5)]
+        for nick in nicks:
+            self._upsert(nick, value=1)
+            self.backend.insert_link({'nick': nick, 'real_nick': 'alpha'})
+
+        assert sorted(
+            user['nick'] for user in self.backend.find_users(nicks)
+        ) == nicks
+        assert sorted(
+            link['nick'] for link in self.backend.find_links(nicks)
+        ) == nicks
+
+        self.backend.repoint_links('alpha', 'omega', nicks[:4])
+        assert sorted(
+            link['nick'] for link in self.backend.find_links_to('omega')
+        ) == nicks[:4]
+
+
+class TestMongoBackend(BackendTests):
+
+    def get_backend(self):
+        from helga_karma.backends.mongo import MongoBackend
+        return MongoBackend(mongomock.MongoClient().helga_karma_test)
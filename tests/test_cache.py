@@ -0,0 +1,83 @@
+from helga_karma.cache import LRUCache
+
+from tests import FakeTimer
+
+
+class TestLRUCache(object):
+
+    def test_get_and_set(self):
+        cache = LRUCache()
+        cache.set('alpha', 'beta')
+
+        assert cache.get('alpha') == 'beta'
+        assert cache.get('gamma') is None
+        assert cache.get('gamma', 'default') == 'default'
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('one', 1)
+        cache.set('two', 2)
+        cache.get('one')
+        cache.set('three', 3)
+
+        assert cache.get('one') == 1
+        assert cache.get('two') is None
+        assert cache.get('three') == 3
+        assert len(cache) == 2
+
+    def test_expires_entries(self):
+        timer = FakeTimer()
+        cache = LRUCache(ttl=10, timer=timer)
+        cache.set('one', 1)
+
+        timer.now = 9
+        assert cache.get('one') == 1
+        timer.now = 10
+        assert cache.get('one') is None
+
+    def test_peek(self):
+        timer = FakeTimer()
+        cache = LRUCache(ttl=10, timer=timer)
+        cache.set('one', 1)
+
+        assert cache.peek('one') == 1
+        assert cache.peek('two') is None
+        timer.now = 10
+        assert cache.peek('one') is None
+        assert cache.stats()['hits'] == 0
+        assert cache.stats()['misses'] == 0
+
+    def test_items(self):
+        timer = FakeTimer()
+        cache = LRUCache(ttl=10, timer=timer)
+        cache.set('one', 1)
+        timer.now = 5
+        cache.set('two', 2)
+        cache.get('one')
+
+        assert cache.items() == [('two', 2), ('one', 1)]
+        timer.now = 12
+        assert cache.items() == [('two', 2)]
+        assert cache.stats()['hits'] == 1
+
+    def test_invalidate(self):
+        cache = LRUCache()
+        cache.set('one', 1)
+        cache.invalidate('one')
+        cache.invalidate('two')
+
+        assert cache.get('one') is None
+
+    def test_stats(self):
+        cache = LRUCache()
+        cache.set('one', 1)
+        cache.get('one')
+        cache.get('one')
+        cache.get('two')
+
+        stats = cache.stats()
+        assert stats['size'] == 1
+        assert stats['hits'] == 2
+        assert stats['misses'] == 1
+        assert stats['hit_ratio'] == 2.0 / 3
+        assert stats['memory'] > 0
@@ -0,0 +1,60 @@
+import threading
+
+from helga_karma.channels import ChannelScoped, channel_scope, get_channel
+
+
+class TestChannelScope(object):
+
+    def test_default_is_global(self):
+        assert get_channel() is None
+
+    def test_nested(self):
+        with channel_scope('#bots'):
+            assert get_channel() == '#bots'
+            with channel_scope(None):
+                assert get_channel() is None
+            assert get_channel() == '#bots'
+        assert get_channel() is None
+
+    def test_restored_after_error(self):
+        try:
+            with channel_scope('#bots'):
+                raise ValueError()
+        except ValueError:
+            pass
+        assert get_channel() is None
+
+    def test_per_thread(self):
+        seen = []
+        with channel_scope('#bots'):
+            thread = threading.Thread(
+                target=lambda: seen.append(get_channel()),
+            )
+            thread.start()
+            thread.join()
+        assert seen == [None]
+
+
+class TestChannelScoped(object):
+
+    def setup(self):
+        self.created = []
+
+        def factory(channel):
+            self.created.append(channel)
+            return {'channel': channel}
+
+        self.scoped = ChannelScoped(factory)
+
+    def test_forwards_to_current_channel(self):
+        assert self.scoped.get('channel') is None
+        with channel_scope('#bots'):
+            assert self.scoped.get('channel') == '#bots'
+            assert self.scoped.get('channel') == '#bots'
+
+        assert self.created == [None, '#bots']
+        assert set(self.scoped.channels()) == set([None, '#bots'])
+
+    def test_for_channel(self):
+        assert self.scoped.for_channel('#bots') == {'channel': '#bots'}
+        assert self.scoped.instances() == [{'channel': '#bots'}]
@@ -1,5 +1,6 @@
 import datetime
 import math
+import threading
 
 import mock
 import mongomock
@@ -31,6 +32,10 @@ class TestKarmaRecord(object):
     def teardown(self):
         self.db.karma_user.drop()
         self.db.karma_link.drop()
+        self.db.karma_event.drop()
+        self.db.karma_snapshot.drop()
+        self.db.karma_bucket.drop()
+        self.KarmaRecord.clear_caches()
 
     def test_get_actual_nick(self):
         arbitrary_nick = 'one'
@@ -49,6 +54,54 @@ class TestKarmaRecord(object):
 
         assert actual_result == expected_result
 
+    def test_get_actual_nick_is_cached(self):
+        self.db.karma_link.insert({'nick': 'two', 'real_nick': 'one'})
+        self.KarmaRecord.get_actual_nick('two')
+        self.KarmaRecord.get_actual_nick('three')
+
+        with mock.patch.object(self.db.karma_link, 'find') as find:
+            assert self.KarmaRecord.get_actual_nick('two') == 'one'
+            assert self.KarmaRecord.get_actual_nick('three') == 'three'
+            assert not find.called
+
+    def test_get_actual_nick_follows_chains(self):
+        self.db.karma_link.insert({'nick': 'three', 'real_nick': 'two'})
+        self.db.karma_link.insert({'nick': 'two', 'real_nick': 'one'})
+
+        assert self.KarmaRecord.get_actual_nick('three') == 'one'
+        assert self.KarmaRecord.get_actual_nicks(['three', 'two']) == [
+            'one', 'one',
+        ]
+
+    def test_add_alias_repoints_aliases_at_once(self):
+        main_record = self._get_karma_record('one', value=10)
+        alias_record = self._get_karma_record('two', value=1)
+        for nick in ['three', 'four', 'five']:
+            alias_record.add_alias(self.KarmaRecord.get_for_nick(nick))
+        assert self.KarmaRecord.get_actual_nick('four') == 'two'
+
+        with mock.patch.object(
+            self.db.karma_link, 'update', wraps=self.db.karma_link.update,
+        ) as update:
+            main_record.add_alias(alias_record)
+            assert not update.called
+
+        assert set(main_record.get_aliases()) == set(
+            ['two', 'three', 'four', 'five']
+        )
+        assert self.KarmaRecord.get_actual_nick('four') == 'one'
+
+    def test_add_alias_invalidates_cached_nick(self):
+        main_record = self.KarmaRecord.get_for_nick('one')
+        alias_record = self.KarmaRecord.get_for_nick('two')
+        assert self.KarmaRecord.get_actual_nick('two') == 'two'
+
+        main_record.add_alias(alias_record)
+        assert self.KarmaRecord.get_actual_nick('two') == 'one'
+
+        main_record.remove_alias('two')
+        assert self.KarmaRecord.get_actual_nick('two') == 'two'
+
     def test_get_nick_with_pipe(self):
         arbitrary_nick = 'somebody|away'
 
@@ -66,6 +119,140 @@ class TestKarmaRecord(object):
 
         assert result == 'somebody'
 
+    def test_get_for_nick_folds_case(self):
+        from helga_karma.nicks import NickNormalizer
+
+        with mock.patch(
+            'helga_karma.data.nick_normalizer', NickNormalizer('rfc1459'),
+        ):
+            record = self._get_karma_record('some[body]', value=10)
+            record.give_karma_to(self.KarmaRecord.get_for_nick('Other'))
+
+            assert self.KarmaRecord.get_for_nick('Some{Body}')['value'] == 10
+            assert self.db.karma_user.find_one({'nick': 'other'})
+            assert not self.db.karma_user.find_one({'nick': 'Other'})
+
+    def test_merge_unnormalized_nicks(self):
+        from helga_karma.nicks import NickNormalizer
+
+        self._get_karma_record('alpha', value=10, given=1, received=2)
+        self._get_karma_record('Alpha', value=5, given=3, received=4)
+        self._get_karma_record('ALPHA', value=1, given=0, received=1)
+        self._get_karma_record('Beta', value=7)
+        self.db.karma_link.insert({
+            'nick': 'Alpha_Away',
+            'real_nick': 'Alpha',
+            'record': {'nick': 'Alpha_Away', 'value': 0},
+            'aliases': [],
+        })
+        self.db.karma_link.insert({'nick': 'GAMMA', 'real_nick': 'gamma'})
+
+        with mock.patch(
+            'helga_karma.data.nick_normalizer', NickNormalizer('rfc1459'),
+        ):
+            moved = self.KarmaRecord.merge_unnormalized_nicks()
+
+            assert sorted(moved) == [
+                ('ALPHA', 'alpha'),
+                ('Alpha', 'alpha'),
+                ('Alpha_Away', 'alpha_away'),
+                ('Beta', 'beta'),
+                ('GAMMA', 'gamma'),
+            ]
+            alpha = self.KarmaRecord.get_for_nick('alpha_away')
+            assert alpha['nick'] == 'alpha'
+            assert alpha['value'] == 16
+            assert alpha['given'] == 4
+            assert alpha['received'] == 7
+            assert self.KarmaRecord.get_for_nick('BETA')['value'] == 7
+            assert sorted(
+                user['nick'] for user in self.db.karma_user.find()
+            ) == ['alpha', 'beta']
+            assert [
+                link['nick'] for link in self.db.karma_link.find()
+            ] == ['alpha_away']
+            assert self.KarmaRecord.merge_unnormalized_nicks() == []
+
+    def test_merge_unnormalized_nicks_into_alias_target(self):
+        from helga_karma.nicks import NickNormalizer
+
+        self._get_karma_record('Delta', value=3, received=1)
+        self._get_karma_record('epsilon', value=10, received=2)
+        self.db.karma_link.insert({
+            'nick': 'delta',
+            'real_nick': 'epsilon',
+            'record': {'nick': 'delta', 'value': 0},
+            'aliases': [],
+        })
+
+        with mock.patch(
+            'helga_karma.data.nick_normalizer', NickNormalizer('rfc1459'),
+        ):
+            moved = self.KarmaRecord.merge_unnormalized_nicks()
+
+            assert moved == [('Delta', 'epsilon')]
+            delta = self.KarmaRecord.get_for_nick('Delta')
+            assert delta['nick'] == 'epsilon'
+            assert delta['value'] == 13
+            assert delta['received'] == 3
+            assert [
+                user['nick'] for user in self.db.karma_user.find()
+            ] == ['epsilon']
+
+    def test_record_reads_document_lazily(self):
+        document = {'_id': 1, 'nick': 'alpha', 'value': 10}
+        record = self.KarmaRecord(document)
+
+        assert record['value'] == 10
+        assert record['given'] == 0
+        assert record['last_given'] is None
+        assert record.get('colour') is None
+        assert record.nick == 'alpha'
+        assert not hasattr(record, '__dict__')
+
+        record['value'] = 11
+        record['colour'] = 'blue'
+        assert record['value'] == 11
+        assert record['colour'] == 'blue'
+        assert document == {'_id': 1, 'nick': 'alpha', 'value': 10}
+
+    def test_record_to_document(self):
+        record = self.KarmaRecord({'_id': 1, 'nick': 'alpha', 'value': 10})
+        expected = {
+            '_id': 1,
+            'nick': 'alpha',
+            'given': 0,
+            'received': 0,
+            'value': 10,
+            'created': None,
+            'last_received': None,
+            'last_given': None,
+        }
+
+        assert record.to_document() == expected
+        record['given'] = 1
+        expected['given'] = 1
+        assert record.to_document() == expected
+        assert dict(record) == expected
+
+    def test_record_missing_nick(self):
+        record = self.KarmaRecord({})
+
+        try:
+            record['nick']
+        except KeyError:
+            pass
+        else:
+            assert False, 'Expected KeyError'
+        assert record.get('nick') is None
+
+    def test_get_for_nick_does_not_change_cached_document(self):
+        self._get_karma_record('alpha', value=10)
+        record = self.KarmaRecord.get_for_nick('alpha')
+        record['value'] = 20
+
+        assert self.KarmaRecord.get_for_nick('alpha')['value'] == 10
+
     def test_get_actual_nick_no_alias(self):
         arbitrary_nick = 'two'
 
@@ -92,6 +279,35 @@ class TestKarmaRecord(object):
         k = self.KarmaRecord.get_for_nick(non_existing_nick)
         assert k['given'] == 0
 
+    def test_get_for_nick_is_cached(self):
+        self.db.karma_user.insert({'nick': 'alpha', 'value': 10})
+        self.KarmaRecord.get_for_nick('alpha')
+        self.KarmaRecord.get_for_nick('beta')
+
+        with mock.patch.object(self.db.karma_user, 'find') as find:
+            assert self.KarmaRecord.get_for_nick('alpha')['value'] == 10
+            assert self.KarmaRecord.get_for_nick('beta')['value'] == 0
+            assert not find.called
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_record_cache_is_written_through(self, get_coefficient_mock):
+        get_coefficient_mock.return_value = 1
+        giver = self._get_karma_record('giraffe', given=10)
+        receiver = self._get_karma_record('elephant', value=10)
+
+        giver.give_karma_to(receiver)
+
+        with mock.patch.object(self.db.karma_user, 'find') as find:
+            assert self.KarmaRecord.get_for_nick('elephant')['value'] == 11
+            assert self.KarmaRecord.get_for_nick('giraffe')['given'] == 11
+            assert not find.called
+
+    def test_delete_updates_record_cache(self):
+        record = self._get_karma_record('alpha', value=10)
+        record.delete()
+
+        assert self.KarmaRecord.get_for_nick('alpha', get_empty=False) is None
+
     def test_get_top(self):
         first = {'nick': 'three', 'value': 15.0}
         second = {'nick': 'one', 'value': 10.0}
@@ -105,6 +321,31 @@ class TestKarmaRecord(object):
         assert expected_results[1]['nick'] == second['nick']
         assert len(expected_results) == 2
 
+    def test_get_top_uses_leaderboard(self):
+        self._get_karma_record('one', value=10)
+        self._get_karma_record('two', value=5)
+        list(self.KarmaRecord.get_top(limit=2))
+        self._get_karma_record('three', value=15)
+
+        with mock.patch.object(self.db.karma_user, 'find') as find:
+            results = list(self.KarmaRecord.get_top(limit=2))
+            assert not find.called
+
+        assert [r['nick'] for r in results] == ['three', 'one']
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_give_karma_to_updates_leaderboard(self, get_coefficient_mock):
+        get_coefficient_mock.return_value = 10
+        giver = self._get_karma_record('one', value=10)
+        receiver = self._get_karma_record('two', value=5)
+        list(self.KarmaRecord.get_top(limit=2))
+
+        giver.give_karma_to(receiver)
+
+        results = list(self.KarmaRecord.get_top(limit=2))
+        assert [r['nick'] for r in results] == ['two', 'one']
+        assert results[0]['value'] == 15
+
     def test_add_alias(self):
         main_nick = 'one'
         alias_nick = 'two'
@@ -131,6 +372,34 @@ class TestKarmaRecord(object):
         assert actual_result['given'] == 20
         assert actual_result['received'] == 20
 
+    def test_add_alias_keeps_concurrent_changes(self):
+        record = self._get_karma_record('one', value=10, given=1, received=1)
+        alias_record = self._get_karma_record(
+            'two', value=5, given=1, received=1,
+        )
+        # Somebody else thanks `one` after we loaded the record
+        self.db.karma_user.update({'nick': 'one'}, {'$inc': {'value': 1}})
+
+        record.add_alias(alias_record)
+
+        actual_result = self.db.karma_user.find_one({'nick': 'one'})
+        assert actual_result['value'] == 16
+        assert actual_result['given'] == 2
+
+    def test_add_alias_keeps_latest_timestamps(self):
+        earlier = datetime.datetime(2015, 1, 1)
+        later = datetime.datetime(2015, 1, 2)
+        record = self._get_karma_record('one', last_received=later)
+        alias_record = self._get_karma_record(
+            'two', last_received=earlier, last_given=earlier,
+        )
+
+        record.add_alias(alias_record)
+
+        actual_result = self.KarmaRecord.get_for_nick('one')
+        assert actual_result['last_received'] == later
+        assert actual_result['last_given'] == earlier
+
     def test_remove_alias(self):
         main_nick = 'three'
         alias_nick = 'four'
@@ -210,6 +479,226 @@ class TestKarmaRecord(object):
         assert to_record['received'] == 11
         assert to_record['value'] == 11
 
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_give_karma_to_keeps_concurrent_changes(self, get_coefficient_mock):
+        get_coefficient_mock.return_value = 1
+
+        from_record = self._get_karma_record('giraffe', given=10)
+        to_record = self._get_karma_record('elephant', value=10, received=10)
+        self.db.karma_user.update(
+            {'nick': 'elephant'},
+            {'$inc': {'value': 5, 'received': 1}},
+        )
+
+        from_record.give_karma_to(to_record)
+
+        actual_result = self.db.karma_user.find_one({'nick': 'elephant'})
+        assert actual_result['value'] == 16
+        assert actual_result['received'] == 12
+
+    def test_get_for_nicks(self):
+        self._get_karma_record('alpha', value=10)
+        self.db.karma_link.insert({'nick': 'beta', 'real_nick': 'alpha'})
+
+        records = self.KarmaRecord.get_for_nicks(['alpha', 'beta', 'gamma'])
+
+        assert [r['nick'] for r in records] == ['alpha', 'alpha', 'gamma']
+        assert records[0] is records[1]
+        assert records[0]['value'] == 10
+        assert records[2]['value'] == 0
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_give_karma_to_many(self, get_coefficient_mock):
+        get_coefficient_mock.return_value = 2
+
+        self._get_karma_record('giraffe', given=10)
+        self._get_karma_record('elephant', value=10, received=10)
+        records = self.KarmaRecord.get_for_nicks(
+            ['giraffe', 'elephant', 'zebra', 'elephant']
+        )
+
+        with mock.patch.object(
+            self.db.karma_user,
+            'bulk_write',
+            wraps=self.db.karma_user.bulk_write,
+        ) as bulk_write:
+            values = records[0].give_karma_to_many(records[1:])
+            assert bulk_write.call_count == 1
+
+        assert values == [2, 2, 2]
+        giraffe = self.KarmaRecord.get_for_nick('giraffe')
+        elephant = self.KarmaRecord.get_for_nick('elephant')
+        zebra = self.KarmaRecord.get_for_nick('zebra')
+        assert giraffe['given'] == 13
+        assert giraffe['last_given'] is not None
+        assert elephant['value'] == 14
+        assert elephant['received'] == 12
+        assert zebra['value'] == 2
+        assert zebra['received'] == 1
+        assert zebra['given'] == 0
+        assert zebra['created'] is not None
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_give_karma_to_write_behind(self, get_coefficient_mock):
+        from helga_karma.data import _get_queued_channel, _merge_update
+        from helga_karma.writebehind import WriteBehindQueue
+
+        get_coefficient_mock.return_value = 1
+        queue = WriteBehindQueue(
+            self.KarmaRecord._write_queued, _merge_update,
+            group=_get_queued_channel,
+        )
+        self._get_karma_record('giraffe', given=10)
+
+        with mock.patch('helga_karma.data.write_behind', queue):
+            giver, receiver = self.KarmaRecord.get_for_nicks(
+                ['giraffe', 'elephant']
+            )
+            giver.give_karma_to(receiver)
+
+            assert self.db.karma_user.find_one({'nick': 'elephant'}) is None
+            pending = self.KarmaRecord.get_for_nick('elephant')
+            assert pending['value'] == 1
+            assert self.KarmaRecord.get_for_nick('giraffe')['given'] == 11
+
+            queue.stop()
+
+        assert self.KarmaRecord.get_for_nick('elephant')['value'] == 1
+        assert self.KarmaRecord.get_for_nick('giraffe')['given'] == 11
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_write_behind_read_during_flush(self, get_coefficient_mock):
+        from helga_karma.data import _get_queued_channel, _merge_update
+        from helga_karma.writebehind import WriteBehindQueue
+
+        get_coefficient_mock.return_value = 1
+        written = threading.Event()
+        release = threading.Event()
+
+        def writer(updates):
+            self.KarmaRecord._write_queued(updates)
+            written.set()
+            release.wait(5)
+
+        queue = WriteBehindQueue(
+            writer, _merge_update, group=_get_queued_channel,
+        )
+        self._get_karma_record('elephant', value=10)
+        results = []
+
+        with mock.patch('helga_karma.data.write_behind', queue):
+            self.KarmaRecord.get_for_nick('giraffe').give_karma_to(
+                self.KarmaRecord.get_for_nick('elephant')
+            )
+            flush = threading.Thread(target=queue.flush)
+            flush.start()
+            assert written.wait(5)
+
+            read = threading.Thread(target=lambda: results.append(
+                self.KarmaRecord.get_for_nick('elephant')['value']
+            ))
+            read.start()
+            read.join(0.1)
+            assert read.is_alive()
+
+            release.set()
+            flush.join(5)
+            read.join(5)
+
+        assert results == [11]
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_rebuild_from_event_log(self, get_coefficient_mock):
+        from helga_karma.data import (
+            _get_queued_channel, _insert_events, backend,
+        )
+        from helga_karma.events import EventLog
+
+        get_coefficient_mock.return_value = 2
+        self._get_karma_record('giraffe', given=1, value=5)
+        log = EventLog(_insert_events, group=_get_queued_channel)
+
+        with mock.patch('helga_karma.data.event_log', log):
+            self.KarmaRecord.take_snapshot()
+
+            giraffe, elephant, zebra = self.KarmaRecord.get_for_nicks(
+                ['giraffe', 'elephant', 'zebra']
+            )
+            giraffe.give_karma_to_many([elephant, zebra])
+            elephant.add_alias(zebra)
+            self.KarmaRecord.get_for_nick('zebra').give_karma_to(giraffe)
+            elephant.remove_alias('zebra')
+
+            expected = dict(
+                (user['nick'], user) for user in backend.iter_users()
+            )
+            self.db.karma_user.update(
+                {'nick': 'giraffe'}, {'$set': {'value': 100}},
+            )
+            self.db.karma_user.remove({'nick': 'zebra'})
+
+            result = self.KarmaRecord.rebuild()
+
+        assert result.events == 5
+        assert expected['zebra']['value'] == 2
+        assert expected['elephant']['given'] == 1
+        for nick in ['giraffe', 'elephant', 'zebra']:
+            record = self.KarmaRecord.get_for_nick(nick)
+            for key in ['given', 'received', 'value', 'last_received']:
+                assert record[key] == expected[nick][key]
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_get_top_window(self, get_coefficient_mock):
+        from helga import settings
+
+        get_coefficient_mock.return_value = 2
+        self._get_karma_record('elephant', value=100)
+
+        with mock.patch.object(
+            settings, 'KARMA_WINDOWED_TOP', True, create=True,
+        ):
+            giraffe, elephant, zebra = self.KarmaRecord.get_for_nicks(
+                ['giraffe', 'elephant', 'zebra']
+            )
+            giraffe.give_karma_to_many([zebra, elephant, zebra])
+            assert [
+                (record['nick'], record['value'])
+                for record in self.KarmaRecord.get_top(window='week')
+            ] == [('zebra', 4), ('elephant', 2)]
+
+            giraffe.add_alias(zebra)
+            assert [
+                (record['nick'], record['value'])
+                for record in self.KarmaRecord.get_top(window='day')
+            ] == [('giraffe', 4), ('elephant', 2)]
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_get_top_window_write_behind(self, get_coefficient_mock):
+        from helga import settings
+        from helga_karma.data import _get_queued_channel, _merge_update
+        from helga_karma.writebehind import WriteBehindQueue
+
+        get_coefficient_mock.return_value = 2
+        queue = WriteBehindQueue(
+            self.KarmaRecord._write_queued, _merge_update,
+            group=_get_queued_channel,
+        )
+
+        with mock.patch.object(
+            settings, 'KARMA_WINDOWED_TOP', True, create=True,
+        ), mock.patch('helga_karma.data.write_behind', queue):
+            giraffe, zebra = self.KarmaRecord.get_for_nicks(
+                ['giraffe', 'zebra']
+            )
+            giraffe.give_karma_to_many([zebra, zebra])
+            assert self.db.karma_bucket.count() == 0
+
+            queue.flush()
+            assert [
+                (record['nick'], record['value'])
+                for record in self.KarmaRecord.get_top(window='week')
+            ] == [('zebra', 4)]
+
     def test_get_global_karma_maximum(self):
         maximum_value = 30
         not_maximum_value = 20
@@ -224,6 +713,56 @@ class TestKarmaRecord(object):
 
         assert actual_value == expected_value
 
+    def test_get_global_karma_maximum_is_cached(self):
+        self._get_karma_record('alpha', value=30)
+        assert self.KarmaRecord.get_global_karma_maximum() == 30
+
+        with mock.patch.object(self.KarmaRecord, 'get_top') as get_top:
+            assert self.KarmaRecord.get_global_karma_maximum() == 30
+            assert not get_top.called
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_give_karma_to_raises_cached_maximum(self, get_coefficient_mock):
+        get_coefficient_mock.return_value = 10
+        giver = self._get_karma_record('alpha', value=30)
+        receiver = self._get_karma_record('beta', value=25)
+        assert self.KarmaRecord.get_global_karma_maximum() == 30
+
+        giver.give_karma_to(receiver)
+
+        with mock.patch.object(self.KarmaRecord, 'get_top') as get_top:
+            assert self.KarmaRecord.get_global_karma_maximum() == 35
+            assert not get_top.called
+
+    def test_remove_alias_refreshes_cached_maximum(self):
+        main_record = self._get_karma_record('alpha', value=30)
+        alias_record = self._get_karma_record('beta', value=20)
+        self._get_karma_record('gamma', value=40)
+        main_record.add_alias(alias_record)
+        assert self.KarmaRecord.get_global_karma_maximum() == 50
+
+        main_record.remove_alias('beta')
+
+        assert self.KarmaRecord.get_global_karma_maximum() == 40
+
+    @mock.patch('helga_karma.data.settings')
+    def test_get_values_looks_up_maximum_once(self, settings):
+        settings.KARMA_SCALED_RANGE = (0, 10)
+        settings.KARMA_SCALE_LINEAR = True
+        self._get_karma_record('alpha', value=100)
+        self._get_karma_record('beta', value=50)
+
+        with mock.patch.object(
+            self.KarmaRecord,
+            'get_global_karma_maximum',
+            return_value=100,
+        ) as get_maximum:
+            top = list(self.KarmaRecord.get_top())
+            values = self.KarmaRecord.get_values(top)
+            assert get_maximum.call_count == 1
+
+        assert values == [10.0, 5.0]
+
     def test_get_value_unscaled(self):
         karma_value = 223.210
         record = self._get_karma_record('delta', value=karma_value)
@@ -276,3 +815,166 @@ class TestKarmaRecord(object):
         actual_result = user.get_value()
 
         assert actual_result == expected_result
+
+    def test_memory_backend(self):
+        from helga_karma.backends import MemoryBackend
+
+        with mock.patch('helga_karma.data.backend', MemoryBackend()):
+            giver, receiver = self.KarmaRecord.get_for_nicks(['one', 'two'])
+            giver.give_karma_to(receiver)
+            receiver.add_alias(self.KarmaRecord.get_for_nick('three'))
+            self.KarmaRecord.clear_caches()
+
+            alias_record = self.KarmaRecord.get_for_nick('three')
+            assert alias_record['nick'] == 'two'
+            assert alias_record['value'] == 1
+            assert self.KarmaRecord.get_for_nick('one')['given'] == 1
+
+        assert self.db.karma_user.find_one({'nick': 'two'}) is None
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_channel_karma_write_behind(self, get_coefficient_mock):
+        from helga_karma.channels import channel_scope
+        from helga_karma.data import _get_queued_channel, _merge_update
+        from helga_karma.writebehind import WriteBehindQueue
+
+        get_coefficient_mock.return_value = 2
+        queue = WriteBehindQueue(
+            self.KarmaRecord._write_queued, _merge_update,
+            group=_get_queued_channel,
+        )
+
+        with mock.patch('helga_karma.data.write_behind', queue):
+            with channel_scope('#bots'):
+                giver, receiver = self.KarmaRecord.get_for_nicks(
+                    ['one', 'two'],
+                )
+                giver.give_karma_to(receiver)
+                assert self.KarmaRecord.get_for_nick('two')['value'] == 2
+            assert self.KarmaRecord.get_for_nick('two')['value'] == 2
+            assert self.db.karma_user.find().count() == 0
+
+            queue.flush()
+
+        assert self.db.karma_user.find({'channel': '#bots'}).count() == 2
+        assert self.KarmaRecord.get_for_nick('two')['value'] == 2
+        with channel_scope('#bots'):
+            assert self.KarmaRecord.get_for_nick('one')['given'] == 1
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_channel_karma_rolls_up(self, get_coefficient_mock):
+        from helga_karma.channels import channel_scope
+        get_coefficient_mock.return_value = 2
+
+        with channel_scope('#bots'):
+            giver, receiver = self.KarmaRecord.get_for_nicks(['one', 'two'])
+            giver.give_karma_to(receiver)
+        with channel_scope('#dev'):
+            giver, receiver = self.KarmaRecord.get_for_nicks(['three', 'two'])
+            giver.give_karma_to(receiver)
+            assert self.KarmaRecord.get_for_nick('two')['value'] == 2
+            assert self.KarmaRecord.get_for_nick('one')['given'] == 0
+
+        with channel_scope('#bots'):
+            assert [
+                record['nick'] for record in self.KarmaRecord.get_top()
+            ] == ['two', 'one']
+        record = self.KarmaRecord.get_for_nick('two')
+        assert record['value'] == 4
+        assert record['received'] == 2
+        assert self.KarmaRecord.get_for_nick('one')['given'] == 1
+        assert self.db.karma_user.find({'channel': '#bots'}).count() == 2
+
+    def test_warm_caches(self):
+        from helga_karma import data
+        self._get_karma_record('alpha', value=10)
+        self._get_karma_record('beta', value=5)
+        self.db.karma_link.insert({'nick': 'gamma', 'real_nick': 'alpha'})
+
+        self.KarmaRecord.warm_caches()
+
+        assert data.alias_cache.peek('gamma') == 'alpha'
+        assert [
+            record['nick'] for record in data.leaderboard.top(2)
+        ] == ['alpha', 'beta']
+
+    @mock.patch('helga_karma.data.KarmaRecord.get_coefficient')
+    def test_warm_start_writes_queued_changes_first(
+        self, get_coefficient_mock
+    ):
+        import shutil
+        import tempfile
+        from helga_karma import warmstart
+        from helga_karma.data import _get_queued_channel, _merge_update
+        from helga_karma.writebehind import WriteBehindQueue
+
+        get_coefficient_mock.return_value = 1
+        queue = WriteBehindQueue(
+            self.KarmaRecord._write_queued, _merge_update,
+            group=_get_queued_channel,
+        )
+        self._get_karma_record('bob', received=1, value=1)
+        directory = tempfile.mkdtemp()
+        path = directory + '/karma.warm'
+        try:
+            with mock.patch('helga_karma.data.write_behind', queue):
+                self.KarmaRecord.get_for_nick('alice').give_karma_to(
+                    self.KarmaRecord.get_for_nick('bob')
+                )
+                self.KarmaRecord.save_warm_start(path)
+
+            snapshot = warmstart.load(path)
+            try:
+                records = dict(snapshot.get(None)['records'])
+            finally:
+                snapshot.close()
+            assert records['bob']['received'] == 2
+        finally:
+            shutil.rmtree(directory)
+
+    def test_warm_start_saves_stop_after_queue(self):
+        from helga_karma import data
+        calls = []
+        saves = mock.Mock()
+        saves.stop.side_effect = lambda final: calls.append(('stop', final))
+        saves.save.side_effect = lambda: calls.append('save')
+        queue = mock.Mock()
+        queue.stop.side_effect = lambda: calls.append('flush')
+
+        with mock.patch(
+            'helga_karma.data.write_behind', queue,
+        ), mock.patch('helga_karma.data.event_log', None):
+            data._stop_warm_start_saves(saves)
+
+        assert calls == [('stop', False), 'flush', 'save']
+
+    def test_warm_start(self):
+        import shutil
+        import tempfile
+        from helga_karma import data
+        directory = tempfile.mkdtemp()
+        path = directory + '/karma.warm'
+        try:
+            self._get_karma_record('alpha', value=10)
+            self.db.karma_link.insert({'nick': 'gamma', 'real_nick': 'alpha'})
+            self.KarmaRecord.get_for_nick('gamma')
+            list(self.KarmaRecord.get_top(limit=5))
+            self.KarmaRecord.save_warm_start(path)
+
+            self.db.karma_user.update(
+                {'nick': 'alpha'}, {'$set': {'value': 20}},
+            )
+            self.KarmaRecord.clear_caches()
+            since = self.KarmaRecord.load_warm_start(path)
+
+            assert since is not None
+            assert data.alias_cache.peek('gamma') == 'alpha'
+            assert self.KarmaRecord.get_for_nick('alpha')['value'] == 10
+            assert [
+                record['nick'] for record in self.KarmaRecord.get_top(limit=5)
+            ] == ['alpha']
+
+            self.KarmaRecord.reconcile_warm_start(since)
+            assert self.KarmaRecord.get_for_nick('alpha')['value'] == 20
+        finally:
+            shutil.rmtree(directory)
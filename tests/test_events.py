@@ -0,0 +1,138 @@
+import threading
+import time
+
+import mock
+from pymongo.errors import PyMongoError
+
+
+class TestEventLog(object):
+
+    def setup(self):
+        from helga_karma.events import EventLog
+
+        self.now = [0.0]
+        self.written = []
+        self.writer = mock.Mock(side_effect=self.written.extend)
+        self.snapshot = mock.Mock()
+        self.log = EventLog(
+            self.writer,
+            snapshot=self.snapshot,
+            snapshot_interval=60,
+            timer=lambda: self.now[0],
+        )
+
+    def test_flush_keeps_order(self):
+        for idx in range(3):
+            self.log.append({'type': 'give', 'value': idx})
+
+        self.log.flush(limit=2)
+        assert [event['value'] for event in self.written] == [0, 1]
+        assert self.log.stats()['depth'] == 1
+
+        self.log.flush()
+        assert [event['value'] for event in self.written] == [0, 1, 2]
+
+    def test_failed_flush_is_retried(self):
+        self.writer.side_effect = PyMongoError()
+        self.log.append({'type': 'give', 'value': 0})
+
+        assert not self.log.flush()
+        self.log.append({'type': 'give', 'value': 1})
+
+        self.writer.side_effect = self.written.extend
+        assert self.log.flush()
+        assert [event['value'] for event in self.written] == [0, 1]
+        assert self.log.stats()['failures'] == 1
+
+    def test_append_writes_directly_when_full(self):
+        self.log.maxsize = 1
+        self.log.append({'type': 'give', 'value': 0})
+        self.log.append({'type': 'give', 'value': 1})
+
+        assert [event['value'] for event in self.written] == [1]
+        assert self.log.stats()['depth'] == 1
+        assert self.log.stats()['overflowed'] == 1
+
+    def test_append_drops_unwritable_event_when_full(self):
+        self.log.maxsize = 1
+        self.log.append({'type': 'give', 'value': 0})
+        self.writer.side_effect = PyMongoError()
+        self.log.append({'type': 'give', 'value': 1})
+
+        stats = self.log.stats()
+        assert stats['depth'] == 1
+        assert stats['dropped'] == 1
+        assert stats['written'] == 0
+
+    def test_failed_group_is_put_back_alone(self):
+        from helga_karma.events import EventLog
+
+        log = EventLog(self.writer, group=lambda event: event['channel'])
+        log.append({'channel': '#bots', 'value': 0})
+        log.append({'channel': '#dev', 'value': 1})
+        log.append({'channel': '#bots', 'value': 2})
+        self.writer.side_effect = [None, PyMongoError()]
+
+        assert not log.flush()
+        assert self.writer.call_args_list[0] == mock.call([
+            {'channel': '#bots', 'value': 0},
+            {'channel': '#bots', 'value': 2},
+        ])
+
+        self.writer.side_effect = self.written.extend
+        assert log.flush()
+        assert self.written == [{'channel': '#dev', 'value': 1}]
+        assert log.stats()['written'] == 3
+
+    def test_worker_survives_flush_during_interval(self):
+        from helga_karma.events import EventLog
+
+        flushed = threading.Event()
+
+        def writer(events):
+            self.written.extend(events)
+            flushed.set()
+
+        log = EventLog(writer, interval=0.5)
+        log.start()
+        log.append({'type': 'give', 'value': 0})
+        # Flush while the worker waits out the interval, and let it see
+        # that nothing is left
+        time.sleep(0.1)
+        log.flush()
+        flushed.clear()
+        time.sleep(0.1)
+
+        log.append({'type': 'give', 'value': 1})
+        assert flushed.wait(5)
+        log.stop()
+
+        assert [event['value'] for event in self.written] == [0, 1]
+
+    def test_stop_flushes(self):
+        self.log.start()
+        self.log.append({'type': 'give', 'value': 0})
+
+        self.log.stop()
+
+        assert len(self.written) == 1
+        assert self.log.stats()['depth'] == 0
+
+    def test_snapshot_when_due(self):
+        self.log._snapshot_if_due()
+        assert not self.snapshot.called
+
+        self.now[0] = 60
+        self.log._snapshot_if_due()
+        self.log._snapshot_if_due()
+        assert self.snapshot.call_count == 1
+        assert self.log.stats()['snapshots'] == 1
+
+    def test_failed_snapshot_waits(self):
+        self.snapshot.side_effect = PyMongoError()
+        self.now[0] = 60
+        self.log._snapshot_if_due()
+        self.log._snapshot_if_due()
+
+        assert self.snapshot.call_count == 1
+        assert self.log.stats()['snapshots'] == 0
@@ -0,0 +1,126 @@
+import mock
+import mongomock
+
+
+class TestIndexes(object):
+
+    def setup(self):
+        from _pytest.monkeypatch import monkeypatch
+        patch = monkeypatch()
+        patch.setattr('pymongo.MongoClient', mongomock.MongoClient)
+
+        from helga_karma import indexes
+        from helga.db import db
+        self.indexes = indexes
+        self.db = db
+
+    def teardown(self):
+        self.db.karma_user.drop()
+        self.db.karma_link.drop()
+        self.db.karma_event.drop()
+        self.db.karma_snapshot.drop()
+        self.db.karma_bucket.drop()
+
+    def test_ensure_indexes(self):
+        self.db.karma_user.drop_indexes()
+        self.db.karma_link.drop_indexes()
+        self.db.karma_event.drop_indexes()
+        self.db.karma_snapshot.drop_indexes()
+        self.db.karma_bucket.drop_indexes()
+
+        created = self.indexes.ensure_indexes()
+
+        assert set(created) == set([
+            ('karma_user', 'channel_1_nick_1'),
+            ('karma_user', 'channel_1_value_-1'),
+            ('karma_link', 'channel_1_nick_1'),
+            ('karma_link', 'channel_1_real_nick_1'),
+            ('karma_event', 'channel_1_time_1__id_1'),
+            ('karma_snapshot', 'channel_1_snapshot_1'),
+            ('karma_bucket', 'channel_1_nick_1_granularity_1_start_1'),
+            ('karma_bucket', 'channel_1_granularity_1_start_1'),
+            ('karma_bucket', 'expires_1'),
+        ])
+        user_indexes = self.db.karma_user.index_information()
+        assert user_indexes['channel_1_nick_1']['unique']
+
+    def test_ensure_indexes_drops_obsolete(self):
+        self.db.karma_user.drop_indexes()
+        self.db.karma_user.create_index(
+            [('nick', 1)],
+            name='nick_1',
+            unique=True,
+        )
+
+        self.indexes.ensure_indexes()
+
+        user_indexes = self.db.karma_user.index_information()
+        assert 'nick_1' not in user_indexes
+        assert 'channel_1_nick_1' in user_indexes
+
+    def test_ensure_indexes_keeps_obsolete_when_create_fails(self):
+        from pymongo.errors import PyMongoError
+
+        self.db.karma_user.drop_indexes()
+        self.db.karma_user.create_index(
+            [('nick', 1)],
+            name='nick_1',
+            unique=True,
+        )
+
+        collection_class = self.db.karma_user.__class__
+        create_index = collection_class.create_index
+
+        def failing_create_index(collection, keys, **options):
+            if options.get('name') == 'channel_1_value_-1':
+                raise PyMongoError()
+            return create_index(collection, keys, **options)
+
+        with mock.patch.object(
+            collection_class, 'create_index', failing_create_index,
+        ):
+            try:
+                self.indexes.ensure_indexes()
+            except PyMongoError:
+                pass
+            else:
+                assert False, 'Expected PyMongoError'
+
+        assert 'nick_1' in self.db.karma_user.index_information()
+
+    def test_ensure_indexes_is_idempotent(self):
+        self.indexes.ensure_indexes()
+        assert self.indexes.ensure_indexes() == []
+
+    def test_check_indexes_reports_missing(self):
+        self.indexes.ensure_indexes()
+        self.db.karma_link.drop_index('channel_1_real_nick_1')
+
+        with mock.patch.object(
+            self.db.karma_user.__class__,
+            'aggregate',
+            return_value=[],
+        ):
+            report = self.indexes.check_indexes()
+
+        assert report['missing'] == [('karma_link', 'channel_1_real_nick_1')]
+        assert report['unused'] == []
+
+    def test_check_indexes_reports_unused(self):
+        self.indexes.ensure_indexes()
+        stats = [
+            {'name': '_id_', 'accesses': {'ops': 0}},
+            {'name': 'channel_1_nick_1', 'accesses': {'ops': 10}},
+            {'name': 'channel_1_value_-1', 'accesses': {'ops': 0}},
+        ]
+
+        with mock.patch.object(
+            self.db.karma_user.__class__,
+            'aggregate',
+            return_value=stats,
+        ):
+            report = self.indexes.check_indexes()
+
+        assert report['missing'] == []
+        assert ('karma_user', 'channel_1_value_-1') in report['unused']
+        assert ('karma_user', 'channel_1_nick_1') not in report['unused']
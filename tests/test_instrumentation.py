@@ -0,0 +1,151 @@
+import mock
+
+from helga_karma.instrumentation import (
+    Histogram,
+    InstrumentedBackend,
+    Instrumentation,
+)
+
+from tests import FakeTimer
+
+
+class FakeBackend(object):
+    name = 'fake'
+
+    def __init__(self, timer):
+        self.timer = timer
+
+    def find_link(self, nick):
+        self.timer.now += 0.002
+        return None
+
+    def find_users(self, nicks):
+        self.timer.now += 0.003
+        return []
+
+
+class TestHistogram(object):
+
+    def test_percentiles(self):
+        histogram = Histogram((1, 2, 4, 8))
+        for value in (1, 1, 1, 3, 20):
+            histogram.observe(value)
+
+        assert histogram.count == 5
+        assert histogram.mean() == 5.2
+        assert histogram.percentile(50) == 1
+        assert histogram.percentile(80) == 4
+        assert histogram.percentile(99) == 20
+
+    def test_empty(self):
+        histogram = Histogram((1, 2))
+
+        assert histogram.percentile(50) == 0
+        assert histogram.mean() == 0.0
+
+
+class TestInstrumentation(object):
+
+    def setup(self):
+        self.timer = FakeTimer()
+        self.instrumentation = Instrumentation(timer=self.timer)
+        self.backend = InstrumentedBackend(
+            FakeBackend(self.timer),
+            self.instrumentation,
+            timer=self.timer,
+        )
+
+    def test_groups_calls_by_operation(self):
+        @self.instrumentation.operation('info')
+        def info():
+            self.backend.find_link('foo')
+            self.backend.find_users(['foo'])
+
+        info()
+        info()
+
+        stats = self.instrumentation.stats()
+        assert list(stats) == ['info']
+        assert stats['info']['count'] == 2
+        assert stats['info']['calls']['mean'] == 2
+        assert abs(stats['info']['time']['mean'] - 0.005) < 1e-9
+        assert stats['info']['methods'] == {'find_link': 2, 'find_users': 2}
+
+    def test_nested_operations_count_towards_outermost(self):
+        @self.instrumentation.operation('info')
+        def info():
+            self.backend.find_users(['foo'])
+
+        @self.instrumentation.operation('alias')
+        def alias():
+            info()
+            self.backend.find_link('foo')
+
+        alias()
+
+        stats = self.instrumentation.stats()
+        assert list(stats) == ['alias']
+        assert stats['alias']['calls']['mean'] == 2
+
+    def test_calls_outside_operations(self):
+        self.backend.find_link('foo')
+        self.backend.find_link('bar')
+
+        stats = self.instrumentation.stats()
+        assert stats['other']['count'] == 2
+        assert stats['other']['methods'] == {'find_link': 2}
+
+    def test_records_failing_calls(self):
+        @self.instrumentation.operation('give')
+        def give():
+            self.backend.find_users(None)
+
+        with mock.patch.object(
+            FakeBackend, 'find_users', side_effect=ValueError,
+        ):
+            try:
+                give()
+            except ValueError:
+                pass
+
+        assert self.instrumentation.stats()['give']['calls']['mean'] == 1
+
+    def test_passes_through_attributes(self):
+        assert self.backend.name == 'fake'
+
+    def test_format_stats(self):
+        @self.instrumentation.operation('top')
+        def top():
+            self.backend.find_users([])
+
+        top()
+
+        assert self.instrumentation.format_stats() == [
+            'top: 1 ops, 1.0 calls/op (p50 1, p99 1), '
+            '3.0ms/op (p50 3.0ms, p99 3.0ms)'
+        ]
+
+    def test_logs_periodically(self):
+        self.instrumentation.log_interval = 60
+
+        @self.instrumentation.operation('top')
+        def top():
+            pass
+
+        with mock.patch('helga_karma.instrumentation.logger') as logger:
+            top()
+            assert not logger.info.called
+
+            self.timer.now = 60
+            top()
+            assert logger.info.call_count == 1
+
+            self.timer.now = 90
+            top()
+            assert logger.info.call_count == 1
+
+    def test_reset(self):
+        self.backend.find_link('foo')
+        self.instrumentation.reset()
+
+        assert self.instrumentation.stats() == {}
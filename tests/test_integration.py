@@ -29,6 +29,7 @@ class TestKarmaPluginIntegration(TestCase):
     def tearDown(self):
         self.db.karma_user.drop()
         self.db.karma_link.drop()
+        self.KarmaRecord.clear_caches()
 
     def create_nick(self, nick, **kwargs):
         aliases = []
@@ -0,0 +1,27 @@
+import mock
+
+from helga_karma.lazy import LazyAttribute, LazyModule
+
+
+class TestLazyModule(object):
+
+    def test_loads_on_first_use(self):
+        on_load = mock.Mock()
+        module = LazyModule('helga_karma.windows', on_load=on_load)
+        assert not module.loaded
+        assert not on_load.called
+
+        assert 'week' in module.WINDOWS
+        assert 'day' in module.WINDOWS
+
+        assert module.loaded
+        on_load.assert_called_once_with(module.load())
+
+    def test_attribute(self):
+        module = LazyModule('helga_karma.windows')
+        get_window = LazyAttribute(module, 'get_window')
+        assert not module.loaded
+
+        assert get_window('week')[0] == 'day'
+        assert get_window.__name__ == 'get_window'
+        assert module.loaded
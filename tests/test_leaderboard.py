@@ -0,0 +1,92 @@
+from helga_karma.leaderboard import Leaderboard
+
+from tests import FakeTimer
+
+
+class TestLeaderboard(object):
+
+    def setup(self):
+        self.records = [
+            {'nick': 'alpha', 'value': 40},
+            {'nick': 'beta', 'value': 30},
+            {'nick': 'gamma', 'value': 20},
+        ]
+
+    def _nicks(self, records):
+        return [record['nick'] for record in records]
+
+    def test_unseeded(self):
+        board = Leaderboard(size=3)
+        board.update({'nick': 'alpha', 'value': 10})
+
+        assert board.top(1) is None
+
+    def test_top(self):
+        board = Leaderboard(size=3)
+        board.seed(self.records, 3)
+
+        assert self._nicks(board.top(2)) == ['alpha', 'beta']
+        assert self._nicks(board.top(3)) == ['alpha', 'beta', 'gamma']
+        assert board.top(4) is None
+
+    def test_top_complete(self):
+        board = Leaderboard(size=5)
+        board.seed(self.records, 5)
+
+        assert len(board.top(10)) == 3
+
+    def test_snapshot(self):
+        board = Leaderboard(size=5)
+        assert board.snapshot() is None
+
+        board.seed(self.records, 5)
+        records, complete = board.snapshot()
+        assert self._nicks(records) == ['alpha', 'beta', 'gamma']
+        assert complete
+
+    def test_increase_reorders(self):
+        board = Leaderboard(size=3)
+        board.seed(self.records, 3)
+        board.update({'nick': 'gamma', 'value': 50})
+
+        assert self._nicks(board.top(3)) == ['gamma', 'alpha', 'beta']
+
+    def test_newcomer_pushes_out_last(self):
+        board = Leaderboard(size=3)
+        board.seed(self.records, 3)
+        board.update({'nick': 'delta', 'value': 35})
+        board.update({'nick': 'epsilon', 'value': 5})
+
+        assert self._nicks(board.top(3)) == ['alpha', 'delta', 'beta']
+        assert len(board) == 3
+
+    def test_decrease_below_boundary_drops_record(self):
+        board = Leaderboard(size=3)
+        board.seed(self.records, 3)
+        board.update({'nick': 'alpha', 'value': 10})
+
+        assert self._nicks(board.top(2)) == ['beta', 'gamma']
+        # Somebody off the board may now rank third
+        assert board.top(3) is None
+
+    def test_decrease_when_complete(self):
+        board = Leaderboard(size=5)
+        board.seed(self.records, 5)
+        board.update({'nick': 'alpha', 'value': 10})
+
+        assert self._nicks(board.top(5)) == ['beta', 'gamma', 'alpha']
+
+    def test_remove(self):
+        board = Leaderboard(size=3)
+        board.seed(self.records, 3)
+        board.remove('beta')
+
+        assert self._nicks(board.top(2)) == ['alpha', 'gamma']
+
+    def test_expires(self):
+        timer = FakeTimer()
+        board = Leaderboard(size=3, ttl=10, timer=timer)
+        board.seed(self.records, 3)
+
+        timer.now = 10
+        assert board.top(1) is None
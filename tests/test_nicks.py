@@ -0,0 +1,63 @@
+from helga_karma.nicks import NickNormalizer
+
+
+class TestNickNormalizer(object):
+
+    def test_strips_suffixes(self):
+        normalize = NickNormalizer()
+
+        assert normalize('somebody|away') == 'somebody'
+        assert normalize('somebody++') == 'somebody'
+        assert normalize('somebody|away++') == 'somebody'
+        assert normalize('somebody:') == 'somebody'
+        assert normalize('somebody,') == 'somebody'
+        assert normalize('somebody++,') == 'somebody'
+
+    def test_keeps_case_by_default(self):
+        normalize = NickNormalizer()
+
+        assert normalize('SomeBody') == 'SomeBody'
+        assert normalize('some[body]') == 'some[body]'
+
+    def test_ascii(self):
+        normalize = NickNormalizer('ascii')
+
+        assert normalize('SomeBody') == 'somebody'
+        assert normalize('some[body]') == 'some[body]'
+
+    def test_rfc1459(self):
+        normalize = NickNormalizer('rfc1459')
+
+        assert normalize('Some[Body]') == 'some{body}'
+        assert normalize('some~body') == 'some^body'
+        assert normalize('some^body') == 'some^body'
+        # \\ is the upper case form of the | suffix separator
+        assert normalize('Somebody\\away') == 'somebody'
+
+    def test_strict_rfc1459(self):
+        normalize = NickNormalizer('strict-rfc1459')
+
+        assert normalize('Some[Body]') == 'some{body}'
+        assert normalize('some~body') == 'some~body'
+
+    def test_unknown_casemapping(self):
+        try:
+            NickNormalizer('ebcdic')
+        except ValueError:
+            pass
+        else:
+            assert False, 'Expected ValueError'
+
+    def test_memoised(self):
+        normalize = NickNormalizer('rfc1459')
+        normalize('SomeBody')
+        normalize('SomeBody')
+
+        assert normalize.stats()['hits'] == 1
+        assert normalize.stats()['size'] == 1
+
+    def test_idempotent(self):
+        normalize = NickNormalizer('rfc1459')
+
+        for nick in ['Some[Body]', 'a\\b|c', 'x++|y', 'Nick~:']:
+            assert normalize(normalize(nick)) == normalize(nick)
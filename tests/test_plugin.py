@@ -20,31 +20,172 @@ class TestKarmaPlugin(object):
         ret = self.plugin.give('foo', ['foo'])
         assert ret == "Uhh, do you want a gold star, foo?"
 
+    def test_give_handles_arrogance_with_suffix(self):
+        ret = self.plugin.give('foo|away', ['bar', 'foo++'])
+        assert ret == "Uhh, do you want a gold star, foo|away?"
+
     def test_give(self):
         with mock.patch.object(self.plugin, 'KarmaRecord') as db:
             from_user = mock.Mock()
             to_user = mock.Mock()
-            db.get_for_nick.side_effect = [from_user, to_user]
+            db.get_for_nicks.return_value = [from_user, to_user]
 
             self.plugin.give('foo', ['bar'])
 
-            from_user.give_karma_to.assert_called_with(to_user)
+            db.get_for_nicks.assert_called_with(['foo', 'bar'])
+            from_user.give_karma_to_many.assert_called_with([to_user])
+
+    def test_give_flood_protection(self):
+        from helga_karma.ratelimit import FloodProtection, TokenBuckets
+        protection = FloodProtection(givers=TokenBuckets(1, 0.001))
+
+        with mock.patch.object(self.plugin, 'flood_protection', protection):
+            with mock.patch.object(self.plugin, 'KarmaRecord') as db:
+                from_user = mock.Mock()
+                to_user = mock.Mock()
+                db.get_for_nicks.return_value = [from_user, to_user]
+
+                self.plugin.give('foo', ['bar', 'baz'])
+                db.get_for_nicks.assert_called_with(['foo', 'bar'])
+
+                db.get_for_nicks.reset_mock()
+                assert self.plugin.give('foo', ['bar']) is None
+                assert not db.get_for_nicks.called
 
     def test_top(self):
         with mock.patch.object(self.plugin, 'KarmaRecord') as db:
-            getitem = lambda s, k: getattr(s, k)
-            users = [
-                mock.Mock(nick='foo', get_value=lambda: 1, __getitem__=getitem),
-                mock.Mock(nick='bar', get_value=lambda: 2, __getitem__=getitem),
-                mock.Mock(nick='baz', get_value=lambda: 3, __getitem__=getitem),
-            ]
+            users = [{'nick': 'foo'}, {'nick': 'bar'}, {'nick': 'baz'}]
             db.get_top.return_value = users
+            db.get_values.return_value = [1, 2, 3]
             ret = self.plugin.top()
 
             assert ret[0] == '#1: foo (1.0 karma)'
             assert ret[1] == '#2: bar (2.0 karma)'
             assert ret[2] == '#3: baz (3.0 karma)'
 
+    @mock.patch('helga_karma.plugin.settings')
+    def test_top_window(self, settings):
+        settings.KARMA_WINDOWED_TOP = True
+        settings.KARMA_MESSAGE_OVERRIDES = {}
+        settings.KARMA_VALUE_NAME = 'karma'
+        with mock.patch.object(self.plugin, 'KarmaRecord') as db:
+            db.get_top.return_value = [{'nick': 'foo', 'value': 2.5}]
+            ret = self.plugin._handle_command(
+                None, '#bots', 'me', '!k top week 3', 'k',
+                ['top', 'week', '3'],
+            )
+
+            db.get_top.assert_called_with(3, window='week')
+            assert not db.get_values.called
+            assert ret == ['#1: foo (2.5 karma)']
+
+    @mock.patch('helga_karma.plugin.settings')
+    def test_top_window_disabled(self, settings):
+        settings.KARMA_WINDOWED_TOP = False
+        settings.KARMA_MESSAGE_OVERRIDES = {}
+        settings.KARMA_VALUE_NAME = 'karma'
+        with mock.patch.object(self.plugin, 'KarmaRecord') as db:
+            ret = self.plugin.top(window='week', requested_by='me')
+
+            assert not db.get_top.called
+            assert ret == "I'm not keeping track of karma over time, me."
+
+    @mock.patch('helga_karma.plugin.settings')
+    def test_top_global(self, settings):
+        from helga_karma.channels import get_channel
+        settings.KARMA_CHANNEL_SCOPED = True
+        settings.KARMA_ASYNC = False
+        channels = []
+        with mock.patch.object(self.plugin, 'top') as top:
+            top.side_effect = lambda *args, **kwargs: channels.append(
+                get_channel()
+            )
+            self.plugin.karma(
+                None, '#bots', 'me', '!k top', 'k', ['top'],
+            )
+            self.plugin.karma(
+                None, '#bots', 'me', '!k top global 5', 'k',
+                ['top', 'global', '5'],
+            )
+            top.assert_called_with(5, window=None, requested_by='me')
+
+        assert channels == ['#bots', None]
+
+    @mock.patch('helga_karma.plugin.settings')
+    def test_karma_service(self, settings):
+        from helga.plugins import ResponseNotReady
+        from twisted.internet import defer
+        settings.KARMA_ASYNC = False
+        client = mock.Mock()
+        service_client = mock.Mock()
+        service_client.request.return_value = '#1: foo (1.0 karma)'
+        with mock.patch.object(self.plugin, 'service_client', service_client):
+            with mock.patch.object(self.plugin, 'thread_pool') as pool:
+                pool.run.side_effect = (
+                    lambda fn, *args: defer.succeed(fn(*args))
+                )
+                with mock.patch.object(self.plugin, 'KarmaRecord') as db:
+                    try:
+                        self.plugin.karma(
+                            client, '#bots', 'me', '!k top 1', 'k',
+                            ['top', '1'],
+                        )
+                    except ResponseNotReady:
+                        pass
+                    else:
+                        assert False, 'Expected ResponseNotReady'
+
+                    assert not db.get_top.called
+        service_client.request.assert_called_with(
+            '#bots', 'me', '!k top 1', 'k', ['top', '1'],
+        )
+        client.msg.assert_called_with('#bots', '#1: foo (1.0 karma)')
+
+    @mock.patch('helga_karma.plugin.settings')
+    def test_resolve_request_nicks(self, settings):
+        from helga_karma.channels import get_channel
+        settings.KARMA_CHANNEL_SCOPED = True
+        resolved = {
+            '#bots': {'foo': 'bar'},
+            None: {'bar': 'baz'},
+        }
+        with mock.patch.object(self.plugin, 'KarmaRecord') as db:
+            db.get_actual_nicks.side_effect = lambda nicks: [
+                resolved[get_channel()].get(nick, nick) for nick in nicks
+            ]
+            nicks = self.plugin.resolve_request_nicks('#bots', ['me', 'foo'])
+            assert nicks == ['me', 'bar', 'me', 'baz']
+
+            settings.KARMA_CHANNEL_SCOPED = False
+            nicks = self.plugin.resolve_request_nicks('#bots', ['bar'])
+            assert nicks == ['baz']
+
+    @mock.patch('helga_karma.plugin.settings')
+    def test_get_namespace(self, settings):
+        settings.KARMA_CHANNEL_SCOPED = False
+        assert self.plugin._get_namespace('#bots') is None
+
+        settings.KARMA_CHANNEL_SCOPED = True
+        assert self.plugin._get_namespace('#bots') == '#bots'
+        assert self.plugin._get_namespace('&local') == '&local'
+        # Private messages
+        assert self.plugin._get_namespace('me') is None
+
+    @mock.patch('helga_karma.plugin.settings')
+    def test_karma_top_ignores_other_words(self, settings):
+        settings.KARMA_ASYNC = False
+        with mock.patch.object(self.plugin, 'top') as top:
+            self.plugin.karma(
+                None, '#bots', 'me', '!k top foo', 'k', ['top', 'foo'],
+            )
+            top.assert_called_with(10, window=None, requested_by='me')
+
+    def test_top_window_unknown(self):
+        ret = self.plugin.top(window='year', requested_by='me')
+        assert ret == (
+            'I can only rank karma over the last day, week or month, me.'
+        )
+
     def test_info_no_previous_karma(self):
         with mock.patch.object(self.plugin, 'KarmaRecord') as db:
             record = mock.Mock()
@@ -157,6 +298,122 @@ class TestKarmaPlugin(object):
 
             user2.remove_alias.assert_called_with('bar')
 
+    @mock.patch('helga_karma.plugin.data', mock.Mock(loaded=False))
+    def test_stats_none(self):
+        with mock.patch.object(self.plugin, 'instrumentation') as stats:
+            stats.format_stats.return_value = []
+
+            retval = self.plugin._handle_command(
+                None, '#bots', 'me', '!k stats', 'k', ['stats'],
+            )
+            assert retval == 'No karma operations have been recorded yet.'
+
+    @mock.patch('helga_karma.plugin.data', mock.Mock(loaded=False))
+    def test_stats(self):
+        with mock.patch.object(self.plugin, 'instrumentation') as stats:
+            stats.format_stats.return_value = ['give: 1 ops']
+
+            retval = self.plugin._handle_command(
+                None, '#bots', 'me', '!k stats', 'k', ['stats'],
+            )
+            assert retval == ['give: 1 ops']
+
+    def test_stats_write_behind(self):
+        data = mock.Mock(loaded=True)
+        data.KarmaRecord.get_cache_stats.return_value = {}
+        data.write_behind.stats.return_value = {
+            'depth': 3,
+            'queued': 10,
+            'overflowed': 1,
+            'flushes': 2,
+            'flushed': 6,
+            'failures': 0,
+            'last_flush_latency': 0.0015,
+            'max_flush_latency': 0.004,
+        }
+        with mock.patch.object(self.plugin, 'instrumentation') as stats:
+            stats.format_stats.return_value = []
+            with mock.patch.object(self.plugin, 'data', data):
+                retval = self.plugin._handle_command(
+                    None, '#bots', 'me', '!k stats', 'k', ['stats'],
+                )
+        assert retval == [
+            'write-behind: 3 waiting, 6 written in 2 flushes (last 1.5ms, '
+            'max 4.0ms), 1 written directly, 0 failed',
+        ]
+
+    def test_stats_caches(self):
+        data = mock.Mock(loaded=True, write_behind=None)
+        data.KarmaRecord.get_cache_stats.return_value = {
+            'record': {
+                'size': 2,
+                'memory': 2048,
+                'hits': 3,
+                'misses': 1,
+                'hit_ratio': 0.75,
+            },
+            'alias': {
+                'size': 0,
+                'memory': 256,
+                'hits': 0,
+                'misses': 0,
+                'hit_ratio': 0.0,
+            },
+        }
+        with mock.patch.object(self.plugin, 'instrumentation') as stats:
+            stats.format_stats.return_value = []
+            with mock.patch.object(self.plugin, 'data', data):
+                retval = self.plugin._handle_command(
+                    None, '#bots', 'me', '!k stats', 'k', ['stats'],
+                )
+        assert retval == [
+            'alias cache: 0% hit ratio (0 hits, 0 misses), 0 entries in '
+            '0.2KiB',
+            'record cache: 75% hit ratio (3 hits, 1 misses), 2 entries in '
+            '2.0KiB',
+        ]
+
+    @mock.patch('helga_karma.plugin.settings')
+    def test_karma_async(self, settings):
+        from helga.plugins import ResponseNotReady
+        from twisted.internet import defer
+
+        settings.KARMA_ASYNC = True
+        client = mock.Mock()
+        with mock.patch.object(self.plugin, 'thread_pool') as pool:
+            with mock.patch.object(self.plugin, 'top') as top:
+                top.return_value = ['#1: foo (1.0 karma)']
+                pool.run.side_effect = (
+                    lambda fn, *args: defer.succeed(fn(*args))
+                )
+                try:
+                    self.plugin.karma(
+                        client, '#bots', 'me', '!k top 1', 'k', ['top', '1'],
+                    )
+                except ResponseNotReady:
+                    pass
+                else:
+                    assert False, 'Expected ResponseNotReady'
+
+        top.assert_called_with(1, window=None, requested_by='me')
+        client.msg.assert_called_with('#bots', '#1: foo (1.0 karma)')
+
+    @mock.patch('helga_karma.plugin.settings')
+    def test_karma_async_no_response(self, settings):
+        from helga.plugins import ResponseNotReady
+        from twisted.internet import defer
+
+        settings.KARMA_ASYNC = True
+        client = mock.Mock()
+        with mock.patch.object(self.plugin, 'thread_pool') as pool:
+            pool.run.return_value = defer.succeed(None)
+            try:
+                self.plugin.karma(client, '#bots', 'me', 'thanks foo', ['foo'])
+            except ResponseNotReady:
+                pass
+
+        assert not client.msg.called
+
     @mock.patch('helga_karma.plugin.settings')
     def test_message_not_overridden(self, settings):
         overridden_message = 'info_standard'
@@ -196,6 +453,28 @@ class TestKarmaPlugin(object):
 
         assert not matcher('i appreciate it helga')
 
+    @mock.patch('helga_karma.plugin.settings')
+    def test_autokarma_match_follows_settings(self, settings):
+        matcher = self.plugin._autokarma_match
+
+        settings.KARMA_THANKS_WORDS = ['cheers']
+        settings.KARMA_INVALID_THANKS = ['for']
+        assert ['helga'] == matcher('cheers helga')
+        assert not matcher('thanks helga')
+
+        settings.KARMA_THANKS_WORDS = ['thanks']
+        assert ['helga'] == matcher('thanks helga')
+
+    def test_autokarma_match_precheck_skips_patterns(self):
+        matcher = self.plugin.AutokarmaMatcher()
+        matcher('warming up')
+
+        with mock.patch.object(matcher, '_pattern') as pattern:
+            with mock.patch.object(matcher, '_skip_pattern') as skip_pattern:
+                assert matcher('nothing to see here') == []
+                assert not pattern.findall.called
+                assert not skip_pattern.findall.called
+
 
 class TestPlusPlusSupport(TestKarmaPlugin):
 
@@ -0,0 +1,88 @@
+from helga_karma.ratelimit import FloodProtection, TokenBuckets
+
+from tests import FakeTimer
+
+
+class TestTokenBuckets(object):
+
+    def setup(self):
+        self.timer = FakeTimer()
+        self.buckets = TokenBuckets(2, 0.5, timer=self.timer)
+
+    def test_take(self):
+        assert self.buckets.take('alpha')
+        assert self.buckets.take('alpha')
+        assert not self.buckets.take('alpha')
+        assert self.buckets.take('beta')
+
+    def test_refills(self):
+        self.buckets.take('alpha')
+        self.buckets.take('alpha')
+
+        self.timer.now = 1
+        assert self.buckets.available('alpha') == 0.5
+        assert not self.buckets.take('alpha')
+        self.timer.now = 2
+        assert self.buckets.take('alpha')
+
+    def test_full_buckets_are_dropped(self):
+        self.buckets.take('alpha')
+        self.buckets.take('beta')
+        assert len(self.buckets) == 2
+
+        self.timer.now = 2
+        self.buckets.take('gamma')
+        assert len(self.buckets) == 1
+        assert self.buckets.available('alpha') == 2
+
+    def test_maxsize(self):
+        buckets = TokenBuckets(1, 0.001, maxsize=2, timer=self.timer)
+        for nick in ['alpha', 'beta', 'gamma']:
+            buckets.take(nick)
+
+        assert len(buckets) == 2
+        # Forgotten, so full again
+        assert buckets.take('alpha')
+        assert not buckets.take('gamma')
+
+
+class TestFloodProtection(object):
+
+    def setup(self):
+        self.timer = FakeTimer()
+
+    def _buckets(self, capacity):
+        return TokenBuckets(capacity, 0.1, timer=self.timer)
+
+    def test_disabled(self):
+        protection = FloodProtection()
+        assert protection.filter('me', ['foo', 'foo']) == ['foo', 'foo']
+
+    def test_giver_limit(self):
+        protection = FloodProtection(
+            givers=self._buckets(2),
+            timer=self.timer,
+        )
+
+        assert protection.filter('me', ['foo', 'bar', 'baz']) == [
+            'foo', 'bar',
+        ]
+        assert protection.filter('me', ['foo']) == []
+        assert protection.filter('you', ['foo']) == ['foo']
+        assert protection.stats()['rejected'] == 2
+
+    def test_pair_limit(self):
+        protection = FloodProtection(
+            givers=self._buckets(3),
+            pairs=self._buckets(1),
+            normalize=lambda nick: nick.lower(),
+            timer=self.timer,
+        )
+
+        assert protection.filter('me', ['foo', 'FOO', 'bar']) == [
+            'foo', 'bar',
+        ]
+        assert protection.filter('ME', ['foo']) == []
+        # Only thanks that were allowed count against the giver
+        assert protection.filter('me', ['baz']) == ['baz']
+        assert protection.filter('me', ['qux']) == []
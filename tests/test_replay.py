@@ -0,0 +1,120 @@
+import datetime
+
+
+class TestReplay(object):
+
+    def setup(self):
+        from helga_karma.backends import MemoryBackend
+        from helga_karma import replay
+
+        self.replay = replay
+        self.backend = MemoryBackend()
+        self.start = datetime.datetime(2020, 1, 1)
+
+    def _time(self, seconds):
+        return self.start + datetime.timedelta(seconds=seconds)
+
+    def _give(self, seconds, giver, receiver, value=1.0):
+        return {
+            'type': 'give',
+            'giver': giver,
+            'receiver': receiver,
+            'value': value,
+            'time': self._time(seconds),
+        }
+
+    def test_give(self):
+        result = self.replay.Replay()
+        result.fold([
+            self._give(1, 'alpha', 'beta', 2.0),
+            self._give(2, 'alpha', 'beta', 0.5),
+        ])
+
+        alpha = result.totals['alpha']
+        beta = result.totals['beta']
+        assert alpha['given'] == 2
+        assert alpha['last_given'] == self._time(2)
+        assert alpha['created'] == self._time(1)
+        assert beta['value'] == 2.5
+        assert beta['received'] == 2
+        assert beta['last_received'] == self._time(2)
+        assert result.events == 2
+
+    def test_give_last_received(self):
+        event = self._give(1, 'alpha', 'beta')
+        event['last_received'] = self._time(3601)
+        result = self.replay.Replay()
+        result.fold([event])
+
+        assert result.totals['alpha']['last_given'] == self._time(1)
+        assert result.totals['beta']['last_received'] == self._time(3601)
+
+    def test_merge_and_split(self):
+        result = self.replay.Replay([
+            {'nick': 'alpha', 'given': 0, 'received': 3, 'value': 3.0},
+        ])
+        result.fold([
+            self._give(1, 'gamma', 'beta', 2.0),
+            {'type': 'merge', 'nick': 'alpha', 'alias': 'beta',
+             'time': self._time(2)},
+        ])
+
+        assert 'beta' not in result.totals
+        assert result.removed == set(['beta'])
+        assert result.totals['alpha']['value'] == 5.0
+        assert result.totals['alpha']['last_received'] == self._time(1)
+
+        result.fold([
+            self._give(3, 'gamma', 'alpha', 1.0),
+            {'type': 'split', 'nick': 'alpha', 'alias': 'beta',
+             'record': {'nick': 'beta', 'given': 0, 'received': 1,
+                        'value': 2.0},
+             'time': self._time(4)},
+        ])
+
+        assert result.removed == set()
+        assert result.totals['alpha']['value'] == 4.0
+        assert result.totals['alpha']['received'] == 4
+        assert result.totals['beta']['value'] == 2.0
+
+    def test_rebuild_from_snapshot(self):
+        self.backend.save_users([
+            {'nick': 'alpha', 'given': 0, 'received': 1, 'value': 1.0},
+            {'nick': 'untouched', 'given': 0, 'received': 0, 'value': 7.0},
+        ])
+        self.backend.insert_events([self._give(-10, 'beta', 'alpha')])
+        time = self.replay.take_snapshot(self.backend, self._time(0))
+        self.backend.insert_events([
+            self._give(1, 'beta', 'alpha', 2.0),
+            self._give(2, 'beta', 'gamma', 1.0),
+            {'type': 'merge', 'nick': 'alpha', 'alias': 'gamma',
+             'time': self._time(3)},
+        ])
+        # Corrupt what is stored; the rebuild should put it right
+        self.backend.save_users([
+            {'nick': 'alpha', 'given': 0, 'received': 0, 'value': 100.0},
+            {'nick': 'gamma', 'given': 0, 'received': 0, 'value': 100.0},
+            {'nick': 'untouched', 'given': 0, 'received': 0, 'value': 9.0},
+            {'nick': 'newcomer', 'given': 0, 'received': 0, 'value': 5.0},
+        ])
+
+        result = self.replay.rebuild(self.backend, batch_size=2)
+
+        assert time == self._time(0)
+        assert result.events == 3
+        users = dict(
+            (user['nick'], user) for user in self.backend.iter_users()
+        )
+        assert users['alpha']['value'] == 4.0
+        assert users['alpha']['received'] == 3
+        assert users['beta']['given'] == 2
+        assert 'gamma' not in users
+        assert users['untouched']['value'] == 7.0
+        # Users in neither the snapshot nor the log are left alone
+        assert users['newcomer']['value'] == 5.0
+
+    def test_snapshot_time_is_next_millisecond(self):
+        time = self.replay.get_snapshot_time(
+            datetime.datetime(2020, 1, 1, 0, 0, 0, 123456)
+        )
+        assert time.microsecond == 124000
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import mock
+
+from helga_karma.service import (
+    KarmaService,
+    ServiceClient,
+    ServiceError,
+    ShardLocks,
+    get_request_nicks,
+)
+
+
+class TestShardLocks(object):
+
+    def test_locked(self):
+        locks = ShardLocks(4)
+        with locks.locked(['alpha', 'beta', 'alpha']):
+            for shard in locks.get_shards(['alpha', 'beta']):
+                assert locks._locks[shard].locked()
+        assert not any(lock.locked() for lock in locks._locks)
+
+    def test_get_request_nicks(self):
+        assert get_request_nicks('me', ['k', ['foo,', 'bar']]) == [
+            'me', 'k', 'foo', 'bar',
+        ]
+        assert get_request_nicks('me', [['foo++']]) == ['me', 'foo']
+
+
+class TestKarmaService(object):
+
+    def setup(self):
+        self.handler = mock.Mock(return_value='You\'re doing good work, foo!')
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'karma.sock')
+        self.aliases = {'foo': 'bar'}
+        self.service = KarmaService(
+            self.path,
+            self.handler,
+            resolve=lambda channel, nicks: [
+                self.aliases.get(nick.lower(), nick.lower())
+                for nick in nicks
+            ],
+        )
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_handle(self):
+        response = self.service.handle(['#bots', 'me', 'foo++', [['foo']]])
+
+        assert response == [None, 'You\'re doing good work, foo!']
+        self.handler.assert_called_with('#bots', 'me', 'foo++', ['foo'])
+
+    def test_handle_locks_resolved_nicks(self):
+        locked = []
+        self.handler.side_effect = lambda *args: locked.extend(
+            lock.locked() for lock in self.service.locks._locks
+        )
+
+        self.service.handle(['#bots', 'bar', 'Foo++', [['Foo']]])
+
+        assert locked == [
+            shard in self.service.locks.get_shards(['bar'])
+            for shard in range(len(self.service.locks._locks))
+        ]
+
+    def test_handle_error(self):
+        self.handler.side_effect = ValueError('broken')
+
+        assert self.service.handle(['#bots', 'me', '!k', ['k', []]]) == [
+            'broken', None,
+        ]
+        assert self.service.stats()['errors'] == 1
+
+    def test_client(self):
+        thread = threading.Thread(target=self.service.serve_forever)
+        thread.start()
+        try:
+            deadline = time.time() + 5
+            while not os.path.exists(self.path):
+                assert time.time() < deadline, 'The service never started'
+                time.sleep(0.01)
+            client = ServiceClient(self.path, timeout=5)
+
+            assert client.request('#bots', 'me', '!k top', 'k', ['top']) == (
+                'You\'re doing good work, foo!'
+            )
+            self.handler.assert_called_with(
+                '#bots', 'me', '!k top', 'k', ['top'],
+            )
+
+            self.handler.side_effect = ValueError('broken')
+            try:
+                client.request('#bots', 'me', 'foo++', ['foo'])
+            except ServiceError as error:
+                assert str(error) == 'broken'
+            else:
+                assert False, 'Expected ServiceError'
+            client.close()
+        finally:
+            self.service.shutdown()
+            thread.join()
+
+        assert not os.path.exists(self.path)
+
+    def test_client_unreachable(self):
+        client = ServiceClient(self.path, timeout=1)
+        try:
+            client.request('#bots', 'me', 'foo++', ['foo'])
+        except ServiceError:
+            pass
+        else:
+            assert False, 'Expected ServiceError'
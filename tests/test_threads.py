@@ -0,0 +1,67 @@
+import threading
+
+from helga_karma.threads import KarmaThreadPool
+
+
+class FakeReactor(object):
+    def __init__(self):
+        self.triggers = []
+
+    def callFromThread(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+    def addSystemEventTrigger(self, phase, event, fn):
+        self.triggers.append((phase, event, fn))
+
+
+class TestKarmaThreadPool(object):
+
+    def setup(self):
+        self.reactor = FakeReactor()
+        self.pool = KarmaThreadPool(size=2, reactor=self.reactor)
+
+    def teardown(self):
+        self.pool.stop()
+
+    def run(self, fn, *args, **kwargs):
+        done = threading.Event()
+        results = []
+
+        deferred = self.pool.run(fn, *args, **kwargs)
+        deferred.addBoth(results.append)
+        deferred.addBoth(lambda _: done.set())
+        done.wait(5)
+        return results[0]
+
+    def test_not_started_until_used(self):
+        assert self.pool._pool is None
+        assert self.reactor.triggers == []
+
+    def test_runs_off_the_calling_thread(self):
+        result = self.run(lambda x: (x, threading.current_thread()), x=1)
+
+        assert result[0] == 1
+        assert result[1] is not threading.current_thread()
+
+    def test_reports_failures(self):
+        def fail():
+            raise ValueError('nope')
+
+        failure = self.run(fail)
+
+        assert failure.check(ValueError)
+
+    def test_stops_with_reactor(self):
+        self.run(lambda: None)
+
+        assert len(self.reactor.triggers) == 1
+        phase, event, stop = self.reactor.triggers[0]
+        assert (phase, event) == ('during', 'shutdown')
+
+        stop()
+        assert self.pool._pool is None
+
+    def test_bounded(self):
+        self.run(lambda: None)
+
+        assert self.pool._pool.max == 2
@@ -0,0 +1,87 @@
+import datetime
+import gzip
+import io
+
+from helga_karma.backends import MemoryBackend, SQLiteBackend
+from helga_karma.transfer import export_karma, import_karma
+
+
+class TestTransfer(object):
+
+    def setup(self):
+        self.source = MemoryBackend()
+        self.created = datetime.datetime(2015, 1, 2, 3, 4, 5, 6)
+        self.source.save_users([
+            {
+                'nick': 'user%d' % idx,
+                'value': idx,
+                'given': 1,
+                'received': 2,
+                'created': self.created,
+                'last_given': None,
+            }
+            for idx in range(25)
+        ])
+        self.source.insert_link({
+            'nick': 'user1_away',
+            'real_nick': 'user1',
+            'record': {'nick': 'user1_away', 'value': 0},
+            'aliases': [],
+        })
+
+    def export(self):
+        out = io.BytesIO()
+        counts = export_karma(self.source, out)
+        assert counts == {'karma_user': 25, 'karma_link': 1}
+        return out.getvalue()
+
+    def test_round_trip(self):
+        destination = SQLiteBackend(':memory:')
+
+        counts = import_karma(
+            destination,
+            io.BytesIO(self.export()),
+            batch_size=10,
+        )
+
+        assert counts == {'karma_user': 25, 'karma_link': 1}
+        user = destination.find_users(['user3'])[0]
+        assert user['value'] == 3
+        assert user['created'] == self.created
+        assert user['last_given'] is None
+        assert destination.find_link('user1_away')['real_nick'] == 'user1'
+
+    def test_batches(self):
+        destination = MemoryBackend()
+        batches = []
+        save_users = destination.save_users
+
+        def counting_save_users(records):
+            batches.append(len(records))
+            save_users(records)
+        destination.save_users = counting_save_users
+
+        import_karma(destination, io.BytesIO(self.export()), batch_size=10)
+
+        assert batches == [10, 10, 5]
+
+    def test_gzip(self):
+        compressed = io.BytesIO()
+        with gzip.GzipFile(fileobj=compressed, mode='wb') as out:
+            export_karma(self.source, out)
+        compressed.seek(0)
+        destination = MemoryBackend()
+
+        with gzip.GzipFile(fileobj=compressed, mode='rb') as in_:
+            counts = import_karma(destination, in_)
+
+        assert counts == {'karma_user': 25, 'karma_link': 1}
+
+    def test_unknown_collection(self):
+        lines = [b'\n', b'{"collection": "karma_nope", "document": {}}\n']
+        try:
+            import_karma(MemoryBackend(), lines)
+        except ValueError as e:
+            assert 'line 2' in str(e)
+        else:
+            assert False, 'Expected ValueError'
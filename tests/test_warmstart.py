@@ -0,0 +1,73 @@
+import datetime
+import os
+import shutil
+import tempfile
+
+from helga_karma import warmstart
+
+
+class TestWarmStart(object):
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'karma.warm')
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_and_load(self):
+        saved = datetime.datetime(2020, 1, 1, 12, 30)
+        created = datetime.datetime(2019, 6, 1)
+        warmstart.save(self.path, {
+            None: {
+                'aliases': [('beta', 'alpha')],
+                'records': [('alpha', {'nick': 'alpha', 'created': created})],
+                'top': [{'nick': 'alpha', 'value': 10}],
+                'complete': True,
+            },
+            '#bots': {
+                'aliases': [],
+                'records': [],
+                'top': [],
+                'complete': False,
+            },
+        }, saved=saved)
+
+        snapshot = warmstart.load(self.path)
+        try:
+            assert snapshot.saved == saved
+            assert set(snapshot.channels()) == set([None, '#bots'])
+            section = snapshot.get(None)
+            assert section['aliases'] == [['beta', 'alpha']]
+            assert section['records'][0][1]['created'] == created
+            assert section['complete']
+            assert snapshot.get('#bots')['top'] == []
+            assert snapshot.get('#other') is None
+        finally:
+            snapshot.close()
+        assert os.listdir(self.directory) == ['karma.warm']
+
+    def test_load_missing(self):
+        assert warmstart.load(self.path) is None
+
+    def test_load_invalid(self):
+        with open(self.path, 'wb') as out:
+            out.write(b'not a warm-start file')
+
+        assert warmstart.load(self.path) is None
+
+    def test_periodic_save(self):
+        calls = []
+        saves = warmstart.PeriodicSave(lambda: calls.append(1), interval=60)
+        saves.start()
+        saves.stop()
+
+        assert calls == [1]
+
+    def test_periodic_save_stop_without_saving(self):
+        calls = []
+        saves = warmstart.PeriodicSave(lambda: calls.append(1), interval=60)
+        saves.start()
+        saves.stop(final=False)
+
+        assert calls == []
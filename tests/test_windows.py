@@ -0,0 +1,38 @@
+import datetime
+
+from helga_karma import windows
+
+
+class TestWindows(object):
+
+    def test_get_increments(self):
+        time = datetime.datetime(2020, 1, 2, 15, 30, 10)
+        day, hour = windows.get_increments('alpha', 1.5, time)
+
+        assert hour['granularity'] == 'hour'
+        assert hour['start'] == datetime.datetime(2020, 1, 2, 15)
+        assert hour['expires'] == datetime.datetime(2020, 1, 3, 15)
+        assert day['granularity'] == 'day'
+        assert day['start'] == datetime.datetime(2020, 1, 2)
+        assert day['expires'] == datetime.datetime(2020, 2, 1)
+        assert day['value'] == 1.5
+        assert day['received'] == 1
+
+    def test_get_window(self):
+        now = datetime.datetime(2020, 1, 31, 15, 30)
+
+        assert windows.get_window('day', now) == (
+            'hour', datetime.datetime(2020, 1, 30, 16),
+        )
+        assert windows.get_window('week', now) == (
+            'day', datetime.datetime(2020, 1, 25),
+        )
+        assert windows.get_window('month', now) == (
+            'day', datetime.datetime(2020, 1, 2),
+        )
+
+    def test_buckets_outlive_their_windows(self):
+        now = datetime.datetime(2020, 1, 31, 15, 30)
+        for window in windows.WINDOWS:
+            granularity, since = windows.get_window(window, now)
+            assert since + windows.RETENTION[granularity] > now
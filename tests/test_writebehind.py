@@ -0,0 +1,175 @@
+import threading
+import time
+
+import mock
+from pymongo.errors import PyMongoError
+
+
+class TestWriteBehindQueue(object):
+
+    def setup(self):
+        from helga_karma.data import _merge_update
+        from helga_karma.writebehind import WriteBehindQueue
+
+        self.written = []
+        self.writer = mock.Mock(side_effect=self.written.extend)
+        self.queue = WriteBehindQueue(self.writer, _merge_update)
+
+    def test_merges_updates_per_nick(self):
+        self.queue.put('alpha', {'$inc': {'value': 1, 'received': 1}})
+        self.queue.put('beta', {'$inc': {'given': 1}})
+        self.queue.put('alpha', {'$inc': {'value': 2, 'received': 1}})
+
+        self.queue.flush()
+
+        assert self.written == [
+            ('alpha', {'$inc': {'value': 3, 'received': 2}}),
+            ('beta', {'$inc': {'given': 1}}),
+        ]
+
+    def test_coalesces_within_window(self):
+        from helga_karma.data import _merge_update
+        from helga_karma.writebehind import WriteBehindQueue
+
+        flushed = threading.Event()
+
+        def writer(batch):
+            self.written.extend(batch)
+            flushed.set()
+
+        queue = WriteBehindQueue(writer, _merge_update, window=0.1)
+        queue.start()
+        for _ in range(10):
+            queue.put('alpha', {'$inc': {'value': 1}})
+
+        assert flushed.wait(5)
+        queue.stop()
+
+        assert self.written == [('alpha', {'$inc': {'value': 10}})]
+
+    def test_worker_survives_flush_during_window(self):
+        from helga_karma.data import _merge_update
+        from helga_karma.writebehind import WriteBehindQueue
+
+        flushed = threading.Event()
+
+        def writer(batch):
+            self.written.extend(batch)
+            flushed.set()
+
+        queue = WriteBehindQueue(writer, _merge_update, window=0.5)
+        queue.start()
+        queue.put('alpha', {'$inc': {'value': 1}})
+        # Flush while the worker waits out the window, and let it see
+        # that nothing is left
+        time.sleep(0.1)
+        queue.flush()
+        flushed.clear()
+        time.sleep(0.1)
+
+        queue.put('beta', {'$inc': {'value': 1}})
+        assert flushed.wait(5)
+        queue.stop()
+
+        assert [nick for nick, _ in self.written] == ['alpha', 'beta']
+
+    def test_pending(self):
+        self.queue.put('alpha', {'$inc': {'value': 1}})
+        self.queue.put('alpha', {'$inc': {'value': 1}})
+
+        assert self.queue.pending('alpha') == {'$inc': {'value': 2}}
+        assert self.queue.pending('beta') is None
+
+        self.queue.flush()
+        assert self.queue.pending('alpha') is None
+
+    def test_pending_excludes_update_being_written(self):
+        seen = []
+
+        def writer(batch):
+            self.written.extend(batch)
+            seen.append(self.queue.pending('alpha'))
+            self.queue.put('alpha', {'$inc': {'value': 5}})
+            seen.append(self.queue.pending('alpha'))
+
+        self.queue._writer = writer
+        self.queue.put('alpha', {'$inc': {'value': 1}})
+        self.queue.flush()
+
+        assert self.written == [('alpha', {'$inc': {'value': 1}})]
+        assert seen == [None, {'$inc': {'value': 5}}]
+        assert self.queue.pending('alpha') == {'$inc': {'value': 5}}
+
+    def test_flush_in_batches(self):
+        for nick in ['alpha', 'beta', 'gamma']:
+            self.queue.put(nick, {'$inc': {'value': 1}})
+
+        self.queue.flush(limit=2)
+
+        assert self.writer.call_count == 1
+        assert [nick for nick, _ in self.written] == ['alpha', 'beta']
+        assert self.queue.stats()['depth'] == 1
+
+    def test_failed_flush_is_retried(self):
+        self.writer.side_effect = PyMongoError()
+        self.queue.put('alpha', {'$inc': {'value': 1}})
+
+        assert not self.queue.flush()
+        self.queue.put('alpha', {'$inc': {'value': 1}})
+        assert self.queue.pending('alpha') == {'$inc': {'value': 2}}
+
+        self.writer.side_effect = self.written.extend
+        assert self.queue.flush()
+        assert self.written == [('alpha', {'$inc': {'value': 2}})]
+        assert self.queue.stats()['failures'] == 1
+
+    def test_failed_group_is_put_back_alone(self):
+        from helga_karma.data import _merge_update
+        from helga_karma.writebehind import WriteBehindQueue
+
+        queue = WriteBehindQueue(
+            self.writer, _merge_update, group=lambda key: key[0],
+        )
+        queue.put(('#bots', 'alpha'), {'$inc': {'value': 1}})
+        queue.put(('#dev', 'alpha'), {'$inc': {'value': 2}})
+        queue.put(('#bots', 'beta'), {'$inc': {'value': 3}})
+        self.writer.side_effect = [None, PyMongoError()]
+
+        assert not queue.flush()
+        assert self.writer.call_args_list[0] == mock.call([
+            (('#bots', 'alpha'), {'$inc': {'value': 1}}),
+            (('#bots', 'beta'), {'$inc': {'value': 3}}),
+        ])
+        assert queue.pending(('#bots', 'alpha')) is None
+        assert queue.pending(('#dev', 'alpha')) == {'$inc': {'value': 2}}
+        assert queue.stats()['flushed'] == 2
+
+    def test_put_writes_directly_when_full(self):
+        self.queue.maxsize = 1
+        self.queue.put('alpha', {'$inc': {'value': 1}})
+        self.queue.put('alpha', {'$inc': {'value': 1}})
+        self.queue.put('beta', {'$inc': {'value': 1}})
+
+        assert self.written == [('beta', {'$inc': {'value': 1}})]
+        assert self.queue.pending('alpha') == {'$inc': {'value': 2}}
+        assert self.queue.stats()['overflowed'] == 1
+
+    def test_stop_flushes(self):
+        self.queue.start()
+        self.queue.put('alpha', {'$inc': {'value': 1}})
+
+        self.queue.stop()
+
+        assert self.written == [('alpha', {'$inc': {'value': 1}})]
+        assert self.queue.stats()['depth'] == 0
+
+    def test_stats(self):
+        self.queue.put('alpha', {'$inc': {'value': 1}})
+        self.queue.put('alpha', {'$inc': {'value': 1}})
+        self.queue.flush()
+
+        stats = self.queue.stats()
+        assert stats['queued'] == 2
+        assert stats['flushes'] == 1
+        assert stats['flushed'] == 1
+        assert stats['depth'] == 0